@@ -0,0 +1,103 @@
+import asyncio
+import collections
+import time
+import numpy as np
+
+# ------------------------------------------------------
+# Dynamic Micro-Batching
+# ------------------------------------------------------
+class MicroBatcher:
+    """Coalesces concurrent async calls into batched calls of a sync function.
+
+    Callers await submit(item). A single worker task collects queued items until
+    max_batch is reached or max_wait_ms has passed since the first one, runs
+    fn(items) -> results in an executor thread, and resolves each caller's
+    future with its own result.
+    """
+
+    def __init__(self, fn, max_batch=16, max_wait_ms=5, executor=None, latency_window=1000):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self._queue = None
+        self._worker = None
+        # Tuning metrics
+        self.batch_sizes = collections.Counter()
+        self.queue_depths = collections.Counter()
+        self.latencies = collections.deque(maxlen=latency_window)
+        self.requests = 0
+        self.batches = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        """Queue one item and wait for its result"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        """Wait for the first item, then gather more until the batch is full or the wait expires"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        self.queue_depths[self._queue.qsize()] += 1
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            self.requests += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, [item for item, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            for (_, future, queued_at), result in zip(batch, results):
+                self.latencies.append(now - queued_at)
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0,
+            "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+            "queue_depth_histogram": dict(sorted(self.queue_depths.items())),
+            "latency_ms": {
+                "p50": float(np.percentile(latencies, 50)) if len(latencies) else None,
+                "p99": float(np.percentile(latencies, 99)) if len(latencies) else None
+            }
+        }
@@ -0,0 +1,293 @@
+import argparse
+import io
+import os
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+
+from quantization import create_codec
+from search_index import FEATURE_DIM, create_index, top_k_rows
+
+# ------------------------------------------------------
+# Helpers
+# ------------------------------------------------------
+def synthetic_vectors(n, dim=FEATURE_DIM, n_clusters=1000, noise=0.35, seed=0):
+    """Clustered, L2-normalized vectors that roughly mimic product photo embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + noise * rng.normal(size=(n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def make_queries(vectors, n_queries, seed=1):
+    """Perturbed catalog vectors, standing in for new photos of known products"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=n_queries, replace=False)]
+    queries = sample + 0.5 / np.sqrt(vectors.shape[1]) * rng.normal(size=sample.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+# ------------------------------------------------------
+# Benchmarks
+# ------------------------------------------------------
+def bench_index(args):
+    """Query latency and recall@k of each search backend against exact search"""
+    print(f"Generating {args.n} synthetic vectors...")
+    vectors = synthetic_vectors(args.n)
+    image_ids = np.arange(len(vectors))
+    product_ids = image_ids // 4
+    queries = make_queries(vectors, args.queries)
+
+    exact = [image_ids[top_k_rows(vectors @ q, args.k)] for q in queries]
+
+    for backend in args.backends:
+        index = create_index(backend, nlist=args.nlist, nprobe=args.nprobe)
+        index.add(image_ids, product_ids, vectors)
+        _, build_time = timed(index.train)
+
+        start = time.perf_counter()
+        found = [index.search(q, args.k)[0] for q in queries]
+        elapsed = time.perf_counter() - start
+
+        recall = np.mean([len(np.intersect1d(e, f)) / len(e) for e, f in zip(exact, found)])
+        print(f"{backend:>6}: build {build_time:7.2f}s | {1000 * elapsed / len(queries):7.2f} ms/query | recall@{args.k} {recall:.3f}")
+
+def bench_encoding(args):
+    """Memory, latency and recall@k of each vector encoding, with and without exact re-rank"""
+    print(f"Generating {args.n} synthetic vectors...")
+    vectors = synthetic_vectors(args.n)
+    queries = make_queries(vectors, args.queries)
+    exact = [top_k_rows(vectors @ q, args.k) for q in queries]
+    raw_bytes = vectors.nbytes
+
+    for encoding in args.encodings:
+        codec = create_codec(encoding, vectors.shape[1], pq_subspaces=args.pq_subspaces)
+        if not codec.trained:
+            sample = vectors[np.random.default_rng(2).choice(len(vectors), size=min(len(vectors), 65536), replace=False)]
+            _, train_time = timed(codec.train, sample)
+        else:
+            train_time = 0.0
+        codes, encode_time = timed(codec.encode, vectors)
+
+        start = time.perf_counter()
+        found = [top_k_rows(codec.scores(q, codes), max(args.k, args.rerank)) for q in queries]
+        elapsed = time.perf_counter() - start
+
+        recall = np.mean([len(np.intersect1d(e, f[:args.k])) / args.k for e, f in zip(exact, found)])
+        # Re-rank: re-score the shortlist with the exact vectors and keep the top k
+        reranked = [f[top_k_rows(vectors[f] @ q, args.k)] for f, q in zip(found, queries)]
+        rerank_recall = np.mean([len(np.intersect1d(e, r)) / args.k for e, r in zip(exact, reranked)])
+
+        print(f"{encoding:>8}: {codec.code_size:5d} B/vector | {codes.nbytes / 2**20:8.1f} MB ({raw_bytes / codes.nbytes:5.1f}x smaller) | "
+              f"train {train_time:6.1f}s encode {encode_time:6.1f}s | {1000 * elapsed / len(queries):7.2f} ms/query | "
+              f"recall@{args.k} {recall:.3f} | re-ranked top {args.rerank} {rerank_recall:.3f}")
+
+def bench_db_writes(args):
+    """Rows/s of the per-row DBManager write path against the bulk one, on a scratch database"""
+    from database import DBManager
+
+    vectors = synthetic_vectors(args.images, n_clusters=100)
+    n_products = max(1, args.images // args.images_per_product)
+    products = [(f"BENCH{i:06d}", f"product {i}", 9.9, "-") for i in range(n_products)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in ("row", "bulk"):
+            db = DBManager(os.path.join(tmp, f"{path}.db"))
+            start = time.perf_counter()
+            if path == "row":
+                pids = [db.add_product(*product) for product in products]
+                for i, vector in enumerate(vectors):
+                    db.add_product_image(pids[i % n_products], f"uploads/bench/{i}.jpg", vector)
+            else:
+                pids = []
+                for i in range(0, n_products, args.batch):
+                    pids += db.add_products_bulk(products[i:i + args.batch])
+                for i in range(0, len(vectors), args.batch):
+                    db.add_product_images_bulk([(pids[j % n_products], f"uploads/bench/{j}.jpg", vectors[j])
+                                                for j in range(i, min(len(vectors), i + args.batch))])
+            elapsed = time.perf_counter() - start
+            rows = n_products + len(vectors)
+            print(f"{path:>4}: {rows} rows in {elapsed:6.2f}s | {rows / elapsed:9.0f} rows/s")
+            db.close()
+
+# The LIKE scan get_logs used before the FTS index, for comparison
+LIKE_LOGS_QUERY = """SELECT id, user_id, username, action, details, created_at FROM logs
+    WHERE username LIKE ? OR action LIKE ? OR details LIKE ? ORDER BY created_at DESC LIMIT 20"""
+LIKE_LOGS_COUNT = "SELECT COUNT(*) FROM logs WHERE username LIKE ? OR action LIKE ? OR details LIKE ?"
+
+def bench_search(args):
+    """Log search latency of the LIKE scan against the FTS5 trigram index, on a scratch database"""
+    from database import DBManager
+
+    rng = np.random.default_rng(0)
+    actions = ["LOGIN", "CREATE_PRODUCT", "UPDATE_PRODUCT", "DELETE_PRODUCT", "UPLOAD_IMAGE", "BATCH_UPDATE"]
+    users = [f"user{i}" for i in range(50)]
+    now = time.time()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBManager(os.path.join(tmp, "search.db"))
+        start = time.perf_counter()
+        for first in range(0, args.logs, 10000):
+            rows = []
+            for i in range(first, min(args.logs, first + 10000)):
+                model = f"CS{rng.integers(0, args.logs // 10):06d}"
+                rows.append((1, users[i % len(users)], actions[i % len(actions)],
+                             f"Updated product {model} (ID: {i})", time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now - args.logs + i))))
+            with db.write() as cursor:
+                cursor.executemany("INSERT INTO logs (user_id, username, action, details, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+        elapsed = time.perf_counter() - start
+        print(f"Inserted {args.logs} logs (FTS kept in sync by triggers) in {elapsed:.1f}s | {args.logs / elapsed:.0f} rows/s")
+
+        conn = db.reader()
+        # Rare (one model), common (every sixth log) and too short for trigrams
+        for term in [f"CS{args.logs // 20:06d}", "DELETE_PRODUCT", "ID"]:
+            like = [f"%{term}%"] * 3
+            _, like_page = timed(lambda: conn.execute(LIKE_LOGS_QUERY, like).fetchall())
+            like_total, like_count = timed(lambda: conn.execute(LIKE_LOGS_COUNT, like).fetchone()[0])
+            _, fts_page = timed(db.get_logs, 20, 0, term)
+            fts_total, fts_count = timed(db.count_logs, term)
+            assert like_total == fts_total
+            print(f"{term!r:>18} ({fts_total} matches) | LIKE page {like_page * 1000:8.1f} ms count {like_count * 1000:8.1f} ms"
+                  f" | FTS page {fts_page * 1000:8.1f} ms count {fts_count * 1000:8.1f} ms")
+        db.close()
+
+def bench_paging(args):
+    """GET /products page latency at increasing depth, OFFSET against keyset cursors, on a scratch database"""
+    from database import DBManager, PRODUCT_SORTS, encode_cursor, order_clause
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBManager(os.path.join(tmp, "paging.db"))
+        for first in range(0, args.products, 10000):
+            db.add_products_bulk([(f"BENCH{i:07d}", f"product {i}", float(rng.integers(1, 1000)), "-")
+                                  for i in range(first, min(args.products, first + 10000))])
+        print(f"{args.products} products")
+
+        conn = db.reader()
+        for sort in ["date_desc", "price_asc", "name_asc"]:
+            keys, descending = PRODUCT_SORTS[sort]
+            for fraction in [0.0, 0.1, 0.5, 0.99]:
+                depth = int(args.products * fraction)
+                after = None
+                if depth:
+                    # Cursor of the page ending just before depth, as the previous request returned it
+                    key = conn.execute(f"SELECT {', '.join(keys)} FROM products p ORDER BY {order_clause(keys, descending)}"
+                                       f" LIMIT 1 OFFSET ?", (depth - 1,)).fetchone()
+                    after = encode_cursor(sort, list(key))
+                offset_page, offset_time = timed(db.get_all_products, 20, depth, None, sort)
+                cursor_page, cursor_time = timed(db.get_all_products, 20, 0, None, sort, after)
+                assert [p["id"] for p in offset_page] == [p["id"] for p in cursor_page]
+                print(f"{sort:>10} depth {depth:8d} | OFFSET {offset_time * 1000:7.1f} ms | cursor {cursor_time * 1000:7.1f} ms")
+        db.close()
+
+def latency_summary(latencies):
+    ms = np.array(latencies) * 1000
+    return f"n={len(ms):5d} p50 {np.percentile(ms, 50):7.1f} ms | p99 {np.percentile(ms, 99):7.1f} ms | max {ms.max():7.1f} ms"
+
+def bench_loadtest(args):
+    """GET /products latency on a running server, idle and while uploads run"""
+    import requests
+    from PIL import Image
+
+    base = args.url.rstrip("/")
+    token = requests.post(f"{base}/token", data={"username": args.username, "password": args.password}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    # A large noisy photo so every upload pays for decode, resize and inference
+    buffer = io.BytesIO()
+    Image.effect_noise((3000, 2000), 64).convert("RGB").save(buffer, "JPEG", quality=95)
+    photo = buffer.getvalue()
+
+    def unique_photo():
+        """photo with a nonce in a JPEG comment segment: same pixels, but new bytes,
+        so the content-hash dedup does not answer the upload without ingesting it"""
+        nonce = uuid.uuid4().bytes
+        return photo[:2] + b"\xff\xfe" + (len(nonce) + 2).to_bytes(2, "big") + nonce + photo[2:]
+
+    pid = requests.post(f"{base}/products", headers=headers,
+                        data={"model_name": "LOADTEST", "product_name": "loadtest", "price": "0", "maintenance_time": "-"},
+                        files=[("files", ("seed.jpg", photo, "image/jpeg"))]).json()["id"]
+
+    def sample(duration):
+        latencies = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            requests.get(f"{base}/products", params={"limit": 20})
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    stop = threading.Event()
+    uploads = []
+
+    def upload():
+        while not stop.is_set():
+            requests.post(f"{base}/products/{pid}/upload-image", headers=headers,
+                          files={"file": ("load.jpg", unique_photo(), "image/jpeg")})
+            uploads.append(1)
+
+    try:
+        print(f"idle:         {latency_summary(sample(args.duration))}")
+        workers = [threading.Thread(target=upload, daemon=True) for _ in range(args.uploaders)]
+        for worker in workers:
+            worker.start()
+        busy = sample(args.duration)
+        stop.set()
+        for worker in workers:
+            worker.join()
+        print(f"{args.uploaders} uploaders: {latency_summary(busy)} ({len(uploads)} uploads)")
+    finally:
+        requests.delete(f"{base}/products/{pid}", headers=headers)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GoodsAI server benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="Compare search index backends")
+    p.add_argument("--n", type=int, default=200000)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--nlist", type=int, default=0)
+    p.add_argument("--nprobe", type=int, default=16)
+    p.add_argument("--backends", nargs="+", default=["flat", "ivf"])
+    p.set_defaults(func=bench_index)
+
+    p = sub.add_parser("encoding", help="Compare compressed vector encodings")
+    p.add_argument("--n", type=int, default=200000)
+    p.add_argument("--queries", type=int, default=100)
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--rerank", type=int, default=100)
+    p.add_argument("--pq-subspaces", type=int, default=144)
+    p.add_argument("--encodings", nargs="+", default=["float32", "float16", "int8", "pq"])
+    p.set_defaults(func=bench_encoding)
+
+    p = sub.add_parser("db", help="Compare per-row and bulk DB writes")
+    p.add_argument("--images", type=int, default=5000)
+    p.add_argument("--images-per-product", type=int, default=4)
+    p.add_argument("--batch", type=int, default=32, help="Rows per bulk transaction (the import batch size)")
+    p.set_defaults(func=bench_db_writes)
+
+    p = sub.add_parser("search", help="Compare LIKE and full-text log search")
+    p.add_argument("--logs", type=int, default=1000000)
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("paging", help="Compare OFFSET and cursor pagination at depth")
+    p.add_argument("--products", type=int, default=200000)
+    p.set_defaults(func=bench_paging)
+
+    p = sub.add_parser("loadtest", help="GET /products latency while uploads run (needs a running server)")
+    p.add_argument("--url", default="http://localhost:8000")
+    p.add_argument("--username", default="admin")
+    p.add_argument("--password", default="admin123")
+    p.add_argument("--uploaders", type=int, default=4)
+    p.add_argument("--duration", type=float, default=10.0)
+    p.set_defaults(func=bench_loadtest)
+
+    args = parser.parse_args()
+    args.func(args)
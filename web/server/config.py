@@ -0,0 +1,97 @@
+import os
+
+# ------------------------------------------------------
+# Server Configuration
+# Every value can be overridden with a GOODSAI_* environment variable.
+# ------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Search index backend for /recognize: "flat" (exact) or "ivf" (approximate)
+SEARCH_INDEX = os.environ.get("GOODSAI_SEARCH_INDEX", "flat")
+# Persisted ANN state, kept next to goods.db so restarts skip the k-means rebuild
+SEARCH_INDEX_PATH = os.environ.get("GOODSAI_SEARCH_INDEX_PATH", os.path.join(BASE_DIR, "goods.index.npz"))
+# IVF coarse quantizer: number of lists (0 = about 4 * sqrt(N)) and lists probed per query
+IVF_NLIST = int(os.environ.get("GOODSAI_IVF_NLIST", "0"))
+IVF_NPROBE = int(os.environ.get("GOODSAI_IVF_NPROBE", "16"))
+
+# In-memory vector encoding: "float32" (exact), "float16", "int8" or "pq" (product quantization)
+VECTOR_ENCODING = os.environ.get("GOODSAI_VECTOR_ENCODING", "float32")
+# PQ subspaces (one byte each, must divide 576): 144 gives 16x, 72 gives 32x compression
+PQ_SUBSPACES = int(os.environ.get("GOODSAI_PQ_SUBSPACES", "144"))
+PQ_CODEBOOK_PATH = os.environ.get("GOODSAI_PQ_CODEBOOK_PATH", os.path.join(BASE_DIR, "goods.pq.npz"))
+# Candidates re-scored with the exact float32 vectors from SQLite when the encoding is lossy (0 = off)
+RERANK_CANDIDATES = int(os.environ.get("GOODSAI_RERANK_CANDIDATES", "100"))
+# Vectors mirrored in an append-only file (plus <path>.ids) that the VectorStore memory-maps instead of
+# decoding SQLite rows at every start ("" = off). float32 indexes search the mapping in place, so
+# worker processes share one page-cache copy.
+VECTOR_FILE_PATH = os.environ.get("GOODSAI_VECTOR_FILE_PATH", os.path.join(BASE_DIR, "goods.vectors"))
+# Deleted rows it may hold, as a fraction of its rows, before it is rewritten without them
+VECTOR_FILE_COMPACT_RATIO = float(os.environ.get("GOODSAI_VECTOR_FILE_COMPACT_RATIO", "0.25"))
+
+# Images per forward pass in FeatureExtractor.extract_batch
+EXTRACT_BATCH_SIZE = int(os.environ.get("GOODSAI_EXTRACT_BATCH_SIZE", "32"))
+
+# /recognize micro-batching: queries coalesced per forward pass, and how long the first one waits
+RECOGNIZE_MAX_BATCH = int(os.environ.get("GOODSAI_RECOGNIZE_MAX_BATCH", "16"))
+RECOGNIZE_MAX_WAIT_MS = float(os.environ.get("GOODSAI_RECOGNIZE_MAX_WAIT_MS", "5"))
+# /recognize query cache: uploads remembered (0 = off), and whether near-identical copies
+# (re-encoded, resized) match by perceptual hash as well as by exact bytes, within how many of 64 bits
+RECOGNIZE_CACHE_SIZE = int(os.environ.get("GOODSAI_RECOGNIZE_CACHE_SIZE", "1024"))
+RECOGNIZE_CACHE_PHASH = os.environ.get("GOODSAI_RECOGNIZE_CACHE_PHASH", "0") == "1"
+RECOGNIZE_CACHE_PHASH_DISTANCE = int(os.environ.get("GOODSAI_RECOGNIZE_CACHE_PHASH_DISTANCE", "2"))
+
+# "fast": serve at once and load the model and vectors in the background (the AI endpoints answer
+# 503 and GET /ready reports not ready until then); "blocking": load them before serving
+STARTUP_MODE = os.environ.get("GOODSAI_STARTUP_MODE", "fast")
+
+# Executors: threads for blocking I/O (sqlite, image decode/save) and for torch inference.
+# Inference workers stay few so each forward pass gets TORCH_THREADS intra-op threads (0 = torch default).
+IO_WORKERS = int(os.environ.get("GOODSAI_IO_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+INFERENCE_WORKERS = int(os.environ.get("GOODSAI_INFERENCE_WORKERS", "1"))
+TORCH_THREADS = int(os.environ.get("GOODSAI_TORCH_THREADS", "0"))
+# Server worker processes, forked once the model and vectors are loaded so they share those pages.
+# Writes reach sibling workers through the catalog change log in goods.db. With several workers,
+# TORCH_THREADS = 0 gives each worker an even share of the cores.
+SERVER_WORKERS = int(os.environ.get("GOODSAI_WORKERS", "1"))
+
+# Zip import pipeline: worker processes that decode and resize entries (0 = decode on the import thread),
+# and entries allowed in flight between the zip reader and feature extraction (bounds memory)
+IMPORT_WORKERS = int(os.environ.get("GOODSAI_IMPORT_WORKERS", str(os.cpu_count() or 1)))
+IMPORT_QUEUE_SIZE = int(os.environ.get("GOODSAI_IMPORT_QUEUE_SIZE", "64"))
+# Images whose embedding scores at least this cosine similarity against an image their product
+# already has are skipped as near-duplicates (0 = off; exact copies are always skipped).
+# Re-encoded or resized copies typically score above 0.999, edited shots of the same product around 0.995.
+IMPORT_NEAR_DUPLICATE_SCORE = float(os.environ.get("GOODSAI_IMPORT_NEAR_DUPLICATE_SCORE", "0"))
+# Background import jobs run at the same time, and where their uploaded archives are kept until done
+IMPORT_JOBS = int(os.environ.get("GOODSAI_IMPORT_JOBS", "1"))
+IMPORT_DIR = os.environ.get("GOODSAI_IMPORT_DIR", os.path.join(BASE_DIR, "imports"))
+
+# Thumbnails written for every stored image (uploads/thumbs/<content hash>_<width>.<ext>):
+# widths in pixels, format ("webp" or "jpeg") and encoder quality
+THUMBNAIL_WIDTHS = [int(w) for w in os.environ.get("GOODSAI_THUMBNAIL_WIDTHS", "200,400").split(",") if w.strip()]
+THUMBNAIL_FORMAT = os.environ.get("GOODSAI_THUMBNAIL_FORMAT", "webp")
+THUMBNAIL_QUALITY = int(os.environ.get("GOODSAI_THUMBNAIL_QUALITY", "80"))
+# Browser cache lifetime of original uploads; thumbnails are content-addressed and cached for a year
+UPLOADS_MAX_AGE = int(os.environ.get("GOODSAI_UPLOADS_MAX_AGE", "86400"))
+
+# Cached public product responses (0 = off), and how long one may serve writes made by other processes
+RESPONSE_CACHE_SIZE = int(os.environ.get("GOODSAI_RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.environ.get("GOODSAI_RESPONSE_CACHE_TTL", "30"))
+
+# SQLite (WAL mode): page cache and memory map per connection, and how long a writer waits on a lock
+DB_CACHE_SIZE_MB = int(os.environ.get("GOODSAI_DB_CACHE_SIZE_MB", "64"))
+DB_MMAP_SIZE_MB = int(os.environ.get("GOODSAI_DB_MMAP_SIZE_MB", "256"))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("GOODSAI_DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Feature extractor backend: "torch", "onnxruntime" or "torchscript" (models built by export_onnx.py).
+# Point ONNX_MODEL_PATH at an INT8 variant (model.int8-dynamic.onnx, model.int8-static.onnx) to serve it.
+MODEL_BACKEND = os.environ.get("GOODSAI_MODEL_BACKEND", "torch")
+# Names the embedding model and its preprocessing, and is stored with every vector. Change it with
+# the model: reindex.py stages the catalog's new vectors while the old version keeps serving,
+# and a server started with the new version switches to them before it serves.
+MODEL_VERSION = os.environ.get("GOODSAI_MODEL_VERSION", "mobilenet_v3_small-1")
+ONNX_MODEL_PATH = os.environ.get("GOODSAI_ONNX_MODEL_PATH", os.path.join(BASE_DIR, "..", "serverTS", "model.onnx"))
+TORCHSCRIPT_MODEL_PATH = os.environ.get("GOODSAI_TORCHSCRIPT_MODEL_PATH", os.path.join(BASE_DIR, "model.torchscript.pt"))
+# ONNX Runtime threads (0 = runtime default)
+ONNX_INTRA_OP_THREADS = int(os.environ.get("GOODSAI_ONNX_INTRA_OP_THREADS", "0"))
+ONNX_INTER_OP_THREADS = int(os.environ.get("GOODSAI_ONNX_INTER_OP_THREADS", "0"))
@@ -1,24 +1,369 @@
 import sqlite3
 import numpy as np
 import os
+import base64
+import contextlib
+import json
+import urllib.parse
 from datetime import datetime, timedelta
 import bcrypt
 import threading
+import uuid
+
+import config
+from thumbnails import thumbnail_paths
 
 # Get absolute path to the directory where this file is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "goods.db")
 
+# ------------------------------------------------------
+# Schema Migrations
+# init_db creates the baseline tables, then applies every migration newer than
+# PRAGMA user_version in order, each in its own transaction. Append new ones,
+# never edit or reorder applied ones.
+# ------------------------------------------------------
+def _add_display_order(cursor):
+    # Databases created before display_order existed
+    cursor.execute("PRAGMA table_info(product_images)")
+    if "display_order" not in [info[1] for info in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE product_images ADD COLUMN display_order INTEGER DEFAULT 0")
+
+def _unique_model_names(cursor):
+    """Merge products sharing a model name into the oldest one before enforcing uniqueness.
+
+    Lossy: the newer duplicates' images move to the oldest product, but their own
+    product_name, price, maintenance_time and created_at are deleted with them.
+    Back goods.db up first if such duplicates may hold distinct data.
+    """
+    cursor.execute('''
+        UPDATE product_images SET product_id = (
+            SELECT MIN(p2.id) FROM products p1 JOIN products p2 ON p2.model_name = p1.model_name
+            WHERE p1.id = product_images.product_id)
+        WHERE product_id NOT IN (SELECT MIN(id) FROM products GROUP BY model_name)
+    ''')
+    cursor.execute("DELETE FROM products WHERE id NOT IN (SELECT MIN(id) FROM products GROUP BY model_name)")
+    if cursor.rowcount:
+        print(f"Merged {cursor.rowcount} duplicate products into the oldest product of their model.")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_model_name ON products(model_name)")
+
+def _add_content_hash(cursor):
+    # Hash of the uploaded bytes, naming the image's thumbnails; NULL for older images
+    cursor.execute("PRAGMA table_info(product_images)")
+    if "content_hash" not in [info[1] for info in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE product_images ADD COLUMN content_hash TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_images_content_hash ON product_images(content_hash)")
+
+def _unique_image_hashes(cursor):
+    # Images stored twice before dedup keep their rows, only the later copies lose their hash
+    cursor.execute('''
+        UPDATE product_images SET content_hash = NULL
+        WHERE content_hash IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM product_images WHERE content_hash IS NOT NULL GROUP BY product_id, content_hash)
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_product_images_product_hash ON product_images(product_id, content_hash)")
+
+def _add_import_skipped(cursor):
+    # Entries an import skipped as copies of stored images
+    cursor.execute("PRAGMA table_info(import_jobs)")
+    if "skipped" not in [info[1] for info in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE import_jobs ADD COLUMN skipped INTEGER DEFAULT 0")
+
+def _add_model_version(cursor):
+    # Vectors stored so far came from the configured model. No column default: a default is fixed
+    # at migration time and would mislabel rows written after MODEL_VERSION changes, so every
+    # writer sets the version and NULL means unknown (re-embedded by the next reindex).
+    cursor.execute("PRAGMA table_info(product_images)")
+    if "model_version" not in [info[1] for info in cursor.fetchall()]:
+        cursor.execute("ALTER TABLE product_images ADD COLUMN model_version TEXT")
+    cursor.execute("UPDATE product_images SET model_version = ? WHERE model_version IS NULL", (config.MODEL_VERSION,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_images_model_version ON product_images(model_version)")
+    # Vectors of another model version, staged by reindex.py until every image has one
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_vectors (
+            image_id INTEGER NOT NULL,
+            model_version TEXT NOT NULL,
+            feature_vector BLOB,
+            PRIMARY KEY (model_version, image_id),
+            FOREIGN KEY(image_id) REFERENCES product_images(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_vectors_image ON image_vectors(image_id)")
+
+def _fts_table(table, fts_table, columns):
+    """Statements creating a trigram FTS5 index over columns of table, kept in sync by triggers"""
+    cols = ", ".join(columns)
+    new = ", ".join(f"new.{c}" for c in columns)
+    old = ", ".join(f"old.{c}" for c in columns)
+    delete = f"INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old});"
+    insert = f"INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5({cols}, content='{table}', content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF {cols} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    ]
+
+MIGRATIONS = [
+    (1, "product_images.display_order column", _add_display_order),
+    (2, "index on product_images.product_id",
+     "CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id, display_order)"),
+    (3, "index on logs.created_at", "CREATE INDEX IF NOT EXISTS idx_logs_created_at ON logs(created_at)"),
+    (4, "unique index on products.model_name", _unique_model_names),
+    (5, "full-text index on products", _fts_table("products", "products_fts", ["model_name", "product_name"])),
+    (6, "full-text index on logs", _fts_table("logs", "logs_fts", ["username", "action", "details"])),
+    (7, "index on products price", "CREATE INDEX IF NOT EXISTS idx_products_price ON products(IFNULL(price, 0))"),
+    (8, "product_images.content_hash column and index", _add_content_hash),
+    (9, "unique index on product_images content per product", _unique_image_hashes),
+    (10, "import_jobs.skipped column", _add_import_skipped),
+    (11, "model version of product_images vectors", _add_model_version),
+    # Lets the VectorStore list which images have a vector without reading the vectors
+    (12, "index on product_images with a vector",
+     "CREATE INDEX IF NOT EXISTS idx_product_images_vector ON product_images(id, product_id) WHERE feature_vector IS NOT NULL"),
+    (13, "catalog change log", '''
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            generation INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            change TEXT NOT NULL
+        )
+    '''),
+]
+
+# catalog_changes rows kept for processes that fall behind, pruned every CATALOG_CHANGES_PRUNE_EVERY writes;
+# a process further behind reloads its vector store instead
+CATALOG_CHANGES_KEPT = 10000
+CATALOG_CHANGES_PRUNE_EVERY = 1000
+
+# Images whose vector is not of model version ? (bound twice): two ranges, so the index skips the current version
+STALE_VECTOR = "(model_version < ? OR model_version > ? OR model_version IS NULL)"
+
+# Trigrams are the smallest unit the FTS index can look up
+FTS_MIN_TERM = 3
+
+def search_clause(search, table, alias, fts_table, columns):
+    """FROM clause and WHERE conditions (with params) selecting rows of table that contain
+    every whitespace-separated term of search in one of columns (prefixed with alias).
+
+    Terms of FTS_MIN_TERM+ characters are looked up in the trigram index fts_table.
+    Shorter ones (e.g. a two-character Chinese name) can't be, so they are checked
+    with LIKE, on the rows the index narrowed down when there are any.
+    Returns (from_sql, conditions, params, uses_fts).
+    """
+    terms = search.split() if search else []
+    long_terms = [t for t in terms if len(t) >= FTS_MIN_TERM]
+    from_sql = f"{table} {alias}"
+    conditions, params = [], []
+    if long_terms:
+        from_sql = f"{fts_table} JOIN {table} {alias} ON {alias}.id = {fts_table}.rowid"
+        conditions.append(f"{fts_table} MATCH ?")
+        # Quoted strings are matched as substrings, never parsed as FTS5 syntax
+        params.append(" ".join('"' + t.replace('"', '""') + '"' for t in long_terms))
+    for term in terms:
+        if len(term) < FTS_MIN_TERM:
+            conditions.append("(" + " OR ".join(f"{c} LIKE ?" for c in columns) + ")")
+            params.extend([f"%{term}%"] * len(columns))
+    return from_sql, conditions, params, bool(long_terms)
+
+def where_clause(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+# ------------------------------------------------------
+# Keyset Pagination
+# A page cursor ("after") is an opaque token holding the sort key of the last row
+# returned, so the next page seeks straight to it in the index of that order instead
+# of walking and discarding every earlier row the way OFFSET does.
+# ------------------------------------------------------
+# sort -> (ORDER BY key expressions ending with the unique id, descending)
+PRODUCT_SORTS = {
+    "date_desc": (["p.id"], True),
+    "date_asc": (["p.id"], False),
+    "price_desc": (["IFNULL(p.price, 0)", "p.id"], True),
+    "price_asc": (["IFNULL(p.price, 0)", "p.id"], False),
+    "name_asc": (["p.model_name", "p.id"], False),
+    "name_desc": (["p.model_name", "p.id"], True),
+}
+
+def encode_cursor(sort, key):
+    data = json.dumps([sort, *key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+def decode_cursor(token, sort, size):
+    """Sort key of size values stored in an encode_cursor() token for sort.
+    Raises ValueError if the token is malformed or was issued for another order."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, list) or len(data) != size + 1 or data[0] != sort:
+        raise ValueError("Cursor does not match the sort order")
+    if not all(isinstance(value, (int, float, str)) and not isinstance(value, bool) for value in data[1:]):
+        raise ValueError("Invalid cursor")
+    return data[1:]
+
+def keyset_clause(keys, descending, after):
+    """WHERE condition (with params) for the rows following key after in ORDER BY keys.
+    Written as k <= ? AND (k < ? OR id < ?) rather than a row value comparison,
+    which SQLite can't seek with on an expression index."""
+    op = "<" if descending else ">"
+    if len(keys) == 1:
+        return f"{keys[0]} {op} ?", [after[0]]
+    return f"{keys[0]} {op}= ? AND ({keys[0]} {op} ? OR {keys[1]} {op} ?)", [after[0], after[0], after[1]]
+
+def order_clause(keys, descending):
+    return ", ".join(f"{key} {'DESC' if descending else 'ASC'}" for key in keys)
+
 # ------------------------------------------------------
 # Database Manager
 # ------------------------------------------------------
 class DBManager:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    """SQLite access in WAL mode: one writer connection shared behind write_lock, and a
+    read-only connection per thread, so reads run in parallel with each other and with
+    imports instead of queueing on a single connection."""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        # Single writer; write_lock serializes transactions on it across threads
+        self.write_lock = threading.RLock()
+        self.conn = self._connect()
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        # Per-thread readers, tracked so close() can release them
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        # Optional resident VectorStore, kept in sync by the image write methods
+        self.vector_store = None
+        # Optional ResponseCache of public product responses, invalidated by the catalog write methods
+        self.response_cache = None
+        # Bumped by every catalog write, so results computed against an older catalog can be told apart
+        self.catalog_version = 0
+        # Names this process's rows in catalog_changes, and the newest row applied by sync_catalog()
+        self.source = uuid.uuid4().hex
+        self.synced_generation = 0
+        self._sync_lock = threading.Lock()
+        with self.write_lock:
+            self.init_db()
+        self.synced_generation = self.latest_generation()
+
+    def _connect(self, readonly=False):
+        timeout = config.DB_BUSY_TIMEOUT_MS / 1000
+        if readonly:
+            uri = f"file:{urllib.parse.quote(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=timeout)
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=timeout)
         # Enable foreign keys for every connection
-        self.conn.execute("PRAGMA foreign_keys = ON")
-        self.init_db()
+        conn.execute("PRAGMA foreign_keys = ON")
+        # WAL is crash-safe with NORMAL; only the last commits may roll back on power loss
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_MB * 1024}")
+        conn.execute(f"PRAGMA mmap_size = {config.DB_MMAP_SIZE_MB * 1024 * 1024}")
+        return conn
+
+    def reader(self):
+        """This thread's read-only connection, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect(readonly=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def write(self, immediate=False):
+        """Cursor on the writer connection: one transaction, committed on success and
+        rolled back on error, with other writers held off until it ends.
+        immediate: take SQLite's write lock up front rather than at the first write."""
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            if immediate:
+                cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def _catalog_changed(self, pids=(), lists=False):
+        """Invalidate cached responses after a committed write touching products pids.
+        lists: the write can change which products a listing holds or their order."""
+        with self.write_lock:
+            self.catalog_version += 1
+        if self.response_cache is not None:
+            self.response_cache.invalidate(pids, lists)
+
+    # --- Catalog Change Log ---
+    # Every catalog write also records what it touched in catalog_changes, in its own
+    # transaction, so other server processes on this database can apply it: sync_catalog()
+    # updates their vector store and drops their cached responses.
+    def _log_change(self, cursor, pids=(), lists=False, added=(), removed_images=(), removed_products=(), reload=False):
+        """Record a catalog write inside its transaction. added: new images with a vector."""
+        change = {"products": sorted({int(pid) for pid in pids}), "lists": lists}
+        for key, ids in (("added", added), ("removed_images", removed_images), ("removed_products", removed_products)):
+            if ids:
+                change[key] = [int(i) for i in ids]
+        if reload:
+            change["reload"] = True
+        cursor.execute('INSERT INTO catalog_changes (source, change) VALUES (?, ?)', (self.source, json.dumps(change)))
+        generation = cursor.lastrowid
+        if generation % CATALOG_CHANGES_PRUNE_EVERY == 0:
+            cursor.execute('DELETE FROM catalog_changes WHERE generation <= ?', (generation - CATALOG_CHANGES_KEPT,))
+
+    def latest_generation(self):
+        """Newest catalog_changes generation (one index lookup)"""
+        return self.reader().execute('SELECT MAX(generation) FROM catalog_changes').fetchone()[0] or 0
+
+    def catalog_behind(self):
+        """Whether another process changed the catalog since the last sync_catalog()"""
+        return self.latest_generation() > self.synced_generation
+
+    def sync_catalog(self):
+        """Apply the catalog writes other processes committed since the last call. Returns how many."""
+        with self._sync_lock:
+            cursor = self.reader().cursor()
+            cursor.execute('SELECT generation, source, change FROM catalog_changes WHERE generation > ? ORDER BY generation',
+                           (self.synced_generation,))
+            rows = cursor.fetchall()
+            if not rows:
+                return 0
+            changes = [json.loads(change) for _, source, change in rows if source != self.source]
+            if rows[0][0] != self.synced_generation + 1 or any(change.get("reload") for change in changes):
+                # Pruned before this process saw them, or every vector changed: start over
+                print(f"Catalog changed beyond the change log since generation {self.synced_generation}, reloading vectors.")
+                if self.vector_store is not None:
+                    self.vector_store.reload(self)
+                if self.response_cache is not None:
+                    self.response_cache.clear()
+                with self.write_lock:
+                    self.catalog_version += 1
+            elif changes:
+                if self.vector_store is not None:
+                    self.vector_store.apply_changes(
+                        self,
+                        [i for change in changes for i in change.get("added", ())],
+                        [i for change in changes for i in change.get("removed_images", ())],
+                        [i for change in changes for i in change.get("removed_products", ())])
+                self._catalog_changed({pid for change in changes for pid in change["products"]},
+                                      any(change["lists"] for change in changes))
+            self.synced_generation = rows[-1][0]
+            return len(changes)
+
+    def reopen(self):
+        """Open new connections after close(), in a server worker forked from the process
+        that set the database up; the worker logs its writes under a source of its own"""
+        self.conn = self._connect()
+        self._local = threading.local()
+        self.source = uuid.uuid4().hex
+
+    def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        with self.write_lock:
+            self.conn.close()
 
     def init_db(self):
         """Initialize database tables"""
@@ -71,16 +416,41 @@ class DBManager:
             )
         ''')
         
-        # Migration: check if product_images has display_order
-        cursor.execute("PRAGMA table_info(product_images)")
-        columns = [info[1] for info in cursor.fetchall()]
-        if "display_order" not in columns:
-            print("Migrating DB: Adding display_order column...")
-            try:
-                cursor.execute("ALTER TABLE product_images ADD COLUMN display_order INTEGER DEFAULT 0")
-                self.conn.commit()
-            except Exception as e:
-                print(f"Migration failed: {e}")
+        # Import Jobs Table (background /batch-update runs)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS import_jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                zip_path TEXT,
+                batch_dir TEXT,
+                user_id INTEGER,
+                username TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                total INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                created_products INTEGER DEFAULT 0,
+                error TEXT,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT
+            )
+        ''')
+
+        # Import Job Entries Table (zip members already handled, so a restart resumes)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS import_job_entries (
+                job_id TEXT NOT NULL,
+                member TEXT NOT NULL,
+                status TEXT NOT NULL,
+                image_id INTEGER,
+                PRIMARY KEY (job_id, member),
+                FOREIGN KEY(job_id) REFERENCES import_jobs(id) ON DELETE CASCADE
+            )
+        ''')
+
+        self.conn.commit()
+        self.migrate()
 
         # Seed Admin User
         cursor.execute("SELECT id FROM users WHERE username='admin'")
@@ -104,9 +474,26 @@ class DBManager:
 
         self.conn.commit()
 
+    def migrate(self):
+        """Apply pending MIGRATIONS, recording each in PRAGMA user_version"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, description, step in MIGRATIONS:
+            if number <= version:
+                continue
+            print(f"Migrating DB to version {number}: {description}...")
+            with self.write() as cursor:
+                # DDL does not open a transaction implicitly
+                cursor.execute("BEGIN")
+                if callable(step):
+                    step(cursor)
+                else:
+                    for statement in ([step] if isinstance(step, str) else step):
+                        cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {number}")
+
     # --- User Management ---
     def get_user(self, username):
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         cursor.execute("SELECT id, username, password_hash, role FROM users WHERE username=?", (username,))
         row = cursor.fetchone()
         if row:
@@ -114,83 +501,142 @@ class DBManager:
         return None
 
     def get_all_users(self):
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         cursor.execute("SELECT id, username, role, created_at FROM users ORDER BY id ASC")
         rows = cursor.fetchall()
         return [{"id": r[0], "username": r[1], "role": r[2], "created_at": r[3]} for r in rows]
 
     def add_user(self, username, password_hash, role='user'):
         created_at = datetime.now().isoformat()
-        cursor = self.conn.cursor()
         try:
-            cursor.execute("INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
-                           (username, password_hash, role, created_at))
-            self.conn.commit()
+            with self.write() as cursor:
+                cursor.execute("INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)",
+                               (username, password_hash, role, created_at))
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
 
     def delete_user(self, user_id):
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
 
     def update_password(self, user_id, password_hash):
-        cursor = self.conn.cursor()
-        cursor.execute("UPDATE users SET password_hash=? WHERE id=?", (password_hash, user_id))
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute("UPDATE users SET password_hash=? WHERE id=?", (password_hash, user_id))
 
     # --- Log Management ---
     def add_log(self, user_id, username, action, details):
-        cursor = self.conn.cursor()
         created_at = datetime.now().isoformat()
-        cursor.execute("INSERT INTO logs (user_id, username, action, details, created_at) VALUES (?, ?, ?, ?, ?)",
-                       (user_id, username, action, details, created_at))
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute("INSERT INTO logs (user_id, username, action, details, created_at) VALUES (?, ?, ?, ?, ?)",
+                           (user_id, username, action, details, created_at))
 
-    def get_logs(self, limit=20, offset=0, search=None):
-        cursor = self.conn.cursor()
-        query = "SELECT id, user_id, username, action, details, created_at FROM logs"
-        params = []
-        
-        if search:
-            query += " WHERE username LIKE ? OR action LIKE ? OR details LIKE ?"
-            term = f"%{search}%"
-            params.extend([term, term, term])
-            
-        query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+    def _logs_search(self, search):
+        return search_clause(search, "logs", "l", "logs_fts", ["l.username", "l.action", "l.details"])
+
+    def get_logs(self, limit=20, offset=0, search=None, after=None):
+        """Logs newest first, optionally only those matching every term of search"""
+        return self.get_logs_page(limit, search, after, offset)[0]
+
+    def get_logs_page(self, limit=20, search=None, after=None, offset=0):
+        """One page of get_logs() and the cursor of the next page (None after the last).
+        after is the cursor of the previous page; offset is still honoured without one."""
+        cursor = self.reader().cursor()
+        from_sql, conditions, params, uses_fts = self._logs_search(search)
+        # Index matches come back in rowid (insertion) order, so newest-first stops after one page
+        sort, keys = ("match", ["logs_fts.rowid"]) if uses_fts else ("date_desc", ["l.created_at", "l.id"])
+        if after:
+            condition, key_params = keyset_clause(keys, True, decode_cursor(after, sort, len(keys)))
+            conditions.append(condition)
+            params.extend(key_params)
+            offset = 0
+        query = (f"SELECT l.id, l.user_id, l.username, l.action, l.details, l.created_at FROM {from_sql}{where_clause(conditions)}"
+                 f" ORDER BY {order_clause(keys, True)} LIMIT ? OFFSET ?")
         params.extend([limit, offset])
         
         cursor.execute(query, params)
         rows = cursor.fetchall()
-        return [{"id": r[0], "user_id": r[1], "username": r[2], "action": r[3], "details": r[4], "created_at": r[5]} for r in rows]
+        logs = [{"id": r[0], "user_id": r[1], "username": r[2], "action": r[3], "details": r[4], "created_at": r[5]} for r in rows]
+        next_after = None
+        if logs and len(logs) == limit:
+            last = logs[-1]
+            next_after = encode_cursor(sort, [last["id"]] if uses_fts else [last["created_at"], last["id"]])
+        return logs, next_after
+
+    def count_logs(self, search=None):
+        """Number of logs get_logs pages through"""
+        from_sql, conditions, params, _ = self._logs_search(search)
+        return self.reader().execute(f"SELECT COUNT(*) FROM {from_sql}{where_clause(conditions)}", params).fetchone()[0]
 
     def delete_old_logs(self, months=3):
         # Calculate date threshold
         threshold = (datetime.now() - timedelta(days=30*months)).isoformat()
-        cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM logs WHERE created_at < ?", (threshold,))
-        deleted_count = cursor.rowcount
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute("DELETE FROM logs WHERE created_at < ?", (threshold,))
+            deleted_count = cursor.rowcount
         return deleted_count
 
     # --- Product Management ---
 
 
     def add_product(self, model_name, product_name, price, maintenance_time):
-        """Add a new product (without images first)"""
+        """Add a new product (without images first). Returns None if the model name is taken."""
         created_at = datetime.now().isoformat()
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            INSERT INTO products (model_name, product_name, price, maintenance_time, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (model_name, product_name, price, maintenance_time, created_at))
-        self.conn.commit()
-        return cursor.lastrowid
+        try:
+            with self.write() as cursor:
+                cursor.execute('''
+                    INSERT INTO products (model_name, product_name, price, maintenance_time, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (model_name, product_name, price, maintenance_time, created_at))
+                pid = cursor.lastrowid
+                self._log_change(cursor, [pid], lists=True)
+        except sqlite3.IntegrityError:
+            return None
+        self._catalog_changed([pid], lists=True)
+        return pid
+
+    def add_products_bulk(self, products: list):
+        """Add many (model_name, product_name, price, maintenance_time) products in one
+        transaction. Returns their product ids, in order; a model name that already
+        exists (e.g. created by a concurrent import) maps to the existing product."""
+        if not products:
+            return []
+        created_at = datetime.now().isoformat()
+        model_names = [product[0] for product in products]
+        placeholders = ','.join(['?'] * len(model_names))
+        with self.write() as cursor:
+            cursor.executemany('''
+                INSERT OR IGNORE INTO products (model_name, product_name, price, maintenance_time, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(*product, created_at) for product in products])
+            cursor.execute(f'SELECT model_name, id FROM products WHERE model_name IN ({placeholders})', model_names)
+            pids = dict(cursor.fetchall())
+            self._log_change(cursor, pids.values(), lists=True)
+        self._catalog_changed(pids.values(), lists=True)
+        return [pids[model_name] for model_name in model_names]
+
+    def get_products_by_models(self, model_names: list):
+        """Find products for many model names, keyed by model name"""
+        if not model_names:
+            return {}
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(model_names))
+        cursor.execute(f'SELECT id, model_name, product_name, price, maintenance_time FROM products WHERE model_name IN ({placeholders})', model_names)
+        products = {}
+        for r in cursor.fetchall():
+            # model_name is unique (migration 4), so there is one match per name
+            products.setdefault(r[1], {
+                "id": r[0],
+                "model_name": r[1],
+                "product_name": r[2],
+                "price": r[3],
+                "maintenance_time": r[4]
+            })
+        return products
 
     def get_product_by_model(self, model_name):
         """Find product by model name"""
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         cursor.execute('SELECT id, model_name, product_name, price, maintenance_time FROM products WHERE model_name=?', (model_name,))
         row = cursor.fetchone()
         if row:
@@ -205,7 +651,7 @@ class DBManager:
 
     def get_product_by_id(self, pid):
         """Find product by ID"""
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         cursor.execute('SELECT id, model_name, product_name, price, maintenance_time, created_at FROM products WHERE id=?', (pid,))
         row = cursor.fetchone()
         if row:
@@ -225,182 +671,538 @@ class DBManager:
     def add_product_image(self, product_id, image_path, feature_vector, display_order=0):
         """Add an image to a product"""
         blob = feature_vector.tobytes() if feature_vector is not None else None
-        cursor = self.conn.cursor()
-        
-        # Get max order to append at end if order not specified (or logic in app)
-        if display_order == 0:
-            cursor.execute('SELECT MAX(display_order) FROM product_images WHERE product_id=?', (product_id,))
-            res = cursor.fetchone()
-            current_max = res[0] if res and res[0] is not None else -1
-            display_order = current_max + 1
+        with self.write() as cursor:
+            # Get max order to append at end if order not specified (or logic in app)
+            if display_order == 0:
+                cursor.execute('SELECT MAX(display_order) FROM product_images WHERE product_id=?', (product_id,))
+                res = cursor.fetchone()
+                current_max = res[0] if res and res[0] is not None else -1
+                display_order = current_max + 1
 
-        cursor.execute('''
-            INSERT INTO product_images (product_id, image_path, feature_vector, display_order)
-            VALUES (?, ?, ?, ?)
-        ''', (product_id, image_path, blob, display_order))
-        self.conn.commit()
-        return cursor.lastrowid
+            cursor.execute('''
+                INSERT INTO product_images (product_id, image_path, feature_vector, display_order, model_version)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (product_id, image_path, blob, display_order, config.MODEL_VERSION))
+            image_id = cursor.lastrowid
+            self._log_change(cursor, [product_id], added=[image_id] if feature_vector is not None else ())
+            # Last in the transaction: SQLite's write lock orders vector file writes across processes
+            if self.vector_store is not None and feature_vector is not None:
+                self.vector_store.add(image_id, product_id, feature_vector)
+        self._catalog_changed([product_id])
+        return image_id
+
+    def _insert_images(self, cursor, images):
+        """INSERT (product_id, image_path, feature_vector[, content_hash]) rows inside the
+        caller's transaction, each appended after its product's existing images. Images whose
+        content hash their product already has are skipped. Returns the new ids, None for skipped images."""
+        pids = sorted({image[0] for image in images})
+        placeholders = ','.join(['?'] * len(pids))
+        cursor.execute(f'SELECT product_id, MAX(display_order) FROM product_images WHERE product_id IN ({placeholders}) GROUP BY product_id', pids)
+        next_order = {r[0]: r[1] + 1 for r in cursor.fetchall() if r[1] is not None}
+        cursor.execute(f'SELECT product_id, content_hash FROM product_images WHERE product_id IN ({placeholders}) AND content_hash IS NOT NULL', pids)
+        stored = set(cursor.fetchall())
+        rows = []
+        kept = []
+        for pid, image_path, feature_vector, *content_hash in images:
+            content_hash = content_hash[0] if content_hash else None
+            if content_hash is not None and (pid, content_hash) in stored:
+                kept.append(False)
+                continue
+            stored.add((pid, content_hash))
+            kept.append(True)
+            display_order = next_order.get(pid, 0)
+            next_order[pid] = display_order + 1
+            rows.append((pid, image_path, feature_vector.tobytes(), display_order, content_hash, config.MODEL_VERSION))
+        if not rows:
+            return [None] * len(images)
+        cursor.executemany('''
+            INSERT INTO product_images (product_id, image_path, feature_vector, display_order, content_hash, model_version)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', rows)
+        # The write lock is held until commit, so the newest rows are ours
+        cursor.execute('SELECT id FROM product_images ORDER BY id DESC LIMIT ?', (len(rows),))
+        new_ids = iter(r[0] for r in reversed(cursor.fetchall()))
+        return [next(new_ids) if keep else None for keep in kept]
+
+    def _add_images_to_store(self, cursor, image_ids, images):
+        """Add the stored images to the vector store and log them, inside the caller's transaction
+        (SQLite's write lock orders vector file writes across processes)"""
+        added = [(image_id, image) for image_id, image in zip(image_ids, images) if image_id is not None]
+        self._log_change(cursor, {image[0] for image in images}, added=[image_id for image_id, _ in added])
+        if self.vector_store is not None and added:
+            self.vector_store.add_batch([image_id for image_id, _ in added], [image[0] for _, image in added],
+                                        [image[2] for _, image in added])
+
+    def add_product_images_bulk(self, images: list):
+        """Add many (product_id, image_path, feature_vector[, content_hash]) images in one transaction,
+        each appended after its product's existing images. Returns the new image ids, None for
+        images whose content their product already has."""
+        if not images:
+            return []
+        # Immediate: the content hashes are checked and the rows inserted under one write lock
+        with self.write(immediate=True) as cursor:
+            image_ids = self._insert_images(cursor, images)
+            self._add_images_to_store(cursor, image_ids, images)
+        self._catalog_changed({image[0] for image in images})
+        return image_ids
 
     def update_product(self, pid, model_name, product_name, price, maintenance_time):
-        """Update product info"""
-        cursor = self.conn.cursor()
-        cursor.execute('''
-            UPDATE products 
-            SET model_name=?, product_name=?, price=?, maintenance_time=?
-            WHERE id=?
-        ''', (model_name, product_name, price, maintenance_time, pid))
-        self.conn.commit()
+        """Update product info. Returns False if the model name belongs to another product."""
+        try:
+            with self.write() as cursor:
+                cursor.execute('''
+                    UPDATE products 
+                    SET model_name=?, product_name=?, price=?, maintenance_time=?
+                    WHERE id=?
+                ''', (model_name, product_name, price, maintenance_time, pid))
+                self._log_change(cursor, [pid], lists=True)
+        except sqlite3.IntegrityError:
+            return False
+        self._catalog_changed([pid], lists=True)
+        return True
 
     def update_image_orders(self, image_orders: list):
         """Update display order for multiple images. 
            image_orders: list of {'id': image_id, 'display_order': order}
         """
-        cursor = self.conn.cursor()
+        pids = set()
         try:
-            for item in image_orders:
-                cursor.execute('UPDATE product_images SET display_order=? WHERE id=?', 
-                                  (item['display_order'], item['id']))
-            self.conn.commit()
+            with self.write() as cursor:
+                for item in image_orders:
+                    cursor.execute('UPDATE product_images SET display_order=? WHERE id=?', 
+                                      (item['display_order'], item['id']))
+                    cursor.execute('SELECT product_id FROM product_images WHERE id=?', (item['id'],))
+                    pids.update(r[0] for r in cursor.fetchall())
+                self._log_change(cursor, pids)
         except Exception as e:
             print(f"Error updating orders: {e}")
-            self.conn.rollback()
+        self._catalog_changed(pids)
 
     def get_product_images(self, pid):
         """Get image paths for a product"""
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         cursor.execute('SELECT image_path FROM product_images WHERE product_id=? ORDER BY display_order ASC, id ASC', (pid,))
         return [r[0] for r in cursor.fetchall()]
 
     def get_product_images_full(self, pid):
         """Get full image info for a product"""
-        cursor = self.conn.cursor()
-        cursor.execute('SELECT id, image_path, display_order FROM product_images WHERE product_id=? ORDER BY display_order ASC, id ASC', (pid,))
-        return [{"id": r[0], "image_path": r[1], "display_order": r[2]} for r in cursor.fetchall()]
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT id, image_path, display_order, content_hash FROM product_images WHERE product_id=? ORDER BY display_order ASC, id ASC', (pid,))
+        return [{"id": r[0], "image_path": r[1], "display_order": r[2], "thumbnails": thumbnail_paths(r[3])} for r in cursor.fetchall()]
 
     def get_products_images(self, pids: list):
         """Get image paths for multiple products"""
         if not pids:
             return []
-        cursor = self.conn.cursor()
+        cursor = self.reader().cursor()
         placeholders = ','.join(['?'] * len(pids))
         cursor.execute(f'SELECT image_path FROM product_images WHERE product_id IN ({placeholders})', pids)
         return [r[0] for r in cursor.fetchall()]
 
+    def get_image_hashes(self, pids: list):
+        """Content hashes of the images of multiple products"""
+        if not pids:
+            return set()
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(pids))
+        cursor.execute(f'SELECT content_hash FROM product_images WHERE product_id IN ({placeholders}) AND content_hash IS NOT NULL', pids)
+        return {r[0] for r in cursor.fetchall()}
+
+    def get_unused_hashes(self, hashes):
+        """The content hashes no image references any more"""
+        hashes = [h for h in hashes if h]
+        if not hashes:
+            return set()
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(hashes))
+        cursor.execute(f'SELECT DISTINCT content_hash FROM product_images WHERE content_hash IN ({placeholders})', hashes)
+        return set(hashes) - {r[0] for r in cursor.fetchall()}
+
+    def get_image_by_hash(self, pid, content_hash):
+        """(id, image_path) of the product's image with this content, or None"""
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT id, image_path FROM product_images WHERE product_id=? AND content_hash=?', (pid, content_hash))
+        return cursor.fetchone()
+
+    def get_hashes_by_models(self, model_names: list, chunk_size=500):
+        """Content hashes of the images of the products with these model names, keyed by model name"""
+        hashes = {}
+        cursor = self.reader().cursor()
+        for i in range(0, len(model_names), chunk_size):
+            chunk = model_names[i:i + chunk_size]
+            placeholders = ','.join(['?'] * len(chunk))
+            cursor.execute(f'''
+                SELECT p.model_name, pi.content_hash FROM products p
+                JOIN product_images pi ON pi.product_id = p.id
+                WHERE p.model_name IN ({placeholders}) AND pi.content_hash IS NOT NULL
+            ''', chunk)
+            for model_name, content_hash in cursor.fetchall():
+                hashes.setdefault(model_name, set()).add(content_hash)
+        return hashes
+
+    def get_vectors_by_products(self, pids: list):
+        """Stored feature vectors of multiple products' images, as an (n, dim) array per product id"""
+        if not pids:
+            return {}
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(pids))
+        cursor.execute(f'SELECT product_id, feature_vector FROM product_images WHERE product_id IN ({placeholders}) AND feature_vector IS NOT NULL', pids)
+        vectors = {}
+        for pid, blob in cursor.fetchall():
+            vectors.setdefault(pid, []).append(np.frombuffer(blob, dtype=np.float32))
+        return {pid: np.stack(rows) for pid, rows in vectors.items()}
+
+    def get_images_without_hash(self, after_id=0, limit=500):
+        """(id, image_path) of images stored without a content hash, by id after after_id"""
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT id, image_path FROM product_images WHERE content_hash IS NULL AND id > ? ORDER BY id LIMIT ?', (after_id, limit))
+        return cursor.fetchall()
+
+    def set_image_hashes(self, hashes: list):
+        """Record (content_hash, image_id) pairs. Like migration 9, an image whose product already
+        has an image of that content keeps no hash. Returns how many were left without one."""
+        if not hashes:
+            return 0
+        with self.write() as cursor:
+            cursor.executemany('''
+                UPDATE product_images SET content_hash = ?1 WHERE id = ?2 AND NOT EXISTS (
+                    SELECT 1 FROM product_images other
+                    WHERE other.product_id = product_images.product_id AND other.content_hash = ?1)
+            ''', hashes)
+            duplicates = len(hashes) - cursor.rowcount
+            self._log_change(cursor, lists=True)
+        # Listings show the thumbnails too
+        self._catalog_changed(lists=True)
+        return duplicates
+
+    def get_images_by_products(self, pids: list):
+        """Get ordered image paths for multiple products, keyed by product id"""
+        if not pids:
+            return {}
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(pids))
+        cursor.execute(f'SELECT product_id, image_path FROM product_images WHERE product_id IN ({placeholders}) ORDER BY display_order ASC, id ASC', pids)
+        images = {}
+        for r in cursor.fetchall():
+            images.setdefault(r[0], []).append(r[1])
+        return images
+
     def delete_product(self, pid):
         """Delete a product and its images"""
-        cursor = self.conn.cursor()
-        cursor.execute('DELETE FROM products WHERE id=?', (pid,))
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute('DELETE FROM products WHERE id=?', (pid,))
+            self._log_change(cursor, [pid], lists=True, removed_products=[pid])
+            if self.vector_store is not None:
+                self.vector_store.remove_products([pid])
+        self._catalog_changed([pid], lists=True)
 
     def delete_products(self, pids: list):
         """Batch delete products"""
         if not pids:
             return
-        cursor = self.conn.cursor()
         placeholders = ','.join(['?'] * len(pids))
-        cursor.execute(f'DELETE FROM products WHERE id IN ({placeholders})', pids)
-        self.conn.commit()
+        with self.write() as cursor:
+            cursor.execute(f'DELETE FROM products WHERE id IN ({placeholders})', pids)
+            self._log_change(cursor, pids, lists=True, removed_products=pids)
+            if self.vector_store is not None:
+                self.vector_store.remove_products(pids)
+        self._catalog_changed(pids, lists=True)
 
     def delete_image(self, image_id):
-        """Delete specific image"""
-        cursor = self.conn.cursor()
-        # First get path to return for file deletion
-        cursor.execute('SELECT image_path FROM product_images WHERE id=?', (image_id,))
+        """Delete specific image, returning its (image_path, content_hash) for file deletion"""
+        with self.write() as cursor:
+            cursor.execute('SELECT image_path, product_id, content_hash FROM product_images WHERE id=?', (image_id,))
+            row = cursor.fetchone()
+            if row:
+                cursor.execute('DELETE FROM product_images WHERE id=?', (image_id,))
+                self._log_change(cursor, [row[1]], removed_images=[image_id])
+                if self.vector_store is not None:
+                    self.vector_store.remove_images([image_id])
+        if not row:
+            return None
+        self._catalog_changed([row[1]])
+        return row[0], row[2]
+
+    # --- Import Jobs ---
+    def create_import_job(self, job_id, filename, zip_path, batch_dir, user_id, username):
+        with self.write() as cursor:
+            cursor.execute('''
+                INSERT INTO import_jobs (id, filename, zip_path, batch_dir, user_id, username, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)
+            ''', (job_id, filename, zip_path, batch_dir, user_id, username, datetime.now().isoformat()))
+
+    def get_import_job(self, job_id):
+        cursor = self.reader().cursor()
+        cursor.execute('''
+            SELECT id, filename, zip_path, batch_dir, user_id, username, status, total, processed, failed, skipped,
+                   created_products, error, created_at, started_at, finished_at
+            FROM import_jobs WHERE id=?
+        ''', (job_id,))
         row = cursor.fetchone()
         if row:
-            cursor.execute('DELETE FROM product_images WHERE id=?', (image_id,))
-            self.conn.commit()
-            return row[0]
+            keys = ["id", "filename", "zip_path", "batch_dir", "user_id", "username", "status", "total", "processed",
+                    "failed", "skipped", "created_products", "error", "created_at", "started_at", "finished_at"]
+            return dict(zip(keys, row))
         return None
 
-    def get_all_products(self, limit=20, offset=0, search=None):
-        """Get products with their images, supporting pagination and search"""
+    def get_unfinished_import_jobs(self):
+        """Jobs that were queued or running when the server stopped, oldest first"""
+        cursor = self.reader().cursor()
+        cursor.execute("SELECT id FROM import_jobs WHERE status IN ('queued', 'running') ORDER BY created_at ASC")
+        return [self.get_import_job(r[0]) for r in cursor.fetchall()]
+
+    def set_import_job_status(self, job_id, status, error=None):
+        now = datetime.now().isoformat()
+        with self.write() as cursor:
+            if status == 'running':
+                cursor.execute("UPDATE import_jobs SET status=?, started_at=?, error=NULL WHERE id=?", (status, now, job_id))
+            else:
+                cursor.execute("UPDATE import_jobs SET status=?, finished_at=?, error=? WHERE id=?", (status, now, error, job_id))
+
+    def set_import_job_total(self, job_id, total):
+        with self.write() as cursor:
+            cursor.execute("UPDATE import_jobs SET total=? WHERE id=?", (total, job_id))
+
+    def get_import_job_members(self, job_id):
+        """Zip members a job has already stored or given up on"""
+        cursor = self.reader().cursor()
+        cursor.execute("SELECT member FROM import_job_entries WHERE job_id=?", (job_id,))
+        return {r[0] for r in cursor.fetchall()}
+
+    def record_import_batch(self, job_id, images: list, failed_members: list, created_products=0, skipped_members=()):
+        """Store (member, product_id, image_path, feature_vector, content_hash) images of an
+        import job and mark them, plus the failed and skipped (duplicate) members, as handled
+        in one transaction, so a resumed job neither loses nor duplicates them.
+        Returns the new image ids, None for images found to be duplicates here."""
+        rows = [image[1:] for image in images]
+        with self.write(immediate=True) as cursor:
+            image_ids = self._insert_images(cursor, rows) if rows else []
+            entries = [(job_id, image[0], 'done' if image_id is not None else 'skipped', image_id) for image, image_id in zip(images, image_ids)]
+            entries += [(job_id, member, 'failed', None) for member in failed_members]
+            entries += [(job_id, member, 'skipped', None) for member in skipped_members]
+            cursor.executemany("INSERT OR REPLACE INTO import_job_entries (job_id, member, status, image_id) VALUES (?, ?, ?, ?)", entries)
+            added = sum(image_id is not None for image_id in image_ids)
+            cursor.execute("UPDATE import_jobs SET processed = processed + ?, failed = failed + ?, skipped = skipped + ?, created_products = created_products + ? WHERE id=?",
+                           (added, len(failed_members), len(skipped_members) + len(image_ids) - added, created_products, job_id))
+            if rows:
+                self._add_images_to_store(cursor, image_ids, rows)
+        self._catalog_changed({row[0] for row in rows})
+        return image_ids
+
+    def _products_search(self, search):
+        return search_clause(search, "products", "p", "products_fts", ["p.model_name", "p.product_name"])
+
+    def get_all_products(self, limit=20, offset=0, search=None, sort=None, after=None):
+        """Get products with their images, supporting pagination, search and sorting"""
+        return self.get_products_page(limit, search, sort, after, offset)[0]
+
+    def get_products_page(self, limit=20, search=None, sort=None, after=None, offset=0):
+        """One page of products with their images, and the cursor of the next page (None after the last).
+
+        sort is a PRODUCT_SORTS order, or "relevance" (the default when searching): bm25
+        rank with model name matches first. Ranked pages are cursored by position, since
+        every match is scored anyway; the other orders seek by key. after is the cursor
+        of the previous page; offset is still honoured without one.
+        """
+        from_sql, conditions, params, uses_fts = self._products_search(search)
+        sort = sort or ("relevance" if uses_fts else "date_desc")
+        if sort == "relevance" and not uses_fts:
+            sort = "date_desc"
+        if sort != "relevance" and sort not in PRODUCT_SORTS:
+            raise ValueError(f"Unknown sort: {sort}")
+
+        if sort == "relevance":
+            keys = []
+            order = "bm25(products_fts, 10.0, 1.0), p.id DESC"
+            if after:
+                offset = int(decode_cursor(after, sort, 1)[0])
+        else:
+            keys, descending = PRODUCT_SORTS[sort]
+            order = order_clause(keys, descending)
+            if after:
+                condition, key_params = keyset_clause(keys, descending, decode_cursor(after, sort, len(keys)))
+                conditions.append(condition)
+                params.extend(key_params)
+                offset = 0
+
         try:
-            with self.lock:
-                cursor = self.conn.cursor()
-                
-                # Base query for products
-                query = "SELECT id, model_name, product_name, price, maintenance_time, created_at FROM products"
-                params = []
-                
-                # Add search condition
-                if search:
-                    query += " WHERE model_name LIKE ? OR product_name LIKE ?"
-                    search_term = f"%{search}%"
-                    params.extend([search_term, search_term])
-                
-                # Add pagination
-                query += " ORDER BY id DESC LIMIT ? OFFSET ?"
-                params.extend([limit, offset])
-                
-                cursor.execute(query, params)
-                product_rows = cursor.fetchall()
-                
-                if not product_rows:
-                    return []
-                
-                products_map = {}
-                pids = []
-                for r in product_rows:
-                    pid = r[0]
-                    pids.append(pid)
-                    products_map[pid] = {
-                        "id": pid,
-                        "model_name": r[1],
-                        "product_name": r[2] or "",
-                        "price": r[3],
-                        "maintenance_time": r[4],
-                        "created_at": r[5],
-                        "images": []
-                    }
-                
-                # Fetch images for these products
-                placeholders = ','.join(['?'] * len(pids))
-                img_query = f'''
-                    SELECT product_id, id, image_path, display_order 
-                    FROM product_images 
-                    WHERE product_id IN ({placeholders})
-                    ORDER BY display_order ASC, id ASC
-                '''
-                cursor.execute(img_query, pids)
-                img_rows = cursor.fetchall()
-                
-                for r in img_rows:
-                    pid = r[0]
-                    if pid in products_map:
-                        products_map[pid]["images"].append({
-                            "id": r[1],
-                            "image_path": r[2],
-                            "display_order": r[3]
-                        })
+            cursor = self.reader().cursor()
+            
+            # Base query for products, with the search condition and the sort key of each row
+            columns = ", ".join(["p.id", "p.model_name", "p.product_name", "p.price", "p.maintenance_time", "p.created_at"] + keys)
+            query = f"SELECT {columns} FROM {from_sql}{where_clause(conditions)}"
+            
+            # Add pagination
+            query += f" ORDER BY {order} LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+            
+            cursor.execute(query, params)
+            product_rows = cursor.fetchall()
+            
+            if not product_rows:
+                return [], None
+
+            next_after = None
+            if len(product_rows) == limit:
+                key = [offset + limit] if sort == "relevance" else list(product_rows[-1][6:])
+                next_after = encode_cursor(sort, key)
+            
+            products_map = {}
+            pids = []
+            for r in product_rows:
+                pid = r[0]
+                pids.append(pid)
+                products_map[pid] = {
+                    "id": pid,
+                    "model_name": r[1],
+                    "product_name": r[2] or "",
+                    "price": r[3],
+                    "maintenance_time": r[4],
+                    "created_at": r[5],
+                    "images": []
+                }
+            
+            # Fetch images for these products
+            placeholders = ','.join(['?'] * len(pids))
+            img_query = f'''
+                SELECT product_id, id, image_path, display_order, content_hash
+                FROM product_images 
+                WHERE product_id IN ({placeholders})
+                ORDER BY display_order ASC, id ASC
+            '''
+            cursor.execute(img_query, pids)
+            img_rows = cursor.fetchall()
+            
+            for r in img_rows:
+                pid = r[0]
+                if pid in products_map:
+                    products_map[pid]["images"].append({
+                        "id": r[1],
+                        "image_path": r[2],
+                        "display_order": r[3],
+                        "thumbnails": thumbnail_paths(r[4])
+                    })
             
-            return list(products_map.values())
+            return list(products_map.values()), next_after
         except Exception as e:
             print(f"Error getting products: {e}")
-            return []
+            return [], None
 
-    def get_all_vectors(self):
-        """Get all vectors for search"""
-        cursor = self.conn.cursor()
+    def count_products(self, search=None):
+        """Number of products get_all_products pages through"""
+        from_sql, conditions, params, _ = self._products_search(search)
+        return self.reader().execute(f"SELECT COUNT(*) FROM {from_sql}{where_clause(conditions)}", params).fetchone()[0]
+
+    def iter_vector_rows(self, batch_size=1000):
+        """Yield (image_id, product_id, feature_vector) rows in batches, for the VectorStore"""
+        cursor = self.reader().cursor()
         cursor.execute('''
-            SELECT p.id, p.model_name, p.product_name, p.price, p.maintenance_time,
-                   pi.image_path, pi.feature_vector
-            FROM products p
-            JOIN product_images pi ON p.id = pi.product_id
-            WHERE pi.feature_vector IS NOT NULL
+            SELECT id, product_id, feature_vector
+            FROM product_images
+            WHERE feature_vector IS NOT NULL
         ''')
-        rows = cursor.fetchall()
-        
-        vectors = []
-        for r in rows:
-            vec = np.frombuffer(r[6], dtype=np.float32)
-            vectors.append({
-                "product_id": r[0],
-                "model_name": r[1],
-                "product_name": r[2] or "",
-                "price": r[3],
-                "maintenance_time": r[4],
-                "image_path": r[5],
-                "vector": vec
-            })
-        return vectors
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def get_vector_ids(self):
+        """(image_ids, product_ids) int64 arrays of every image with a vector, by image id"""
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT id, product_id FROM product_images WHERE feature_vector IS NOT NULL ORDER BY id')
+        ids = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+        return ids[:, 0], ids[:, 1]
+
+    # --- Re-indexing ---
+    def count_stale_vectors(self, version):
+        """Number of images whose vector was not computed by model version"""
+        cursor = self.reader().cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM product_images WHERE {STALE_VECTOR}', (version, version))
+        return cursor.fetchone()[0]
+
+    def count_staged_vectors(self, version):
+        cursor = self.reader().cursor()
+        cursor.execute('SELECT COUNT(*) FROM image_vectors WHERE model_version = ?', (version,))
+        return cursor.fetchone()[0]
+
+    def get_unstaged_images(self, version):
+        """Ids of the images needing a vector of model version that reindex has not staged yet"""
+        cursor = self.reader().cursor()
+        cursor.execute(f'''
+            SELECT id FROM product_images pi
+            WHERE {STALE_VECTOR}
+              AND NOT EXISTS (SELECT 1 FROM image_vectors iv WHERE iv.model_version = ? AND iv.image_id = pi.id)
+        ''', (version, version, version))
+        return sorted(r[0] for r in cursor.fetchall())
+
+    def get_image_paths_by_ids(self, image_ids: list):
+        """(id, image_path) of specific images"""
+        if not image_ids:
+            return []
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(image_ids))
+        cursor.execute(f'SELECT id, image_path FROM product_images WHERE id IN ({placeholders})', image_ids)
+        return cursor.fetchall()
+
+    def stage_vectors(self, version, vectors: list):
+        """Store (image_id, feature_vector) vectors of model version aside; None for images that could not be read"""
+        with self.write() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO image_vectors (image_id, model_version, feature_vector) VALUES (?, ?, ?)',
+                               [(image_id, version, vector.tobytes() if vector is not None else None) for image_id, vector in vectors])
+
+    def activate_vectors(self, version):
+        """Replace every image's vector with its staged vector of model version in one transaction,
+        so searches see either the old vectors or the new ones, never a mix. Images that could not
+        be read lose their vector. Returns how many images switched, or None (and changes nothing)
+        while some image has no staged vector."""
+        with self.write() as cursor:
+            cursor.execute('''
+                UPDATE product_images SET model_version = ?, feature_vector = (
+                    SELECT iv.feature_vector FROM image_vectors iv WHERE iv.model_version = ? AND iv.image_id = product_images.id)
+                WHERE id IN (SELECT image_id FROM image_vectors WHERE model_version = ?)
+            ''', (version, version, version))
+            switched = cursor.rowcount
+            cursor.execute(f'SELECT COUNT(*) FROM product_images WHERE {STALE_VECTOR}', (version, version))
+            if cursor.fetchone()[0]:
+                # Images were added since the last reindex pass
+                self.conn.rollback()
+                return None
+            cursor.execute('DELETE FROM image_vectors WHERE model_version = ?', (version,))
+            self._log_change(cursor, lists=True, reload=True)
+        self._catalog_changed(lists=True)
+        return switched
+
+    def get_vectors_by_image_ids(self, image_ids: list):
+        """Get (image_id, product_id, feature_vector) rows for specific images"""
+        if not image_ids:
+            return []
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(image_ids))
+        cursor.execute(f'SELECT id, product_id, feature_vector FROM product_images WHERE id IN ({placeholders})', image_ids)
+        return cursor.fetchall()
+
+    def get_image_hits(self, image_ids: list):
+        """Get product info plus the image path for each matched image id"""
+        if not image_ids:
+            return {}
+        cursor = self.reader().cursor()
+        placeholders = ','.join(['?'] * len(image_ids))
+        cursor.execute(f'''
+            SELECT pi.id, p.id, p.model_name, p.product_name, p.price, p.maintenance_time, pi.image_path, pi.content_hash
+            FROM product_images pi
+            JOIN products p ON p.id = pi.product_id
+            WHERE pi.id IN ({placeholders})
+        ''', image_ids)
+        return {
+            r[0]: {
+                "id": r[1],
+                "model_name": r[2],
+                "product_name": r[3] or "",
+                "price": r[4],
+                "maintenance_time": r[5],
+                "image_path": r[6],
+                "thumbnails": thumbnail_paths(r[7])
+            }
+            for r in cursor.fetchall()
+        }
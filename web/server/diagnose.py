@@ -1,7 +1,13 @@
+import os
 import sqlite3
+import tempfile
 import requests
 import sys
 
+import numpy as np
+
+from database import encode_cursor
+
 def check_db():
     print("Checking Database...")
     try:
@@ -53,6 +59,100 @@ def check_api():
     except Exception as e:
         print(f"❌ API Error: {e}")
 
+# Read paths that must stay index lookups. The few that legitimately walk a table or
+# index (first pages, loading every vector) or sort the images of a page of products
+# list the plan steps they are allowed.
+QUERY_PLAN_CHECKS = [
+    ("get_user", lambda db: db.get_user("admin"), ()),
+    ("get_product_by_model", lambda db: db.get_product_by_model("M1"), ()),
+    ("get_products_by_models", lambda db: db.get_products_by_models(["M1", "M2"]), ()),
+    ("get_product_by_id", lambda db: db.get_product_by_id(1), ()),
+    ("get_product_images", lambda db: db.get_product_images(1), ()),
+    ("get_products_images", lambda db: db.get_products_images([1, 2]), ()),
+    ("get_images_by_products", lambda db: db.get_images_by_products([1, 2]), ("USE TEMP B-TREE FOR ORDER BY",)),
+    ("get_all_products", lambda db: db.get_all_products(limit=20), ("SCAN p", "USE TEMP B-TREE FOR ORDER BY")),
+    # Relevance ranking sorts the index matches
+    ("get_all_products search", lambda db: db.get_all_products(limit=20, search="M1 product"), ("USE TEMP B-TREE FOR ORDER BY",)),
+    ("count_products search", lambda db: db.count_products("M1 product"), ()),
+    # Deep pages seek to the cursor instead of walking the earlier rows
+    ("get_products_page date_desc after",
+     lambda db: db.get_products_page(20, sort="date_desc", after=encode_cursor("date_desc", [2])), ("USE TEMP B-TREE FOR ORDER BY",)),
+    ("get_products_page price_asc after",
+     lambda db: db.get_products_page(20, sort="price_asc", after=encode_cursor("price_asc", [0.0, 1])), ("USE TEMP B-TREE FOR ORDER BY",)),
+    ("get_products_page name_desc after",
+     lambda db: db.get_products_page(20, sort="name_desc", after=encode_cursor("name_desc", ["M2", 2])), ("USE TEMP B-TREE FOR ORDER BY",)),
+    # The first page walks the created_at index from its newest end
+    ("get_logs", lambda db: db.get_logs(limit=20), ("SCAN l USING INDEX idx_logs_created_at",)),
+    ("get_logs search", lambda db: db.get_logs(limit=20, search="query plans"), ()),
+    ("count_logs search", lambda db: db.count_logs("query plans"), ()),
+    ("get_logs_page after", lambda db: db.get_logs_page(20, after=encode_cursor("date_desc", ["9999", 9])), ()),
+    ("get_logs_page search after", lambda db: db.get_logs_page(20, search="query plans", after=encode_cursor("match", [9])), ()),
+    ("get_import_job_members", lambda db: db.get_import_job_members("job"), ()),
+    ("get_vectors_by_image_ids", lambda db: db.get_vectors_by_image_ids([1, 2]), ()),
+    ("get_image_hits", lambda db: db.get_image_hits([1, 2]), ()),
+    ("get_image_hashes", lambda db: db.get_image_hashes([1, 2]), ()),
+    ("get_unused_hashes", lambda db: db.get_unused_hashes(["a", "b"]), ()),
+    ("get_images_without_hash", lambda db: db.get_images_without_hash(0), ()),
+    ("get_image_by_hash", lambda db: db.get_image_by_hash(1, "a"), ()),
+    ("get_hashes_by_models", lambda db: db.get_hashes_by_models(["M1", "M2"]), ()),
+    ("get_vectors_by_products", lambda db: db.get_vectors_by_products([1, 2]), ()),
+    ("count_stale_vectors", lambda db: db.count_stale_vectors("v2"), ()),
+    ("count_staged_vectors", lambda db: db.count_staged_vectors("v2"), ()),
+    ("get_unstaged_images", lambda db: db.get_unstaged_images("v2"), ()),
+    ("get_image_paths_by_ids", lambda db: db.get_image_paths_by_ids([1, 2]), ()),
+    ("iter_vector_rows", lambda db: list(db.iter_vector_rows()),
+     ("SCAN product_images", "SCAN product_images USING INDEX idx_product_images_vector")),
+    # Only reads the partial index (its table seek is deferred and never taken)
+    ("get_vector_ids", lambda db: db.get_vector_ids(), ("SCAN product_images USING INDEX idx_product_images_vector",)),
+    ("latest_generation", lambda db: db.latest_generation(), ()),
+    ("sync_catalog", lambda db: db.sync_catalog(), ()),
+]
+
+def plan_problems(conn, sql, allowed):
+    """Table and index scans and sorts without an index in the query plan of sql"""
+    problems = []
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}"):
+        detail = row[-1]
+        if detail in allowed:
+            continue
+        # FTS5 lookups show as a SCAN of the virtual table
+        if (detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail) or detail.startswith("USE TEMP B-TREE"):
+            problems.append(detail)
+    return problems
+
+def check_query_plans():
+    """Run the hot DBManager reads on a scratch database and check SQLite's plan for
+    every statement they execute, so a new query or a dropped index can't silently
+    turn a lookup into a table scan"""
+    from database import DBManager
+    print("\nChecking query plans...")
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DBManager(os.path.join(tmp, "plans.db"))
+        pids = db.add_products_bulk([(f"M{i}", "", 0.0, "") for i in range(1, 3)])
+        db.add_product_images_bulk([(pid, "uploads/p.jpg", np.ones(576, dtype=np.float32)) for pid in pids])
+        db.add_log(1, "admin", "CHECK", "query plans")
+        conn = db.reader()
+        for name, call, allowed in QUERY_PLAN_CHECKS:
+            statements = []
+            conn.set_trace_callback(statements.append)
+            call(db)
+            conn.set_trace_callback(None)
+            # Skip FTS5's own lookups in its shadow tables (products_fts_data, ...)
+            statements = [sql for sql in statements if sql.lstrip().upper().startswith("SELECT") and "_fts_" not in sql]
+            problems = [p for sql in statements for p in plan_problems(conn, sql, allowed)]
+            if problems:
+                failed = True
+                print(f"❌ {name}: {'; '.join(problems)}")
+            else:
+                print(f"✅ {name}: {len(statements)} queries use indexes")
+        db.close()
+    return not failed
+
 if __name__ == "__main__":
+    # `python diagnose.py plans` runs only the query plan check and fails on a regression
+    if sys.argv[1:] == ["plans"]:
+        sys.exit(0 if check_query_plans() else 1)
     check_db()
+    check_query_plans()
     check_api()
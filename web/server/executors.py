@@ -0,0 +1,117 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+
+# ------------------------------------------------------
+# Executors
+# Keep CPU-bound and blocking work off the asyncio event loop.
+# ------------------------------------------------------
+# Blocking I/O and image work: sqlite calls, decode/resize/save, file deletes
+io_pool = ThreadPoolExecutor(max_workers=config.IO_WORKERS, thread_name_prefix="goodsai-io")
+# Torch inference; few workers so intra-op threads don't oversubscribe the CPU
+inference_pool = ThreadPoolExecutor(max_workers=config.INFERENCE_WORKERS, thread_name_prefix="goodsai-inference")
+
+async def run_io(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) on the I/O pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(fn, *args, **kwargs))
+
+async def run_inference(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) on the inference pool"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(inference_pool, functools.partial(fn, *args, **kwargs))
+
+def inference(fn, *args, **kwargs):
+    """Run fn on the inference pool from a worker thread and wait for its result.
+    Never call this from an inference pool thread."""
+    return inference_pool.submit(fn, *args, **kwargs).result()
+
+# Set by shutdown(); long-running work checks it to stop without marking itself failed
+stopping = threading.Event()
+
+# Image decode/resize for zip imports, started on first use and again after a worker dies
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def _exit_with_parent(parent_pid):
+    """Import worker initializer: exit once the server process is gone, even if it was killed"""
+    def watch():
+        while os.getppid() == parent_pid:
+            time.sleep(1)
+        os._exit(0)
+    threading.Thread(target=watch, daemon=True).start()
+
+def get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # fork: workers inherit the loaded modules instead of re-importing main.py
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("fork" if "fork" in methods else None)
+            _process_pool = ProcessPoolExecutor(max_workers=config.IMPORT_WORKERS, mp_context=context,
+                                                initializer=_exit_with_parent, initargs=(os.getpid(),))
+        return _process_pool
+
+def _discard_process_pool(pool):
+    """Forget pool if it is still the current one, so the next use starts a new one"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def stop_process_pool():
+    """Shut the import workers down and wait for them; the next use starts new ones"""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+def start_process_pool():
+    """Start the import workers now. Call before loading the model and binding the
+    server socket so the forked workers inherit neither."""
+    if config.IMPORT_WORKERS > 0:
+        # Workers are forked on the first submit
+        get_process_pool().submit(int).result()
+
+def submit_image_task(fn, *args):
+    """Run fn(*args) in an import worker process and return its Future.
+    With IMPORT_WORKERS = 0 it runs inline and the Future is already done."""
+    if config.IMPORT_WORKERS > 0:
+        pool = get_process_pool()
+        try:
+            return pool.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed), failing the tasks it had: start over with a new pool
+            print("Import worker pool is broken, starting a new one.")
+            _discard_process_pool(pool)
+            return get_process_pool().submit(fn, *args)
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+def reset_after_fork():
+    """In a forked server worker: the parent's pool threads don't exist here, start new pools"""
+    global io_pool, inference_pool, _process_pool
+    io_pool = ThreadPoolExecutor(max_workers=config.IO_WORKERS, thread_name_prefix="goodsai-io")
+    inference_pool = ThreadPoolExecutor(max_workers=config.INFERENCE_WORKERS, thread_name_prefix="goodsai-inference")
+    # Import workers are forked again on first use
+    _process_pool = None
+
+def shutdown():
+    stopping.set()
+    io_pool.shutdown(wait=False)
+    inference_pool.shutdown(wait=False)
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
@@ -1,30 +1,53 @@
+import argparse
 import torch
-import torchvision.models as models
+import numpy as np
 import os
+import sqlite3
+import time
+from PIL import Image
 
-def export_model():
+import config
+from database import DB_PATH
+from model import OnnxBackend, TorchBackend, TorchScriptBackend, load_image, load_torch_model, preprocess
+
+# Model variants this tool can build; the fp32 ONNX model is the base of the INT8 ones
+VARIANTS = ["fp32", "int8-dynamic", "int8-static", "torchscript"]
+
+def variant_path(variant, onnx_path=config.ONNX_MODEL_PATH):
+    """Output file of a variant: model.onnx, model.<variant>.onnx or the TorchScript path"""
+    if variant == "fp32":
+        return onnx_path
+    if variant == "torchscript":
+        return config.TORCHSCRIPT_MODEL_PATH
+    base, ext = os.path.splitext(onnx_path)
+    return f"{base}.{variant}{ext}"
+
+def model_size(path):
+    """Bytes of an ONNX model including its external weights file, if any"""
+    return sum(os.path.getsize(p) for p in (path, path + ".data") if os.path.exists(p))
+
+def ensure_dir(path):
+    output_dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+# ------------------------------------------------------
+# Builders
+# ------------------------------------------------------
+def export_model(output_path=config.ONNX_MODEL_PATH):
     print("Loading MobileNetV3 Small model...")
     # Initialize model exactly as in model.py
-    weights = models.MobileNet_V3_Small_Weights.DEFAULT
-    model = models.mobilenet_v3_small(weights=weights)
-    
-    # Replace classifier with Identity to get features
-    model.classifier = torch.nn.Identity()
-    model.eval()
-    
+    model = load_torch_model()
+
     # Create dummy input
     # Shape: (Batch Size, Channels, Height, Width)
     dummy_input = torch.randn(1, 3, 224, 224)
-    
+
     # Output path
-    output_dir = os.path.join(os.path.dirname(__file__), "../serverTS")
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    output_path = os.path.join(output_dir, "model.onnx")
-    
+    ensure_dir(output_path)
+
     print(f"Exporting to {output_path}...")
-    
+
     # Export
     torch.onnx.export(
         model,
@@ -36,8 +59,185 @@ def export_model():
         opset_version=12,
         dynamic_axes={'input': {0: 'batch_size'}, 'output': {0: 'batch_size'}}
     )
-    
+
     print("Export complete!")
 
+def export_torchscript(output_path=config.TORCHSCRIPT_MODEL_PATH):
+    """Trace the model, freeze its weights into the graph and save it for TorchScriptBackend.
+
+    optimize_for_inference() is applied at load time instead: the graph it produces
+    (prepacked, oneDNN-specific ops) does not survive save/load.
+    """
+    model = load_torch_model()
+    ensure_dir(output_path)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+        frozen = torch.jit.freeze(traced)
+    frozen.save(output_path)
+    print(f"Saved TorchScript model to {output_path}")
+
+class CatalogCalibrationReader:
+    """Feeds preprocessed catalog images to ONNX static quantization, one batch at a time"""
+
+    def __init__(self, images, input_name, batch_size=8):
+        self.batches = iter([images[i:i + batch_size] for i in range(0, len(images), batch_size)])
+        self.input_name = input_name
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        if batch is None:
+            return None
+        return {self.input_name: np.stack([preprocess(load_image(image)) for image in batch])}
+
+def quantize_onnx(variant, fp32_path, output_path, calibration_images):
+    """INT8 weights (int8-dynamic) or INT8 weights and activations calibrated on the catalog (int8-static)"""
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    # Fold constants and infer shapes first, as the quantizer expects
+    prepared_path = f"{os.path.splitext(output_path)[0]}.prep.onnx"
+    quant_pre_process(fp32_path, prepared_path)
+    try:
+        if variant == "int8-dynamic":
+            quantize_dynamic(prepared_path, output_path, weight_type=QuantType.QInt8)
+        else:
+            input_name = OnnxBackend(fp32_path).input_name
+            quantize_static(prepared_path, output_path, CatalogCalibrationReader(calibration_images, input_name),
+                            quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                            calibrate_method=CalibrationMethod.MinMax)
+    finally:
+        os.remove(prepared_path)
+    print(f"Saved {variant} model to {output_path} "
+          f"({model_size(output_path) / 2**20:.1f} MB, fp32 {model_size(fp32_path) / 2**20:.1f} MB)")
+
+# ------------------------------------------------------
+# Accuracy Checks
+# ------------------------------------------------------
+def catalog_images(limit=None):
+    """Stored catalog images (from product_images, so thumbnails and stray uploads
+    are left out), or random photos when the catalog is empty"""
+    paths = []
+    if os.path.exists(DB_PATH):
+        # Read-only: DBManager() would migrate and seed the server's database
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+        try:
+            paths = [os.path.join(config.BASE_DIR, image_path)
+                     for image_path, in conn.execute("SELECT image_path FROM product_images ORDER BY id")]
+        finally:
+            conn.close()
+    images = []
+    for path in paths:
+        try:
+            with Image.open(path) as image:
+                image.verify()
+        except Exception:
+            continue
+        images.append(path)
+        if limit and len(images) >= limit:
+            break
+    if not images:
+        print("No catalog images, using random images.")
+        images = [Image.effect_noise((320 + 16 * i, 240), 64).convert("RGB") for i in range(limit or 32)]
+    return images
+
+def embed(backend, images, batch_size=32):
+    """L2-normalized vectors of images, batch_size images per forward pass"""
+    vectors = []
+    for start in range(0, len(images), batch_size):
+        batch = np.stack([preprocess(load_image(image)) for image in images[start:start + batch_size]])
+        vectors.append(backend.run(batch))
+    vectors = np.concatenate(vectors)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def batch_latency(backend, images, batch_size=16, repeat=5):
+    """Best-of-repeat seconds for one forward pass over a batch of catalog images"""
+    batch = np.stack([preprocess(load_image(images[i % len(images)])) for i in range(batch_size)])
+    backend.run(batch)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        backend.run(batch)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def retrieval_agreement(expected, actual, k=5):
+    """Top-1 and top-k agreement of catalog search with variant queries against fp32 queries.
+
+    Every catalog image queries the stored fp32 vectors (leaving itself out), once with
+    its fp32 vector and once with the variant's. Top-1 agreement is the share of queries
+    with the same best match, top-k agreement the mean overlap of the top-k sets.
+    Returns (None, None) for fewer than 2 images, which have no other image to match.
+    """
+    if len(expected) < 2:
+        return None, None
+    k = min(k, len(expected) - 1)
+    expected_scores = expected @ expected.T
+    actual_scores = actual @ expected.T
+    np.fill_diagonal(expected_scores, -np.inf)
+    np.fill_diagonal(actual_scores, -np.inf)
+    expected_top = np.argsort(-expected_scores, axis=1)[:, :k]
+    actual_top = np.argsort(-actual_scores, axis=1)[:, :k]
+    top1 = float(np.mean(expected_top[:, 0] == actual_top[:, 0]))
+    topk = float(np.mean([len(np.intersect1d(e, a)) / k for e, a in zip(expected_top, actual_top)]))
+    return top1, topk
+
+def load_variant(variant, path):
+    if variant == "torchscript":
+        return TorchScriptBackend(path)
+    return OnnxBackend(path)
+
+def verify_variant(variant, path, images, reference, min_top1, min_top5, tolerance=1e-4):
+    """Compare a built variant with the PyTorch fp32 model; returns True when it is accepted"""
+    backend = load_variant(variant, path)
+    actual = embed(backend, images)
+    latency = batch_latency(backend, images)
+    max_diff = float(np.abs(reference - actual).max())
+    min_cosine = float((reference * actual).sum(axis=1).min())
+    top1, top5 = retrieval_agreement(reference, actual)
+    agreement = "no agreement (1 image)" if top1 is None else f"top-1 agreement {top1:.3f} | top-5 agreement {top5:.3f}"
+    print(f"{variant:>13}: {latency * 1000:7.1f} ms/batch of 16 | max abs diff {max_diff:.2e} | min cosine {min_cosine:.6f} | "
+          f"{agreement}")
+
+    # fp32 and TorchScript are exact exports, INT8 variants only need to keep retrieval results
+    if variant in ("fp32", "torchscript"):
+        accepted = max_diff <= tolerance
+    elif top1 is None:
+        print(f"{variant:>13}: retrieval agreement needs at least 2 catalog images, skipping the gate")
+        accepted = True
+    else:
+        accepted = top1 >= min_top1 and top5 >= min_top5
+    print(f"{variant:>13}: {'ACCEPTED' if accepted else 'REJECTED'}")
+    return accepted
+
 if __name__ == "__main__":
-    export_model()
+    parser = argparse.ArgumentParser(description="Build the feature extractor model variants and check them against PyTorch")
+    parser.add_argument("--output", default=config.ONNX_MODEL_PATH, help="fp32 ONNX model path; INT8 variants are written next to it")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=["fp32"])
+    parser.add_argument("--verify-only", action="store_true", help="Skip the build, only check the existing files")
+    parser.add_argument("--limit", type=int, default=500, help="Catalog images used for calibration and agreement")
+    parser.add_argument("--min-top1", type=float, default=0.95, help="Minimum top-1 agreement to accept an INT8 variant")
+    parser.add_argument("--min-top5", type=float, default=0.90, help="Minimum top-5 agreement to accept an INT8 variant")
+    args = parser.parse_args()
+
+    images = catalog_images(args.limit)
+    if not args.verify_only:
+        for variant in args.variants:
+            path = variant_path(variant, args.output)
+            if variant == "fp32":
+                export_model(path)
+            elif variant == "torchscript":
+                export_torchscript(path)
+            else:
+                if not os.path.exists(args.output):
+                    export_model(args.output)
+                quantize_onnx(variant, args.output, path, images[:64])
+
+    print(f"Checking {len(args.variants)} variant(s) on {len(images)} catalog images...")
+    reference = embed(TorchBackend(), images)
+    rejected = [variant for variant in args.variants
+                if not verify_variant(variant, variant_path(variant, args.output), images, reference,
+                                      args.min_top1, args.min_top5)]
+    if rejected:
+        raise SystemExit(f"Rejected variants: {', '.join(rejected)}")
+    print("All variants accepted.")
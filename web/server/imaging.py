@@ -0,0 +1,105 @@
+import io
+import os
+import zipfile
+import numpy as np
+from PIL import Image
+
+from model import crop_image
+from thumbnails import image_digest, save_thumbnails
+
+# ------------------------------------------------------
+# Image Processing
+# Plain module-level functions so they can run in import worker processes.
+# ------------------------------------------------------
+def process_and_save_image(image_data: bytes, save_path: str, max_width: int = 800):
+    """Resize and save image, returning the processed PIL image (None on failure)"""
+    try:
+        img = Image.open(io.BytesIO(image_data))
+
+        # Convert to RGB if needed
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        # Resize if width > max_width
+        if img.width > max_width:
+            ratio = max_width / img.width
+            new_height = int(img.height * ratio)
+            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
+
+        img.save(save_path, quality=85, optimize=True)
+        return img
+    except Exception as e:
+        print(f"Error processing image: {e}")
+        return None
+
+def store_image(image_data: bytes, save_path: str, max_width: int = 800, digest=None):
+    """Resize and save an uploaded image plus its thumbnails; digest is its content hash
+    when the caller has it already. Returns (processed PIL image, content hash), or (None, None) on failure."""
+    img = process_and_save_image(image_data, save_path, max_width)
+    if img is None:
+        return None, None
+    digest = digest or image_digest(image_data)
+    try:
+        save_thumbnails(img, digest)
+    except Exception as e:
+        print(f"Error saving thumbnails for {save_path}: {e}")
+        os.remove(save_path)
+        return None, None
+    return img, digest
+
+def perceptual_hash(image_data: bytes, size: int = 8):
+    """Difference hash of an encoded image: size * size bits comparing neighbouring pixels
+    of a tiny grayscale copy, so re-encoded or resized copies differ in few bits, if any.
+    Returns the bits as an int, or None when the data is not a readable image."""
+    try:
+        img = Image.open(io.BytesIO(image_data))
+        # JPEG only: decode at a fraction of the size, plenty for a 9x8 thumbnail
+        img.draft('L', (size * 8, size * 8))
+        pixels = np.asarray(img.convert('L').resize((size + 1, size), Image.Resampling.BILINEAR), dtype=np.int16)
+    except Exception:
+        return None
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+# Zip archive opened by this worker process, reused for every entry of an import
+_zip_file = None
+
+def _open_zip(zip_path):
+    global _zip_file
+    if _zip_file is None or _zip_file.filename != zip_path:
+        if _zip_file is not None:
+            _zip_file.close()
+        _zip_file = zipfile.ZipFile(zip_path)
+    return _zip_file
+
+def prepare_zip_entry(zip_path, member, save_path, skip_hashes=(), max_width=800):
+    """Read one zip member, resize and save it with its thumbnails, and return
+    (model input crop, content hash).
+
+    Runs in an import worker. The entry is read from the spooled archive on disk so
+    only the small (224, 224, 3) uint8 crop travels back to the parent. An entry whose
+    content hash is in skip_hashes is a copy of a stored image and returns (None, hash)
+    without being decoded. Returns None when the entry is not a readable image.
+    """
+    try:
+        data = _open_zip(zip_path).read(member)
+    except Exception as e:
+        print(f"Error reading zip entry {member}: {e}")
+        return None
+    digest = image_digest(data)
+    if digest in skip_hashes:
+        return None, digest
+    image, digest = store_image(data, save_path, max_width, digest)
+    if image is None:
+        return None
+    return crop_image(image), digest
+
+def prepare_stored_image(path):
+    """Read a stored image and return its model input crop, or None when it can't be read.
+    Runs in an import worker for reindex.py."""
+    try:
+        with Image.open(path) as img:
+            return crop_image(img.convert('RGB'))
+    except Exception as e:
+        print(f"Error reading stored image {path}: {e}")
+        return None
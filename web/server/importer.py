@@ -0,0 +1,307 @@
+import collections
+import os
+import zipfile
+from datetime import datetime
+import numpy as np
+
+import config
+import executors
+from imaging import prepare_zip_entry
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+# ------------------------------------------------------
+# Zip Entry Parsing
+# ------------------------------------------------------
+def fix_zip_filename(filename):
+    """Fix encoding issues with zip filenames"""
+    try:
+        # If it was decoded as CP437 (default for non-utf8 flagged zips), recover bytes
+        bytes_name = filename.encode('cp437')
+    except:
+        return filename
+
+    # Try decoding as UTF-8 first
+    try:
+        return bytes_name.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+
+    # Try decoding as GBK
+    try:
+        return bytes_name.decode('gbk')
+    except UnicodeDecodeError:
+        pass
+
+    # Try decoding as Big5
+    try:
+        return bytes_name.decode('big5')
+    except UnicodeDecodeError:
+        pass
+
+    return filename
+
+def parse_entry_name(decoded_filename):
+    """Folder/Image.jpg -> (model_name, product_name, price, file_name)"""
+    parts = decoded_filename.split('/')
+
+    # Handle cases where zip might be flat or nested deeper
+    if len(parts) >= 2:
+        folder_name = parts[-2]
+        file_name = parts[-1]
+
+        # Parse folder name: Model_Name[_Price]
+        parts_name = folder_name.split('_')
+
+        # Default values
+        model_name = parts_name[0]
+        product_name = ""
+        price_val = 0.0
+
+        if len(parts_name) >= 3:
+            # Case: Model_Name_Price (CS001_PearlNecklace_199)
+            # We assume last part is price if it looks like a number
+            possible_price = parts_name[-1]
+            try:
+                price_val = float(possible_price)
+                # Name is everything in between
+                product_name = "_".join(parts_name[1:-1])
+            except ValueError:
+                # Maybe it's just a long name with underscores?
+                # Let's fallback: Model_Name (where Name has underscores)
+                product_name = "_".join(parts_name[1:])
+        elif len(parts_name) == 2:
+            # Case: Model_Name OR Model_Price
+            possible_second = parts_name[1]
+            try:
+                price_val = float(possible_second)
+                # So it is Model_Price, name is empty
+                product_name = ""
+            except ValueError:
+                # It is Model_Name
+                product_name = possible_second
+        else:
+            # Case: Model (CS001)
+            pass
+    else:
+        file_name = parts[-1]
+        model_name = os.path.splitext(file_name)[0]
+        product_name = ""
+        price_val = 0.0
+
+    # Clean names
+    return model_name.strip(), product_name.strip(), price_val, file_name
+
+ZipEntry = collections.namedtuple("ZipEntry", "member model_name product_name price save_name")
+
+def iter_zip_entries(zip_file):
+    """Yield a ZipEntry for every image in the archive, reading only the central directory"""
+    for filename in zip_file.namelist():
+        # Skip hidden files and directories
+        if filename.startswith('__MACOSX') or filename.endswith('/'):
+            continue
+
+        # Fix encoding
+        decoded_filename = fix_zip_filename(filename)
+        if not decoded_filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        model_name, product_name, price_val, file_name = parse_entry_name(decoded_filename)
+
+        # Generate save name, sanitizing filename characters
+        save_name = f"{model_name}_{file_name}"
+        save_name = "".join([c for c in save_name if c.isalnum() or c in "._-"])
+        yield ZipEntry(filename, model_name, product_name, price_val, save_name)
+
+# ------------------------------------------------------
+# Import Pipeline
+# ------------------------------------------------------
+# An image waiting for feature extraction; content_hash names its thumbnails, member is its zip entry when importing a job
+PendingImage = collections.namedtuple("PendingImage", "product_id db_path save_path image content_hash member", defaults=(None, None))
+
+def drop_near_duplicates(db, stored, min_score):
+    """Split extracted (PendingImage, vector) pairs into the ones to store and the ones whose
+    embedding scores at least min_score against an image of the same product, stored or
+    earlier in the list. Vectors are L2-normalized, so the dot product is the cosine similarity."""
+    known = db.get_vectors_by_products(list({item.product_id for item, _ in stored}))
+    kept, dropped = [], []
+    for item, vector in stored:
+        vectors = known.get(item.product_id)
+        if vectors is not None and float(np.max(vectors @ vector)) >= min_score:
+            dropped.append(item)
+            continue
+        kept.append((item, vector))
+        known[item.product_id] = vector[None, :] if vectors is None else np.vstack([vectors, vector])
+    return kept, dropped
+
+def store_extracted_images(db, extractor, pending, job_id=None, failed_members=(), created_products=0, skipped_members=()):
+    """Extract features for PendingImage entries in batched forward passes and store
+    them in one transaction, skipping copies of images their product already has.
+    With job_id the handled zip members (and failed_members, skipped_members) and the
+    job counters are recorded in the same transaction.
+    Returns (images added, images skipped as duplicates including skipped_members)."""
+    vectors, errors = executors.inference(extractor.extract_batch, [item.image for item in pending]) if pending else ([], [])
+    stored = []
+    failed = list(failed_members)
+    for item, vector, error in zip(pending, vectors, errors):
+        if error is None:
+            stored.append((item, vector))
+        else:
+            print(f"Error extracting features for {item.save_path}: {error}")
+            failed.append(item.member)
+            if os.path.exists(item.save_path):
+                os.remove(item.save_path)
+    dropped = []
+    if config.IMPORT_NEAR_DUPLICATE_SCORE > 0 and stored:
+        stored, dropped = drop_near_duplicates(db, stored, config.IMPORT_NEAR_DUPLICATE_SCORE)
+    skipped = list(skipped_members) + [item.member for item in dropped]
+    if job_id is not None:
+        image_ids = db.record_import_batch(job_id, [(item.member, item.product_id, item.db_path, vector, item.content_hash) for item, vector in stored],
+                                           failed, created_products, skipped)
+    else:
+        image_ids = db.add_product_images_bulk([(item.product_id, item.db_path, vector, item.content_hash) for item, vector in stored])
+    # Copies the database already had (e.g. stored concurrently) are skipped there
+    dropped += [item for (item, _), image_id in zip(stored, image_ids) if image_id is None]
+    # Their thumbnails are left alone: an image still being imported may share them
+    kept_paths = {item.save_path for (item, _), image_id in zip(stored, image_ids) if image_id is not None}
+    for item in dropped:
+        if item.save_path not in kept_paths and os.path.exists(item.save_path):
+            os.remove(item.save_path)
+    return sum(image_id is not None for image_id in image_ids), len(skipped_members) + len(dropped)
+
+def resolve_products(db, batch_products, entries):
+    """Map every entry's model to a product id in batch_products, looking up unseen
+    models in one query and creating the missing products in one transaction.
+    Existing products get the name/price of their first entry, if provided.
+    Returns how many products were created."""
+    # First entry of each model not handled earlier in this import
+    first_entries = {}
+    for entry in entries:
+        if entry.model_name not in batch_products:
+            first_entries.setdefault(entry.model_name, entry)
+    if not first_entries:
+        return 0
+
+    existing_products = db.get_products_by_models(list(first_entries))
+    new_entries = []
+    for model_name, entry in first_entries.items():
+        existing_product = existing_products.get(model_name)
+        if not existing_product:
+            new_entries.append(entry)
+            continue
+        pid = existing_product['id']
+        print(f"Found existing product for model '{model_name}': ID {pid}")
+
+        # Update product name/price if provided
+        new_name = entry.product_name if entry.product_name else existing_product['product_name']
+        new_price = entry.price if entry.price > 0 else existing_product['price']
+
+        if new_name != existing_product['product_name'] or new_price != existing_product['price']:
+            db.update_product(pid, model_name, new_name, new_price, existing_product['maintenance_time'])
+        batch_products[model_name] = pid
+
+    # Create new
+    created_at = datetime.now().strftime("%Y-%m-%d")
+    pids = db.add_products_bulk([(e.model_name, e.product_name, e.price, created_at) for e in new_entries])
+    for entry, pid in zip(new_entries, pids):
+        print(f"Created new product for model '{entry.model_name}': ID {pid}")
+        batch_products[entry.model_name] = pid
+    return len(new_entries)
+
+def import_zip(db, extractor, zip_path, batch_dir_name, batch_dir_path, job_id=None):
+    """Import every image entry of a zip archive spooled to disk (blocking, run on a worker thread).
+
+    Stages: this thread walks the central directory and queues entries to the
+    worker processes, which read, resize and save each image and return its model
+    crop; finished crops are embedded extractor.batch_size at a time and written
+    to the DB in one transaction per batch. At most config.IMPORT_QUEUE_SIZE entries
+    are in flight, so memory stays flat however large the archive is.
+
+    Entries whose content hash the product already has, or an earlier entry of the
+    archive had, are skipped; the workers skip the known ones before decoding.
+
+    With job_id, progress is recorded per entry in import_job_entries and entries
+    handled by an earlier run of the job are skipped.
+    Returns (new products count, added images count, skipped duplicates count).
+    """
+    # Key: model_name, Value: product_id
+    batch_products = {}
+    count = 0
+    updated_count = 0
+    skipped_count = 0
+    # Entries queued to the workers, in zip order
+    in_flight = collections.deque()
+    # Decoded (entry, save_path, (crop, content hash)) waiting for a batched forward pass,
+    # and entries that failed to decode or were skipped as copies
+    pending = []
+    failed = []
+    skipped = []
+    # Key: model_name, Value: content hashes stored or accepted in this import; save paths of accepted entries
+    known_hashes = {}
+    kept_paths = set()
+
+    def flush():
+        nonlocal count, updated_count, skipped_count, pending, failed, skipped
+        # Products are created per batch, and only for entries that decoded
+        created = resolve_products(db, batch_products, [entry for entry, _, _ in pending])
+        count += created
+        images = [PendingImage(batch_products[entry.model_name], os.path.join("uploads", batch_dir_name, entry.save_name),
+                               save_path, crop, digest, entry.member)
+                  for entry, save_path, (crop, digest) in pending]
+        added, skipped_images = store_extracted_images(db, extractor, images, job_id, failed, created, skipped)
+        updated_count += added
+        skipped_count += skipped_images
+        pending = []
+        failed = []
+        skipped = []
+
+    def collect():
+        entry, save_path, future = in_flight.popleft()
+        try:
+            prepared = future.result()
+        except Exception as e:
+            if executors.stopping.is_set():
+                raise
+            print(f"Error processing zip entry {entry.member}: {e}")
+            prepared = None
+        if prepared is None:
+            failed.append(entry.member)
+            return
+        crop, digest = prepared
+        hashes = known_hashes.setdefault(entry.model_name, set())
+        if crop is None or digest in hashes:
+            # A copy of a stored image (not decoded), or of an earlier entry (saved, unless at the same path)
+            skipped.append(entry.member)
+            if crop is not None and save_path not in kept_paths and os.path.exists(save_path):
+                os.remove(save_path)
+        else:
+            hashes.add(digest)
+            kept_paths.add(save_path)
+            pending.append((entry, save_path, prepared))
+        # Skipped entries are flushed too, so a re-imported archive still shows progress
+        if len(pending) >= extractor.batch_size or len(skipped) >= config.IMPORT_QUEUE_SIZE:
+            flush()
+
+    with zipfile.ZipFile(zip_path) as zip_file:
+        entries = list(iter_zip_entries(zip_file))
+        if job_id is not None:
+            db.set_import_job_total(job_id, len(entries))
+            handled = db.get_import_job_members(job_id)
+            entries = [entry for entry in entries if entry.member not in handled]
+        known_hashes.update(db.get_hashes_by_models(list({entry.model_name for entry in entries})))
+
+        for entry in entries:
+            save_path = os.path.join(batch_dir_path, entry.save_name)
+            # A snapshot: the set keeps growing while the pool pickles the task
+            skip_hashes = frozenset(known_hashes.get(entry.model_name, ()))
+            future = executors.submit_image_task(prepare_zip_entry, zip_path, entry.member, save_path, skip_hashes)
+            in_flight.append((entry, save_path, future))
+            # Backpressure: wait for the oldest entry before reading further
+            if len(in_flight) >= config.IMPORT_QUEUE_SIZE:
+                collect()
+
+    while in_flight:
+        collect()
+    flush()
+
+    return count, updated_count, skipped_count
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import config
+import executors
+from importer import import_zip
+
+def handled_entries(job):
+    """Zip entries a job has stored, given up on or skipped as duplicates"""
+    return job["processed"] + job["failed"] + job["skipped"]
+
+# ------------------------------------------------------
+# Background Import Jobs
+# ------------------------------------------------------
+class ImportJobs:
+    """Runs /batch-update imports in the background, IMPORT_JOBS at a time.
+
+    Job rows and per-entry progress live in SQLite (import_jobs, import_job_entries),
+    and the spooled archive stays in IMPORT_DIR until the job finishes, so resume()
+    picks up unfinished jobs after a restart without re-embedding stored entries.
+    """
+
+    def __init__(self, db, extractor, uploads_dir):
+        self.db = db
+        self.extractor = extractor
+        self.uploads_dir = uploads_dir
+        self.pool = ThreadPoolExecutor(max_workers=config.IMPORT_JOBS, thread_name_prefix="goodsai-import")
+        # job_id -> [run start, entries handled before this run, run end]; for throughput
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, filename, zip_path, user):
+        """Queue an import of a spooled zip archive, returning the job id"""
+        job_id = uuid.uuid4().hex
+        batch_dir_name = f"batch_{int(datetime.now().timestamp())}_{job_id[:8]}"
+        self.db.create_import_job(job_id, filename, zip_path, batch_dir_name, user["id"], user["username"])
+        self.pool.submit(self._run, job_id)
+        return job_id
+
+    def resume(self):
+        """Re-queue jobs that were queued or running when the server stopped"""
+        for job in self.db.get_unfinished_import_jobs():
+            if os.path.exists(job["zip_path"]):
+                print(f"Resuming import job {job['id']} ({handled_entries(job)}/{job['total']} entries done)")
+                self.pool.submit(self._run, job["id"])
+            else:
+                self.db.set_import_job_status(job["id"], "failed", "Spooled archive is missing")
+
+    def _run(self, job_id):
+        job = self.db.get_import_job(job_id)
+        self.db.set_import_job_status(job_id, "running")
+        with self._lock:
+            self._runs[job_id] = [time.perf_counter(), handled_entries(job), None]
+
+        batch_dir_path = os.path.join(self.uploads_dir, job["batch_dir"])
+        os.makedirs(batch_dir_path, exist_ok=True)
+        try:
+            import_zip(self.db, self.extractor, job["zip_path"], job["batch_dir"], batch_dir_path, job_id=job_id)
+        except BaseException as e:
+            # Interrupted by shutdown: keep the job "running" so the next start resumes it
+            if executors.stopping.is_set():
+                return
+            print(f"Import job {job_id} failed: {e}")
+            self.db.set_import_job_status(job_id, "failed", str(e))
+            return
+        finally:
+            with self._lock:
+                self._runs[job_id][2] = time.perf_counter()
+
+        self.db.set_import_job_status(job_id, "done")
+        job = self.db.get_import_job(job_id)
+        self.db.add_log(job["user_id"], job["username"], "BATCH_UPDATE",
+                        f"Processed {job['created_products']} new products, {job['processed']} images, skipped {job['skipped']} duplicates")
+        os.remove(job["zip_path"])
+
+    def get(self, job_id):
+        """Job progress: counts, throughput in images/s and ETA in seconds"""
+        job = self.db.get_import_job(job_id)
+        if job is None:
+            return None
+        done = handled_entries(job)
+        rate = None
+        with self._lock:
+            run = self._runs.get(job_id)
+        if run is not None:
+            start, done_before, end = run
+            elapsed = (end or time.perf_counter()) - start
+            if elapsed > 0 and done > done_before:
+                rate = (done - done_before) / elapsed
+        eta = None
+        if job["status"] == "running" and rate:
+            eta = max(0, job["total"] - done) / rate
+
+        return {
+            "id": job["id"],
+            "filename": job["filename"],
+            "status": job["status"],
+            "total": job["total"],
+            "processed": job["processed"],
+            "failed": job["failed"],
+            "skipped": job["skipped"],
+            "processed_products_count": job["created_products"],
+            "updated_images_count": job["processed"],
+            "images_per_second": rate,
+            "eta_seconds": eta,
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"]
+        }
+
+    def after_fork(self):
+        """In a forked server worker: start a pool of its own"""
+        self.pool = ThreadPoolExecutor(max_workers=config.IMPORT_JOBS, thread_name_prefix="goodsai-import")
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -1,21 +1,43 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Depends, status
+import time
+# Start of the import phase, the first one timed at startup
+STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Depends, status, Response, Header
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import shutil
+import sqlite3
 import os
+import threading
 import zipfile
-import io
+import tempfile
 import aiofiles
 from datetime import datetime, timedelta
-from PIL import Image
 from jose import JWTError, jwt
 import bcrypt
 
+import config
 from model import FeatureExtractor
 from database import DBManager
+from vector_store import VectorStore
+from response_cache import ResponseCache, json_body, etag_matches
+from recognition_cache import RecognitionCache, content_key
+from batcher import MicroBatcher
+from imaging import store_image, perceptual_hash
+from thumbnails import THUMBNAIL_DIR, image_digest, remove_thumbnails
+from importer import PendingImage, store_extracted_images
+from jobs import ImportJobs
+from startup import Startup
+import executors
+import reindex
+from executors import run_io, run_inference
+
+# Phase timings and readiness, reported by GET /ready
+startup = Startup(STARTED)
+startup.record("imports", time.perf_counter() - STARTED)
 
 app = FastAPI(title="GoodsAI API")
 
@@ -26,6 +48,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
 
 # Initialize
@@ -34,12 +57,121 @@ UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 print(f"UPLOADS_DIR: {UPLOADS_DIR}")
 
-db = DBManager()
-# Lazy load model only when needed or at startup
-ai_model = FeatureExtractor()
+# Fork the zip import workers while the process is still small and has no sockets.
+# Server workers (config.SERVER_WORKERS > 1) fork their own on first use instead.
+if config.SERVER_WORKERS <= 1:
+    executors.start_process_pool()
+
+with startup.phase("db init"):
+    db = DBManager()
+
+# Loaded by load_model_and_index(); the endpoints that need it answer 503 until then
+ai_model = None
+
+# Resident vector matrix for /recognize, kept in sync by DBManager image writes.
+# Attached before it loads: only deletes (no model needed) reach it early, and wait for the load.
+vector_store = VectorStore()
+db.vector_store = vector_store
+# Public product responses, invalidated by DBManager catalog writes
+response_cache = ResponseCache(max_entries=config.RESPONSE_CACHE_SIZE, ttl=config.RESPONSE_CACHE_TTL)
+db.response_cache = response_cache
+
+async def sync_workers():
+    """Dependency of the routes served from the vector store or the caches: apply the catalog
+    writes of sibling server workers first, so no response predates them"""
+    if config.SERVER_WORKERS > 1 and await run_io(db.catalog_behind):
+        await run_io(db.sync_catalog)
+
+@app.on_event("shutdown")
+def on_shutdown():
+    # Persist ANN state so the next start can skip training
+    if startup.ready.is_set():
+        vector_store.save()
+    query_batcher.close()
+    import_jobs.shutdown()
+    executors.shutdown()
+
+def extract_query_vectors(items):
+    """Batch function for the recognize micro-batcher: one vector (or None) per item"""
+    vectors, errors = ai_model.extract_batch(items)
+    return [vector if error is None else None for vector, error in zip(vectors, errors)]
+
+# Concurrent /recognize queries share one forward pass
+query_batcher = MicroBatcher(extract_query_vectors, max_batch=config.RECOGNIZE_MAX_BATCH,
+                             max_wait_ms=config.RECOGNIZE_MAX_WAIT_MS, executor=executors.inference_pool)
+# Re-uploaded photos reuse their embedding, and their results until the catalog changes
+recognition_cache = RecognitionCache(max_entries=config.RECOGNIZE_CACHE_SIZE)
+
+# Zip imports run as background jobs; pick up any interrupted by the last shutdown
+os.makedirs(config.IMPORT_DIR, exist_ok=True)
+import_jobs = ImportJobs(db, ai_model, UPLOADS_DIR)
+# Cleared in all server workers but the first, so no job is resumed twice
+resume_import_jobs = True
+
+def load_model_and_index():
+    """Load the model and the vectors (blocking)"""
+    global ai_model
+    with startup.phase("model load"):
+        ai_model = FeatureExtractor()
+    import_jobs.extractor = ai_model
+    # Vectors of another model version can't be searched with this model: finish the re-index and switch first
+    with startup.phase("reindex catch-up"):
+        reindex.catch_up(db, ai_model)
+    with startup.phase("index load"):
+        vector_store.load(db)
+
+def warm_up():
+    """Load what is still missing, run the model once, then report ready and resume imports"""
+    try:
+        if ai_model is None:
+            load_model_and_index()
+        with startup.phase("model warm-up"):
+            executors.inference(ai_model.warm_up)
+    except Exception as e:
+        startup.fail(e)
+        return
+    startup.mark_ready()
+    if resume_import_jobs:
+        import_jobs.resume()
+
+# Server workers fork after this, sharing what was loaded (see serve_workers())
+if config.STARTUP_MODE == "blocking" or config.SERVER_WORKERS > 1:
+    load_model_and_index()
+
+@app.on_event("startup")
+def on_startup():
+    if config.STARTUP_MODE == "blocking":
+        warm_up()
+    else:
+        # Serve the non-AI endpoints meanwhile
+        threading.Thread(target=warm_up, name="goodsai-warmup", daemon=True).start()
+
+def require_ready():
+    """Dependency of the endpoints that need the model or the vector index"""
+    if not startup.ready.is_set():
+        detail = f"Model failed to load: {startup.error}" if startup.error else "Model is loading, retry shortly"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+# Upper bound for the top_k query parameter of /recognize
+RECOGNIZE_MAX_TOP_K = 100
 
 # Mount static files
-app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
+THUMBNAIL_REAL_DIR = os.path.realpath(THUMBNAIL_DIR)
+
+class UploadFiles(StaticFiles):
+    """Uploaded images with browser caching. Thumbnails are named by content hash and never
+    change, so they are cached for a year; originals are revalidated by ETag after
+    UPLOADS_MAX_AGE. ETag/If-None-Match and Range requests are handled by StaticFiles."""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if os.path.dirname(os.path.realpath(full_path)) == THUMBNAIL_REAL_DIR:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={config.UPLOADS_MAX_AGE}"
+        return response
+
+app.mount("/uploads", UploadFiles(directory=UPLOADS_DIR), name="uploads")
 
 # ------------------------------------------------------
 # Security Configuration
@@ -97,6 +229,9 @@ class PasswordReset(BaseModel):
 def verify_password(plain_password, hashed_password):
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
+def hash_password(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -114,55 +249,6 @@ def save_upload_file(file: UploadFile, destination: str):
     finally:
         file.file.close()
 
-def process_and_save_image(image_data: bytes, save_path: str, max_width: int = 800):
-    """Resize and save image"""
-    try:
-        img = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if needed
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-            
-        # Resize if width > max_width
-        if img.width > max_width:
-            ratio = max_width / img.width
-            new_height = int(img.height * ratio)
-            img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-            
-        img.save(save_path, quality=85, optimize=True)
-        return True
-    except Exception as e:
-        print(f"Error processing image: {e}")
-        return False
-
-def fix_zip_filename(filename):
-    """Fix encoding issues with zip filenames"""
-    try:
-        # If it was decoded as CP437 (default for non-utf8 flagged zips), recover bytes
-        bytes_name = filename.encode('cp437')
-    except:
-        return filename
-
-    # Try decoding as UTF-8 first
-    try:
-        return bytes_name.decode('utf-8')
-    except UnicodeDecodeError:
-        pass
-        
-    # Try decoding as GBK
-    try:
-        return bytes_name.decode('gbk')
-    except UnicodeDecodeError:
-        pass
-    
-    # Try decoding as Big5
-    try:
-        return bytes_name.decode('big5')
-    except UnicodeDecodeError:
-        pass
-
-    return filename
-
 # ------------------------------------------------------
 # Dependencies
 # ------------------------------------------------------
@@ -182,7 +268,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    user = db.get_user(username=token_data.username)
+    user = await run_io(db.get_user, token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -198,8 +284,8 @@ async def get_current_admin(current_user: dict = Depends(get_current_user)):
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = db.get_user(form_data.username)
-    if not user or not verify_password(form_data.password, user["password_hash"]):
+    user = await run_io(db.get_user, form_data.username)
+    if not user or not await run_io(verify_password, form_data.password, user["password_hash"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -211,7 +297,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     
     # Log login
-    db.add_log(user["id"], user["username"], "LOGIN", "User logged in")
+    await run_io(db.add_log, user["id"], user["username"], "LOGIN", "User logged in")
     
     return {"access_token": access_token, "token_type": "bearer", "role": user["role"], "username": user["username"]}
 
@@ -225,33 +311,33 @@ async def change_password(
     current_user: dict = Depends(get_current_user)
 ):
     # Verify old password
-    if not verify_password(pwd.old_password, current_user["password_hash"]):
+    if not await run_io(verify_password, pwd.old_password, current_user["password_hash"]):
         raise HTTPException(status_code=400, detail="旧密码错误")
     
     # Hash new password
-    hashed = bcrypt.hashpw(pwd.new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    db.update_password(current_user["id"], hashed)
+    hashed = await run_io(hash_password, pwd.new_password)
+    await run_io(db.update_password, current_user["id"], hashed)
     
-    db.add_log(current_user["id"], current_user["username"], "CHANGE_PASSWORD", "User changed password")
+    await run_io(db.add_log, current_user["id"], current_user["username"], "CHANGE_PASSWORD", "User changed password")
     return {"status": "ok"}
 
 @app.get("/users")
 async def get_all_users(current_user: dict = Depends(get_current_admin)):
-    return db.get_all_users()
+    return await run_io(db.get_all_users)
 
 @app.post("/users")
 async def create_user(
     user: UserCreate, 
     current_user: dict = Depends(get_current_admin)
 ):
-    if db.get_user(user.username):
+    if await run_io(db.get_user, user.username):
         raise HTTPException(status_code=400, detail="用户名已存在")
         
-    hashed = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    uid = db.add_user(user.username, hashed, user.role)
+    hashed = await run_io(hash_password, user.password)
+    uid = await run_io(db.add_user, user.username, hashed, user.role)
     
     if uid:
-        db.add_log(current_user["id"], current_user["username"], "CREATE_USER", f"Created user {user.username}")
+        await run_io(db.add_log, current_user["id"], current_user["username"], "CREATE_USER", f"Created user {user.username}")
         return {"status": "created", "id": uid}
     else:
         raise HTTPException(status_code=500, detail="创建用户失败")
@@ -262,14 +348,17 @@ async def delete_user(user_id: int, current_user: dict = Depends(get_current_adm
         raise HTTPException(status_code=400, detail="不能删除自己")
     
     # Check if target user is 'admin'
-    cursor = db.conn.cursor()
-    cursor.execute("SELECT username FROM users WHERE id=?", (user_id,))
-    row = cursor.fetchone()
-    if row and row[0] == 'admin':
+    def username():
+        cursor = db.reader().cursor()
+        cursor.execute("SELECT username FROM users WHERE id=?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    if await run_io(username) == 'admin':
         raise HTTPException(status_code=400, detail="不能删除系统默认管理员")
         
-    db.delete_user(user_id)
-    db.add_log(current_user["id"], current_user["username"], "DELETE_USER", f"Deleted user ID {user_id}")
+    await run_io(db.delete_user, user_id)
+    await run_io(db.add_log, current_user["id"], current_user["username"], "DELETE_USER", f"Deleted user ID {user_id}")
     return {"status": "deleted"}
 
 @app.post("/users/{user_id}/reset-password")
@@ -278,49 +367,94 @@ async def reset_password(
     pwd: PasswordReset,
     current_user: dict = Depends(get_current_admin)
 ):
-    hashed = bcrypt.hashpw(pwd.new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-    db.update_password(user_id, hashed)
-    db.add_log(current_user["id"], current_user["username"], "RESET_PASSWORD", f"Reset password for user ID {user_id}")
+    hashed = await run_io(hash_password, pwd.new_password)
+    await run_io(db.update_password, user_id, hashed)
+    await run_io(db.add_log, current_user["id"], current_user["username"], "RESET_PASSWORD", f"Reset password for user ID {user_id}")
     return {"status": "ok"}
 
+def page_headers(next_after, total):
+    """Pagination metadata in headers, so list bodies stay plain arrays.
+    The total is only counted for the first page of a cursor walk."""
+    headers = {}
+    if next_after:
+        headers["X-Next-Cursor"] = next_after
+    if total is not None:
+        headers["X-Total-Count"] = str(total)
+    return headers
+
 @app.get("/logs")
 async def get_logs(
+    response: Response,
     limit: int = 20, 
     offset: int = 0, 
     search: Optional[str] = None, 
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_admin)
 ):
-    return db.get_logs(limit=limit, offset=offset, search=search)
+    try:
+        logs, next_after = await run_io(db.get_logs_page, limit=limit, search=search, after=after, offset=offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers.update(page_headers(next_after, None if after else await run_io(db.count_logs, search)))
+    return logs
 
 @app.delete("/logs")
 async def delete_logs(current_user: dict = Depends(get_current_admin)):
     # Delete logs older than 3 months
-    count = db.delete_old_logs(months=3)
-    db.add_log(current_user["id"], current_user["username"], "DELETE_LOGS", f"Deleted {count} old logs")
+    count = await run_io(db.delete_old_logs, months=3)
+    await run_io(db.add_log, current_user["id"], current_user["username"], "DELETE_LOGS", f"Deleted {count} old logs")
     return {"status": "deleted", "count": count}
 
 # ------------------------------------------------------
 # Product Endpoints
 # ------------------------------------------------------
 
-@app.get("/products")
+def cached_json(key, build, if_none_match):
+    """Serve a public GET from response_cache, building it on a miss, and answer 304
+    when the client already has this version. build() -> (data, product_ids, headers)"""
+    entry = response_cache.get(key)
+    if entry is None:
+        generation = response_cache.generation
+        data, product_ids, headers = build()
+        entry = response_cache.put(key, json_body(data), product_ids, headers, generation)
+    # Clients may keep a copy but revalidate it with If-None-Match on every use
+    headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+    if etag_matches(entry.etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+@app.get("/products", dependencies=[Depends(sync_workers)])
 def get_products(
     limit: int = 20, 
     offset: int = 0, 
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None)
 ):
     # Public access
-    return db.get_all_products(limit=limit, offset=offset, search=search)
+    def build():
+        try:
+            products, next_after = db.get_products_page(limit=limit, search=search, sort=sort, after=after, offset=offset)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return products, [p["id"] for p in products], page_headers(next_after, None if after else db.count_products(search))
+
+    key = (ResponseCache.LIST, limit, offset, search, sort, after)
+    return cached_json(key, build, if_none_match)
 
-@app.get("/products/{pid}")
-def get_product_detail(pid: int):
+@app.get("/products/{pid}", dependencies=[Depends(sync_workers)])
+def get_product_detail(pid: int, if_none_match: Optional[str] = Header(None)):
     # Public access
-    product = db.get_product_by_id(pid)
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    def build():
+        product = db.get_product_by_id(pid)
+        if not product:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return product, [pid], {}
 
-@app.post("/products")
+    return cached_json(("product", pid), build, if_none_match)
+
+@app.post("/products", dependencies=[Depends(require_ready)])
 async def create_product(
     model_name: str = Form(...),
     product_name: str = Form(""),
@@ -330,9 +464,13 @@ async def create_product(
     current_user: dict = Depends(get_current_admin)
 ):
     # Create product entry first
-    pid = db.add_product(model_name, product_name, price, maintenance_time)
+    pid = await run_io(db.add_product, model_name, product_name, price, maintenance_time)
+    if pid is None:
+        raise HTTPException(status_code=400, detail="型号已存在")
     
-    count = 0
+    pending = []
+    hashes = set()
+    skipped = 0
     for file in files:
         filename = f"{pid}_{datetime.now().timestamp()}_{file.filename}"
         filepath = os.path.join(UPLOADS_DIR, filename)
@@ -341,27 +479,37 @@ async def create_product(
         # Read file content
         content = await file.read()
         
-        # Process and save image
-        if process_and_save_image(content, filepath):
-            # Extract features
-            vector = ai_model.extract(filepath)
-            if vector is not None:
-                db.add_product_image(pid, db_path, vector)
-                count += 1
-            else:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
+        # The same picture selected twice is stored once
+        digest = image_digest(content)
+        if digest in hashes:
+            skipped += 1
+            continue
+        hashes.add(digest)
+        
+        # Process and save image with its thumbnails
+        image, digest = await run_io(store_image, content, filepath, 800, digest)
+        if image is not None:
+            pending.append(PendingImage(pid, db_path, filepath, image, digest))
+    
+    # Extract features for all images in batched forward passes
+    count, duplicates = await run_io(store_extracted_images, db, ai_model, pending)
     
     # Log
-    db.add_log(current_user["id"], current_user["username"], "CREATE_PRODUCT", f"Created product {model_name} (ID: {pid})")
+    await run_io(db.add_log, current_user["id"], current_user["username"], "CREATE_PRODUCT", f"Created product {model_name} (ID: {pid})")
         
-    return {"id": pid, "status": "created", "images_count": count}
+    return {"id": pid, "status": "created", "images_count": count, "skipped_count": skipped + duplicates}
+
+def delete_thumbnails(hashes):
+    """Delete the thumbnails of deleted images, unless another image has the same content"""
+    for digest in db.get_unused_hashes(hashes):
+        remove_thumbnails(digest)
 
 # Define specific routes BEFORE generic ones
 @app.post("/products/batch-delete")
 def batch_delete_products(request: BatchDeleteRequest, current_user: dict = Depends(get_current_admin)):
     # Get image paths first
     images = db.get_products_images(request.ids)
+    hashes = db.get_image_hashes(request.ids)
     
     # Delete from DB
     db.delete_products(request.ids)
@@ -373,6 +521,7 @@ def batch_delete_products(request: BatchDeleteRequest, current_user: dict = Depe
                 os.remove(path)
             except Exception as e:
                 print(f"Error deleting file {path}: {e}")
+    delete_thumbnails(hashes)
     
     db.add_log(current_user["id"], current_user["username"], "BATCH_DELETE", f"Deleted products: {request.ids}")
                 
@@ -385,7 +534,8 @@ def reorder_images(request: ReorderImagesRequest, current_user: dict = Depends(g
 
 @app.put("/products/{pid}")
 def update_product(pid: int, item: ProductUpdate, current_user: dict = Depends(get_current_admin)):
-    db.update_product(pid, item.model_name, item.product_name, item.price, item.maintenance_time)
+    if not db.update_product(pid, item.model_name, item.product_name, item.price, item.maintenance_time):
+        raise HTTPException(status_code=400, detail="型号已存在")
     db.add_log(current_user["id"], current_user["username"], "UPDATE_PRODUCT", f"Updated product ID: {pid}")
     return {"status": "updated"}
 
@@ -393,6 +543,7 @@ def update_product(pid: int, item: ProductUpdate, current_user: dict = Depends(g
 def delete_product(pid: int, current_user: dict = Depends(get_current_admin)):
     # Get image paths first
     images = db.get_product_images(pid)
+    hashes = db.get_image_hashes([pid])
     
     # Delete from DB
     db.delete_product(pid)
@@ -404,6 +555,7 @@ def delete_product(pid: int, current_user: dict = Depends(get_current_admin)):
                 os.remove(path)
             except Exception as e:
                 print(f"Error deleting file {path}: {e}")
+    delete_thumbnails(hashes)
     
     db.add_log(current_user["id"], current_user["username"], "DELETE_PRODUCT", f"Deleted product ID: {pid}")
                 
@@ -412,230 +564,239 @@ def delete_product(pid: int, current_user: dict = Depends(get_current_admin)):
 @app.delete("/images/{image_id}")
 def delete_image(image_id: int, current_user: dict = Depends(get_current_admin)):
     # Delete from DB and get path
-    path = db.delete_image(image_id)
+    path, digest = db.delete_image(image_id) or (None, None)
     
     if path and os.path.exists(path):
         try:
             os.remove(path)
         except Exception as e:
             print(f"Error deleting file {path}: {e}")
+    delete_thumbnails([digest])
             
     return {"status": "deleted"}
 
-@app.post("/products/{pid}/upload-image")
+@app.post("/products/{pid}/upload-image", dependencies=[Depends(require_ready)])
 async def upload_product_image(pid: int, file: UploadFile = File(...), current_user: dict = Depends(get_current_admin)):
     filename = f"{pid}_{datetime.now().timestamp()}_{file.filename}"
     filepath = os.path.join(UPLOADS_DIR, filename)
     db_path = os.path.join("uploads", filename)
     
     content = await file.read()
-    if process_and_save_image(content, filepath):
-        vector = ai_model.extract(filepath)
-        if vector is not None:
-            new_id = db.add_product_image(pid, db_path, vector)
-            db.add_log(current_user["id"], current_user["username"], "UPLOAD_IMAGE", f"Added image to product ID: {pid}")
-            return {"status": "uploaded", "image_path": db_path, "id": new_id}
+    # A copy of one of the product's images is not stored again
+    digest = image_digest(content)
+    existing = await run_io(db.get_image_by_hash, pid, digest)
+    if existing:
+        return {"status": "duplicate", "image_path": existing[1], "id": existing[0]}
+    
+    image, digest = await run_io(store_image, content, filepath, 800, digest)
+    if image is not None:
+        vectors, errors = await run_inference(ai_model.extract_batch, [image])
+        if errors[0] is None:
+            # A second try if a copy stored concurrently is deleted again before we read it
+            for _ in range(2):
+                try:
+                    new_id = (await run_io(db.add_product_images_bulk, [(pid, db_path, vectors[0], digest)]))[0]
+                except sqlite3.IntegrityError as e:
+                    os.remove(filepath)
+                    # Only a product deleted meanwhile is expected: the hash check and the insert are atomic
+                    if "FOREIGN KEY" not in str(e):
+                        raise
+                    raise HTTPException(status_code=404, detail="Product not found")
+                if new_id is not None:
+                    await run_io(db.add_log, current_user["id"], current_user["username"], "UPLOAD_IMAGE", f"Added image to product ID: {pid}")
+                    return {"status": "uploaded", "image_path": db_path, "id": new_id}
+                # The same image was stored concurrently
+                existing = await run_io(db.get_image_by_hash, pid, digest)
+                if existing:
+                    os.remove(filepath)
+                    return {"status": "duplicate", "image_path": existing[1], "id": existing[0]}
+            os.remove(filepath)
+            raise HTTPException(status_code=409, detail="The image was changed concurrently, retry the upload")
     
     if os.path.exists(filepath):
         os.remove(filepath)
     raise HTTPException(status_code=400, detail="Failed to process image")
 
-@app.post("/recognize")
-async def recognize(file: UploadFile = File(...)):
+def find_products(query_vector, top_k, min_score):
+    """Search the vector store and build recognize results for the winning products"""
+    # Search: score every image, reduce to a per-product max and take the top-k
+    hits = vector_store.search_products(query_vector, top_k=top_k, min_score=min_score)
+    
+    # Materialize product metadata only for the winners
+    image_info = db.get_image_hits([image_id for _, image_id, _ in hits])
+    images_map = db.get_images_by_products([pid for pid, _, _ in hits])
+    
+    top_results = []
+    for pid, image_id, score in hits:
+        product = image_info.get(image_id)
+        if product:
+            # Attach all images for these products to support gallery view
+            product["images"] = images_map.get(pid, [])
+            top_results.append({"id": pid, "product": product, "score": score})
+
+    return top_results
+
+@app.post("/recognize", dependencies=[Depends(require_ready), Depends(sync_workers)])
+async def recognize(file: UploadFile = File(...), top_k: int = 5, min_score: Optional[float] = None):
     # Public access
+    top_k = max(1, min(top_k, RECOGNIZE_MAX_TOP_K))
+    # Scores are cosines; finer thresholds than this would only fragment the result cache
+    if min_score is not None:
+        min_score = round(min_score, 3)
     
-    # Save temp file
-    filename = f"temp_{datetime.now().timestamp()}_{file.filename}"
-    filepath = os.path.join(UPLOADS_DIR, filename)
+    # Decode and embed straight from the upload buffer, no temp file
+    content = await file.read()
     
-    try:
-        content = await file.read()
-        if not process_and_save_image(content, filepath):
-             raise HTTPException(status_code=400, detail="Invalid image file")
-        
-        # Extract features
-        query_vector = ai_model.extract(filepath)
+    # Same bytes (or, optionally, the same picture) seen before: skip decode and inference
+    key = content_key(content)
+    phash = None
+    entry = recognition_cache.lookup(key)
+    if entry is None and config.RECOGNIZE_CACHE_PHASH:
+        phash = await run_io(perceptual_hash, content)
+        if phash is not None:
+            entry = recognition_cache.lookup_similar(phash, config.RECOGNIZE_CACHE_PHASH_DISTANCE)
+    
+    # Read before searching, so results that raced a catalog write are stale on arrival
+    version = db.catalog_version
+    params = (top_k, min_score)
+    results = recognition_cache.get_results(entry, params, version)
+    if results is not None:
+        return results
+    
+    if entry is None:
+        # Extract features, batched with concurrent queries
+        query_vector = await query_batcher.submit(content)
         if query_vector is None:
-            raise HTTPException(status_code=400, detail="Could not process image")
-        
-        # Search
-        candidates = db.get_all_vectors()
-        
-        # We need to aggregate scores by product, maybe take the best matching image
-        product_scores = {}
-        
-        for cand in candidates:
-            sim = ai_model.compute_similarity(query_vector, cand['vector'])
-            pid = cand['product_id']
-            
-            # Keep the best score for each product
-            if pid not in product_scores or sim > product_scores[pid]['score']:
-                product_scores[pid] = {
-                    "id": pid,
-                    "product": {
-                        "id": pid,
-                        "model_name": cand["model_name"],
-                        "product_name": cand["product_name"],
-                        "price": cand["price"],
-                        "maintenance_time": cand["maintenance_time"],
-                        "image_path": cand["image_path"] # Best matching image
-                    },
-                    "score": float(sim)
-                }
-        
-        # Convert to list and sort
-        results = list(product_scores.values())
-        results.sort(key=lambda x: x['score'], reverse=True)
-        
-        # Take top 5
-        top_results = results[:5]
-
-        # Fetch all images for these products to support gallery view
-        for res in top_results:
-            pid = res["id"]
-            all_images = db.get_product_images(pid)
-            res["product"]["images"] = all_images
-
-        return top_results
-        
-    finally:
-        # Cleanup temp file
-        if os.path.exists(filepath):
-            os.remove(filepath)
-
-@app.post("/batch-update")
+            raise HTTPException(status_code=400, detail="Invalid image file")
+        entry = recognition_cache.store(key, query_vector, phash)
+    
+    # Search off the event loop
+    results = await run_io(find_products, entry.vector, top_k, min_score)
+    recognition_cache.put_results(entry, params, version, results)
+    return results
+
+@app.get("/recognize/stats")
+def get_recognize_stats(current_user: dict = Depends(get_current_admin)):
+    # Queue depth, batch-size histogram and latency of the query micro-batcher, and query cache counters
+    return {**query_batcher.stats(), "model_version": config.MODEL_VERSION, "cache": recognition_cache.stats()}
+
+@app.get("/cache/stats")
+def get_cache_stats(current_user: dict = Depends(get_current_admin)):
+    # Hit/miss counters of the public product response cache
+    return response_cache.stats()
+
+@app.get("/ready")
+def get_ready(response: Response):
+    # Readiness probe: 200 once the model and the vector index are loaded, 503 before; with startup phase timings
+    if not startup.ready.is_set():
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return startup.stats()
+
+@app.get("/index/stats", dependencies=[Depends(sync_workers)])
+def get_index_stats(current_user: dict = Depends(get_current_admin)):
+    # Backend, size and recall@k of the search index against exact search
+    return vector_store.stats()
+
+@app.post("/batch-update", status_code=202, dependencies=[Depends(require_ready)])
 async def batch_update(file: UploadFile = File(...), current_user: dict = Depends(get_current_admin)):
     """Upload a zip file containing images in folders.
     Folder structure: 'ModelName_ProductName/image.jpg'
+    Returns a job id at once; poll GET /jobs/{job_id} for progress.
     """
     if not file.filename.endswith('.zip'):
         raise HTTPException(status_code=400, detail="File must be a zip")
         
-    content = await file.read()
-    try:
-        zip_file = zipfile.ZipFile(io.BytesIO(content))
-    except zipfile.BadZipFile:
+    # Spool the upload to disk in chunks; the job reads entries from there
+    fd, zip_path = tempfile.mkstemp(suffix=".zip", dir=config.IMPORT_DIR)
+    os.close(fd)
+    await run_io(save_upload_file, file, zip_path)
+    if not await run_io(zipfile.is_zipfile, zip_path):
+        os.remove(zip_path)
         raise HTTPException(status_code=400, detail="Invalid zip file")
     
-    # Create batch directory
-    batch_dir_name = f"batch_{int(datetime.now().timestamp())}"
-    batch_dir_path = os.path.join(UPLOADS_DIR, batch_dir_name)
-    os.makedirs(batch_dir_path, exist_ok=True)
-    
-    # Track created products in this batch to avoid multiple lookups for same model in zip
-    # Key: model_name, Value: product_id
-    batch_products = {}
-    count = 0
-    updated_count = 0
-
-    for filename in zip_file.namelist():
-        # Skip hidden files and directories
-        if filename.startswith('__MACOSX') or filename.endswith('/'):
-            continue
-            
-        # Fix encoding
-        decoded_filename = fix_zip_filename(filename)
-        
-        if decoded_filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.webp')):
-            # Parse path: Folder/Image.jpg
-            parts = decoded_filename.split('/')
-            
-            # Handle cases where zip might be flat or nested deeper
-            if len(parts) >= 2:
-                folder_name = parts[-2]
-                file_name = parts[-1]
-                
-                # Parse folder name: Model_Name[_Price]
-                parts_name = folder_name.split('_')
-                
-                # Default values
-                model_name = parts_name[0]
-                product_name = ""
-                price_val = 0.0
-
-                if len(parts_name) >= 3:
-                    # Case: Model_Name_Price (CS001_PearlNecklace_199)
-                    # We assume last part is price if it looks like a number
-                    possible_price = parts_name[-1]
-                    try:
-                        price_val = float(possible_price)
-                        # Name is everything in between
-                        product_name = "_".join(parts_name[1:-1])
-                    except ValueError:
-                        # Maybe it's just a long name with underscores?
-                        # Let's fallback: Model_Name (where Name has underscores)
-                        product_name = "_".join(parts_name[1:])
-                elif len(parts_name) == 2:
-                    # Case: Model_Name OR Model_Price
-                    possible_second = parts_name[1]
-                    try:
-                        price_val = float(possible_second)
-                        # So it is Model_Price, name is empty
-                        product_name = ""
-                    except ValueError:
-                        # It is Model_Name
-                        product_name = possible_second
-                else:
-                    # Case: Model (CS001)
-                    pass
-            else:
-                file_name = parts[-1]
-                model_name = os.path.splitext(file_name)[0]
-                product_name = ""
-                price_val = 0.0
-
-            # Clean names
-            model_name = model_name.strip()
-            product_name = product_name.strip()
-
-            # Extract image data (using original filename)
-            data = zip_file.read(filename)
-            
-            # Generate save path
-            save_name = f"{model_name}_{file_name}"
-            # Sanitize filename characters
-            save_name = "".join([c for c in save_name if c.isalnum() or c in "._-"])
-            save_path = os.path.join(batch_dir_path, save_name)
-            db_path = os.path.join("uploads", batch_dir_name, save_name)
-            
-            # Resize and Save
-            if process_and_save_image(data, save_path):
-                # 1. Check if we already handled this model in this batch
-                pid = batch_products.get(model_name)
-                
-                # 2. If not in batch, check DB
-                if not pid:
-                    existing_product = db.get_product_by_model(model_name)
-                    if existing_product:
-                        pid = existing_product['id']
-                        print(f"Found existing product for model '{model_name}': ID {pid}")
-                        
-                        # Update product name/price if provided
-                        new_name = product_name if product_name else existing_product['product_name']
-                        new_price = price_val if price_val > 0 else existing_product['price']
-                        
-                        if new_name != existing_product['product_name'] or new_price != existing_product['price']:
-                             db.update_product(pid, model_name, new_name, new_price, existing_product['maintenance_time'])
-                    else:
-                        # Create new
-                        print(f"Creating new product for model '{model_name}'")
-                        pid = db.add_product(model_name, product_name, price_val, datetime.now().strftime("%Y-%m-%d"))
-                        count += 1
-                    
-                    batch_products[model_name] = pid
-                
-                # Extract features
-                vector = ai_model.extract(save_path)
-                
-                # Add Image to Product
-                if vector is not None:
-                    db.add_product_image(pid, db_path, vector)
-                    updated_count += 1
+    job_id = await run_io(import_jobs.submit, file.filename, zip_path, current_user)
+    return {"status": "accepted", "job_id": job_id}
 
-    db.add_log(current_user["id"], current_user["username"], "BATCH_UPDATE", f"Processed {count} new products, {updated_count} images")
-    
-    return {"status": "success", "processed_products_count": count, "updated_images_count": updated_count}
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, current_user: dict = Depends(get_current_admin)):
+    # Processed/failed counts, images/s and ETA of a background import
+    job = import_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-if __name__ == "__main__":
+# ------------------------------------------------------
+# Server Workers
+# The process loads the model and the vectors once, then forks SERVER_WORKERS workers
+# accepting on one socket, which share those pages copy-on-write (the vector file's
+# mapping outright). uvicorn --workers would spawn fresh interpreters loading both again.
+# ------------------------------------------------------
+def run_worker(sock, resume_jobs):
+    """Body of a forked worker: fresh connections, threads and descriptors, then serve"""
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    global resume_import_jobs
+    resume_import_jobs = resume_jobs
+    db.reopen()
+    executors.reset_after_fork()
+    vector_store.after_fork()
+    ai_model.after_fork()
+    query_batcher.executor = executors.inference_pool
+    import_jobs.after_fork()
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+
+def serve_workers(host, port, workers):
+    """Fork workers, forward SIGTERM/SIGINT to them and replace any that die"""
+    import signal
+    import socket
+    import time
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    # Workers start in step with the catalog; SQLite connections must not cross a fork
+    db.synced_generation = db.latest_generation()
+    db.close()
+    # Nor import workers, which the startup re-index catch-up may have started here
+    executors.stop_process_pool()
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_id, first):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                run_worker(sock, first and worker_id == 0)
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Starting {workers} server workers on {host}:{port}")
+    for worker_id in range(workers):
+        spawn(worker_id, True)
+    while children:
+        pid, status = os.wait()
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            print(f"Server worker {worker_id} (pid {pid}) exited with code {os.waitstatus_to_exitcode(status)}, restarting it.")
+            # Don't spin if it dies at startup
+            time.sleep(1)
+            spawn(worker_id, False)
+
+if __name__ == "__main__":
+    if config.SERVER_WORKERS > 1:
+        serve_workers("0.0.0.0", 8000, config.SERVER_WORKERS)
+    else:
+        import uvicorn
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,10 +1,165 @@
-import torch
-import torchvision.models as models
-import torchvision.transforms as transforms
 from PIL import Image
 import numpy as np
+import io
 import os
 
+import config
+
+FEATURE_DIM = 576
+
+# Preprocessing of MobileNet_V3_Small_Weights.DEFAULT.transforms():
+# resize shortest side to 256 (bilinear), center crop 224, scale to [0, 1], normalize
+RESIZE_SIZE = 256
+CROP_SIZE = 224
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32).reshape(3, 1, 1)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32).reshape(3, 1, 1)
+
+def load_torch_model():
+    """Build MobileNetV3 Small with the classifier removed (576-dim output)"""
+    import torch
+    import torchvision.models as models
+
+    # Use MobileNetV3 Small for speed
+    weights = models.MobileNet_V3_Small_Weights.DEFAULT
+    model = models.mobilenet_v3_small(weights=weights)
+
+    # Remove the classifier to get features
+    # MobileNetV3 structure: features -> avgpool -> classifier
+    # We want the output after avgpool, which is the feature vector
+    # But standard implementation: model(x) calls classifier.
+    # We can replace the classifier with Identity, but we need to check the shape.
+    # Original classifier is:
+    # Sequential(
+    #   (0): Linear(in_features=576, out_features=1024, bias=True)
+    #   (1): Hardswish()
+    #   (2): Dropout(p=0.2, inplace=True)
+    #   (3): Linear(in_features=1024, out_features=1000, bias=True)
+    # )
+    # If we replace it with Identity, we get 576-dim vector. That's good.
+
+    model.classifier = torch.nn.Identity()
+    model.eval()
+    return model
+
+def load_image(item):
+    """Open a PIL image, raw encoded bytes or a file path as an RGB image"""
+    if isinstance(item, Image.Image):
+        return item.convert('RGB')
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(item))
+    else:
+        image = Image.open(item)
+    # JPEG only: decode at 1/2, 1/4 or 1/8 scale while both sides stay >= RESIZE_SIZE
+    image.draft('RGB', (RESIZE_SIZE, RESIZE_SIZE))
+    return image.convert('RGB')
+
+def crop_image(image):
+    """PIL RGB image -> (224, 224, 3) uint8 array, resized and center cropped as the model expects"""
+    width, height = image.size
+    if width <= height:
+        size = (RESIZE_SIZE, int(RESIZE_SIZE * height / width))
+    else:
+        size = (int(RESIZE_SIZE * width / height), RESIZE_SIZE)
+    image = image.resize(size, Image.Resampling.BILINEAR)
+    left = int(round((size[0] - CROP_SIZE) / 2.0))
+    top = int(round((size[1] - CROP_SIZE) / 2.0))
+    return np.asarray(image.crop((left, top, left + CROP_SIZE, top + CROP_SIZE)))
+
+def normalize(crop):
+    """crop_image() array -> normalized (3, 224, 224) float32 array"""
+    array = crop.astype(np.float32).transpose(2, 0, 1) / 255.0
+    return (array - MEAN) / STD
+
+def preprocess(image):
+    """PIL RGB image -> normalized (3, 224, 224) float32 array, same as the torchvision transform"""
+    return normalize(crop_image(image))
+
+def worker_threads():
+    """Intra-op threads per server worker when not configured: an even share of the cores"""
+    return max(1, (os.cpu_count() or 1) // config.SERVER_WORKERS)
+
+# ------------------------------------------------------
+# Inference Backends
+# Both take an (N, 3, 224, 224) float32 batch and return (N, 576) features.
+# after_fork() readies a backend loaded before the server forked its workers.
+# ------------------------------------------------------
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self):
+        import torch
+        self.torch = torch
+        if config.TORCH_THREADS > 0:
+            torch.set_num_threads(config.TORCH_THREADS)
+        self.model = load_torch_model()
+
+    def run(self, batch):
+        with self.torch.no_grad():
+            output = self.model(self.torch.from_numpy(batch))
+        return output.reshape(len(batch), -1).numpy()
+
+    def after_fork(self):
+        if config.TORCH_THREADS == 0:
+            self.torch.set_num_threads(worker_threads())
+
+
+class OnnxBackend:
+    """ONNX Runtime session over the model exported by export_onnx.py (dynamic batch axis)"""
+    name = "onnxruntime"
+
+    def __init__(self, model_path):
+        import onnxruntime as ort
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"ONNX model not found at {model_path}, run export_onnx.py first")
+        self.ort = ort
+        self.model_path = model_path
+        self.session = self._create_session(config.ONNX_INTRA_OP_THREADS)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _create_session(self, intra_op_threads):
+        options = self.ort.SessionOptions()
+        options.graph_optimization_level = self.ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        if config.ONNX_INTER_OP_THREADS > 0:
+            options.inter_op_num_threads = config.ONNX_INTER_OP_THREADS
+        return self.ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+
+    def run(self, batch):
+        output = self.session.run(None, {self.input_name: batch})[0]
+        return output.reshape(len(batch), -1)
+
+    def after_fork(self):
+        # The session's thread pools stayed in the parent
+        self.session = self._create_session(config.ONNX_INTRA_OP_THREADS or worker_threads())
+
+
+class TorchScriptBackend(TorchBackend):
+    """Traced and frozen TorchScript module written by export_onnx.py"""
+    name = "torchscript"
+
+    def __init__(self, model_path):
+        import torch
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"TorchScript model not found at {model_path}, run export_onnx.py first")
+        self.torch = torch
+        if config.TORCH_THREADS > 0:
+            torch.set_num_threads(config.TORCH_THREADS)
+        model = torch.jit.load(model_path, map_location="cpu")
+        model.eval()
+        # Fuses conv/bn/activation and prepacks weights for this CPU
+        self.model = torch.jit.optimize_for_inference(model)
+
+
+def create_backend(name):
+    if name == "torch":
+        return TorchBackend()
+    if name == "onnxruntime":
+        return OnnxBackend(config.ONNX_MODEL_PATH)
+    if name == "torchscript":
+        return TorchScriptBackend(config.TORCHSCRIPT_MODEL_PATH)
+    raise ValueError(f"Unknown model backend: {name}")
+
 # ------------------------------------------------------
 # AI Model Manager
 # ------------------------------------------------------
@@ -17,58 +172,68 @@ class FeatureExtractor:
             cls._instance.init()
         return cls._instance
 
-    def init(self):
+    def init(self, backend=None):
         """Initialize the model"""
-        print("Loading MobileNetV3 Small model...")
-        # Use MobileNetV3 Small for speed
-        self.weights = models.MobileNet_V3_Small_Weights.DEFAULT
-        self.model = models.mobilenet_v3_small(weights=self.weights)
-        
-        # Remove the classifier to get features
-        # MobileNetV3 structure: features -> avgpool -> classifier
-        # We want the output after avgpool, which is the feature vector
-        # But standard implementation: model(x) calls classifier.
-        # We can replace the classifier with Identity, but we need to check the shape.
-        # Original classifier is:
-        # Sequential(
-        #   (0): Linear(in_features=576, out_features=1024, bias=True)
-        #   (1): Hardswish()
-        #   (2): Dropout(p=0.2, inplace=True)
-        #   (3): Linear(in_features=1024, out_features=1000, bias=True)
-        # )
-        # If we replace it with Identity, we get 576-dim vector. That's good.
-        
-        self.model.classifier = torch.nn.Identity()
-        self.model.eval()
-        
-        self.transform = self.weights.transforms()
+        backend = backend or config.MODEL_BACKEND
+        print(f"Loading MobileNetV3 Small model ({backend})...")
+        self.backend = create_backend(backend)
+        self.batch_size = config.EXTRACT_BATCH_SIZE
         print("Model loaded successfully.")
 
-    def extract(self, img_path):
-        """Extract features from an image"""
-        try:
-            image = Image.open(img_path).convert('RGB')
-            # Preprocess
-            img_t = self.transform(image)
-            batch_t = torch.unsqueeze(img_t, 0)
-            
-            with torch.no_grad():
-                output = self.model(batch_t)
-            
-            # Flatten and convert to numpy
-            feature_vector = output.squeeze().numpy()
-            
-            # Normalize vector (L2 norm) for cosine similarity
-            norm = np.linalg.norm(feature_vector)
-            if norm > 0:
-                feature_vector = feature_vector / norm
-                
-            return feature_vector
-        except Exception as e:
-            print(f"Error extracting features: {e}")
+    def after_fork(self):
+        """In a server worker forked after the model loaded"""
+        self.backend.after_fork()
+
+    def warm_up(self):
+        """Run one blank batch, so the first query doesn't pay for the backend's lazy setup"""
+        self.backend.run(np.zeros((1, 3, CROP_SIZE, CROP_SIZE), dtype=np.float32))
+
+    def _extract_one(self, item):
+        vectors, errors = self.extract_batch([item])
+        if errors[0] is not None:
+            print(f"Error extracting features: {errors[0]}")
             return None
+        return vectors[0]
+
+    def extract(self, img_path):
+        """Extract features from an image file"""
+        return self._extract_one(img_path)
+
+    def extract_batch(self, images, batch_size=None):
+        """Extract features for many images, batch_size images per forward pass.
+
+        Items may be PIL images, encoded bytes, file paths or crop_image() arrays
+        prepared elsewhere (e.g. in an import worker process).
+
+        Returns (vectors, errors): an (N, 576) float32 array of L2-normalized rows
+        and a list holding None or an error message per item. Failed rows are zero.
+        """
+        batch_size = batch_size or self.batch_size
+        n = len(images)
+        vectors = np.zeros((n, FEATURE_DIM), dtype=np.float32)
+        errors = [None] * n
+
+        for start in range(0, n, batch_size):
+            # Preprocess, isolating per-item decode failures
+            arrays = []
+            index = []
+            for i in range(start, min(n, start + batch_size)):
+                try:
+                    item = images[i]
+                    arrays.append(normalize(item) if isinstance(item, np.ndarray) else preprocess(load_image(item)))
+                    index.append(i)
+                except Exception as e:
+                    errors[i] = str(e)
+            if not arrays:
+                continue
+
+            try:
+                vectors[index] = self.backend.run(np.stack(arrays))
+            except Exception as e:
+                for i in index:
+                    errors[i] = str(e)
 
-    def compute_similarity(self, vec1, vec2):
-        """Compute cosine similarity between two vectors"""
-        # Since vectors are normalized, dot product is cosine similarity
-        return np.dot(vec1, vec2)
+        # Normalize vectors (L2 norm) for cosine similarity
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors, errors
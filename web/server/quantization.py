@@ -0,0 +1,247 @@
+import os
+import numpy as np
+
+# Rows scored per block, bounds the float32 temporaries of compressed codecs
+SCORE_CHUNK = 16384
+
+# ------------------------------------------------------
+# Vector Codecs
+# ------------------------------------------------------
+class VectorCodec:
+    """Encodes float32 vectors into fixed-size byte codes.
+
+    Codes are (n, code_size) uint8 rows. scores() is asymmetric: the float32
+    query is compared against the codes directly, without decoding the matrix.
+    """
+    name = "base"
+    lossy = True
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    @property
+    def code_size(self):
+        raise NotImplementedError
+
+    @property
+    def trained(self):
+        return True
+
+    def train(self, vectors):
+        pass
+
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    def decode(self, codes):
+        raise NotImplementedError
+
+    def _score_block(self, query, codes):
+        raise NotImplementedError
+
+    def scores(self, query, codes):
+        """Similarity of the query to every code row"""
+        n = len(codes)
+        if n <= SCORE_CHUNK:
+            return self._score_block(query, codes)
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_CHUNK):
+            out[start:start + SCORE_CHUNK] = self._score_block(query, codes[start:start + SCORE_CHUNK])
+        return out
+
+    def save(self, path):
+        pass
+
+    def restore(self, path):
+        return False
+
+
+class Float32Codec(VectorCodec):
+    """Raw float32, exact (4 bytes per dimension)"""
+    name = "float32"
+    lossy = False
+
+    @property
+    def code_size(self):
+        return self.dim * 4
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors, dtype=np.float32).view(np.uint8).reshape(-1, self.code_size)
+
+    def decode(self, codes):
+        return np.ascontiguousarray(codes).view(np.float32).reshape(-1, self.dim)
+
+    def scores(self, query, codes):
+        # No temporaries needed, score in one product
+        return self.decode(codes) @ query
+
+
+class Float16Codec(VectorCodec):
+    """Half precision (2x smaller)"""
+    name = "float16"
+
+    @property
+    def code_size(self):
+        return self.dim * 2
+
+    def encode(self, vectors):
+        return np.ascontiguousarray(vectors, dtype=np.float16).view(np.uint8).reshape(-1, self.code_size)
+
+    def decode(self, codes):
+        return np.ascontiguousarray(codes).view(np.float16).reshape(-1, self.dim).astype(np.float32)
+
+    def _score_block(self, query, codes):
+        return self.decode(codes) @ query
+
+
+class Int8Codec(VectorCodec):
+    """Per-vector scaled int8: dim signed bytes followed by a float32 scale (about 4x smaller)"""
+    name = "int8"
+
+    @property
+    def code_size(self):
+        return self.dim + 4
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        quantized = np.clip(np.rint(vectors / scale[:, None]), -127, 127).astype(np.int8)
+        codes = np.empty((len(vectors), self.code_size), dtype=np.uint8)
+        codes[:, :self.dim] = quantized.view(np.uint8)
+        codes[:, self.dim:] = scale.astype(np.float32).view(np.uint8).reshape(-1, 4)
+        return codes
+
+    def _split(self, codes):
+        quantized = np.ascontiguousarray(codes[:, :self.dim]).view(np.int8)
+        scale = np.ascontiguousarray(codes[:, self.dim:]).view(np.float32).ravel()
+        return quantized, scale
+
+    def decode(self, codes):
+        quantized, scale = self._split(codes)
+        return quantized.astype(np.float32) * scale[:, None]
+
+    def _score_block(self, query, codes):
+        quantized, scale = self._split(codes)
+        return (quantized.astype(np.float32) @ query) * scale
+
+
+class PQCodec(VectorCodec):
+    """Product quantization: one byte per subspace against a trained codebook.
+
+    The vector is split into m subspaces, each quantized to the nearest of 256
+    k-means centroids. Scoring builds an (m, 256) lookup table of query/centroid
+    dot products and sums the entries selected by each code.
+    """
+    name = "pq"
+    N_CENTROIDS = 256
+
+    def __init__(self, dim, m=144, n_iter=15, seed=0):
+        super().__init__(dim)
+        if dim % m != 0:
+            raise ValueError(f"PQ subspaces ({m}) must divide the vector dimension ({dim})")
+        self.m = m
+        self.sub_dim = dim // m
+        self.n_iter = n_iter
+        self.seed = seed
+        # (m, 256, sub_dim) centroids, None until trained or restored
+        self.codebooks = None
+        self._offsets = (np.arange(m) * self.N_CENTROIDS).astype(np.int32)
+
+    @property
+    def code_size(self):
+        return self.m
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _split(self, vectors):
+        return np.asarray(vectors, dtype=np.float32).reshape(-1, self.m, self.sub_dim)
+
+    def _nearest(self, sub_vectors, centroids):
+        # argmin |x - c|^2 == argmax x.c - |c|^2 / 2
+        return np.argmax(sub_vectors @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+    def train(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < self.N_CENTROIDS:
+            raise ValueError(f"PQ training needs at least {self.N_CENTROIDS} vectors, got {len(vectors)}")
+        print(f"Training PQ codebook: {self.m} subspaces on {len(vectors)} vectors...")
+        rng = np.random.default_rng(self.seed)
+        subs = self._split(vectors)
+        codebooks = np.empty((self.m, self.N_CENTROIDS, self.sub_dim), dtype=np.float32)
+        for j in range(self.m):
+            data = subs[:, j, :]
+            centroids = data[rng.choice(len(data), size=self.N_CENTROIDS, replace=False)].copy()
+            for _ in range(self.n_iter):
+                labels = self._nearest(data, centroids)
+                counts = np.bincount(labels, minlength=self.N_CENTROIDS)
+                sums = np.zeros_like(centroids)
+                for d in range(self.sub_dim):
+                    sums[:, d] = np.bincount(labels, weights=data[:, d], minlength=self.N_CENTROIDS)
+                used = counts > 0
+                centroids[used] = sums[used] / counts[used, None]
+                # Re-seed empty centroids with random points
+                n_empty = int((~used).sum())
+                if n_empty:
+                    centroids[~used] = data[rng.choice(len(data), size=n_empty, replace=False)]
+            codebooks[j] = centroids
+        self.codebooks = codebooks
+
+    def encode(self, vectors):
+        subs = self._split(vectors)
+        codes = np.empty((len(subs), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(subs[:, j, :], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.m)]
+        return np.concatenate(parts, axis=1)
+
+    def scores(self, query, codes):
+        # Asymmetric distance: per-subspace lookup table built once per query
+        table = np.einsum("mcd,md->mc", self.codebooks, self._split(query)[0]).ravel()
+        n = len(codes)
+        out = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SCORE_CHUNK):
+            block = codes[start:start + SCORE_CHUNK].astype(np.int32) + self._offsets
+            out[start:start + SCORE_CHUNK] = table[block].sum(axis=1)
+        return out
+
+    def save(self, path):
+        if not self.trained or not path:
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, codebooks=self.codebooks)
+        os.replace(tmp_path, path)
+
+    def restore(self, path):
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as state:
+                codebooks = state["codebooks"]
+        except Exception as e:
+            print(f"Could not restore PQ codebook from {path}: {e}")
+            return False
+        if codebooks.shape != (self.m, self.N_CENTROIDS, self.sub_dim):
+            print(f"Ignoring PQ codebook {path}: shape {codebooks.shape} does not match m={self.m}")
+            return False
+        self.codebooks = codebooks.astype(np.float32)
+        return True
+
+
+def create_codec(encoding, dim, **options):
+    """Build a VectorCodec by name: float32, float16, int8 or pq"""
+    if encoding == "float32":
+        return Float32Codec(dim)
+    if encoding == "float16":
+        return Float16Codec(dim)
+    if encoding == "int8":
+        return Int8Codec(dim)
+    if encoding == "pq":
+        return PQCodec(dim, m=options.get("pq_subspaces", 144))
+    raise ValueError(f"Unknown vector encoding: {encoding}")
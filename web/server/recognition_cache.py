@@ -0,0 +1,117 @@
+import collections
+import hashlib
+import threading
+
+def content_key(data):
+    """Cache key of an upload's exact bytes"""
+    return "blake2b:" + hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Result lists kept per query image, for its most recently used (top_k, min_score) pairs
+MAX_RESULT_LISTS = 8
+
+class CachedQuery:
+    """Embedding of one query image and its result lists per (top_k, min_score),
+    all computed against catalog version"""
+
+    def __init__(self, vector):
+        self.vector = vector
+        self.version = None
+        self.results = collections.OrderedDict()
+
+# ------------------------------------------------------
+# Recognition Cache
+# ------------------------------------------------------
+class RecognitionCache:
+    """LRU cache of /recognize queries, so a re-uploaded photo skips decode and inference.
+
+    Queries are found by the content hash of the upload and, optionally, by a perceptual
+    hash within a few bits, so re-encoded or resized copies match too. Embeddings depend
+    only on the image and stay valid; result lists are only served while the catalog
+    version they were computed against is current, and are recomputed from the cached
+    embedding otherwise.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        # content key -> CachedQuery, and perceptual hash -> CachedQuery, both LRU
+        self._entries = collections.OrderedDict()
+        self._phashes = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Metrics
+        self.result_hits = 0
+        self.embedding_hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Cached query for a content key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def lookup_similar(self, phash, max_distance):
+        """Cached query whose perceptual hash differs from phash in at most max_distance bits, or None"""
+        with self._lock:
+            best, best_distance = None, max_distance + 1
+            for other in self._phashes:
+                distance = bin(phash ^ other).count("1")
+                if distance < best_distance:
+                    best, best_distance = other, distance
+            if best is None:
+                return None
+            self._phashes.move_to_end(best)
+            return self._phashes[best]
+
+    def store(self, key, vector, phash=None):
+        """Cache the embedding of a query under its content key and perceptual hash"""
+        entry = CachedQuery(vector)
+        with self._lock:
+            if self.max_entries > 0:
+                for entries, k in ((self._entries, key), (self._phashes, phash)):
+                    if k is None:
+                        continue
+                    entries[k] = entry
+                    entries.move_to_end(k)
+                    while len(entries) > self.max_entries:
+                        entries.popitem(last=False)
+        return entry
+
+    def get_results(self, entry, params, version):
+        """Result list of entry for params, if computed at catalog version; counts the lookup"""
+        with self._lock:
+            cached = entry.results.get(params) if entry is not None and entry.version == version else None
+            if cached is not None:
+                entry.results.move_to_end(params)
+                self.result_hits += 1
+                return cached
+            if entry is not None:
+                self.embedding_hits += 1
+            else:
+                self.misses += 1
+            return None
+
+    def put_results(self, entry, params, version, results):
+        """Cache a result list of entry; lists of older catalog versions are dropped"""
+        with self._lock:
+            if entry.version != version:
+                if entry.version is not None and entry.version > version:
+                    return
+                entry.version = version
+                entry.results.clear()
+            entry.results[params] = results
+            entry.results.move_to_end(params)
+            while len(entry.results) > MAX_RESULT_LISTS:
+                entry.results.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.result_hits + self.embedding_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "result_hits": self.result_hits,
+                "embedding_hits": self.embedding_hits,
+                "misses": self.misses,
+                "hit_rate": (self.result_hits + self.embedding_hits) / lookups if lookups else None
+            }
@@ -0,0 +1,128 @@
+import argparse
+import collections
+import os
+import time
+
+import config
+import executors
+from imaging import prepare_stored_image
+from vector_file import vector_file_paths
+
+# ------------------------------------------------------
+# Re-indexing
+# Vectors from one model version are meaningless to another. reindex() embeds the
+# stored images with the loaded model into image_vectors, where they wait while the
+# old vectors keep serving; activate() then switches every image in one transaction.
+# ------------------------------------------------------
+def reindex(db, extractor, version=None):
+    """Stage a vector of model version for every image that lacks one (blocking).
+
+    Stored images are decoded in the import worker processes, at most
+    config.IMPORT_QUEUE_SIZE in flight, embedded extractor.batch_size at a time and
+    written in one transaction per batch. Staged vectors survive an interruption, so
+    a second run only embeds what is left, including images added meanwhile.
+    Returns how many images were staged.
+    """
+    version = version or config.MODEL_VERSION
+    staged = 0
+    start = time.perf_counter()
+    while True:
+        image_ids = db.get_unstaged_images(version)
+        if not image_ids:
+            return staged
+        print(f"Re-indexing {len(image_ids)} images for model version {version}...")
+        # (image_id, future of the crop), in id order
+        in_flight = collections.deque()
+        pending = []
+
+        def flush():
+            nonlocal staged, pending
+            crops = [crop for _, crop in pending if crop is not None]
+            vectors, errors = executors.inference(extractor.extract_batch, crops) if crops else ([], [])
+            results = iter(zip(vectors, errors))
+            rows = []
+            for image_id, crop in pending:
+                vector, error = next(results) if crop is not None else (None, None)
+                if error is not None:
+                    print(f"Error extracting features for image {image_id}: {error}")
+                    vector = None
+                rows.append((image_id, vector))
+            db.stage_vectors(version, rows)
+            staged += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"{staged} images staged ({staged / elapsed:.1f} images/s)")
+            pending = []
+
+        def collect():
+            image_id, future = in_flight.popleft()
+            pending.append((image_id, future.result()))
+            if len(pending) >= extractor.batch_size:
+                flush()
+
+        for i in range(0, len(image_ids), config.IMPORT_QUEUE_SIZE):
+            for image_id, image_path in db.get_image_paths_by_ids(image_ids[i:i + config.IMPORT_QUEUE_SIZE]):
+                path = os.path.join(config.BASE_DIR, image_path)
+                in_flight.append((image_id, executors.submit_image_task(prepare_stored_image, path)))
+                # Backpressure: wait for the oldest image before reading further
+                if len(in_flight) >= config.IMPORT_QUEUE_SIZE:
+                    collect()
+        while in_flight:
+            collect()
+        if pending:
+            flush()
+
+def discard_saved_index():
+    """Delete the persisted ANN index, PQ codebook and vector file, which hold or were learned from the old vectors"""
+    paths = [config.SEARCH_INDEX_PATH, config.PQ_CODEBOOK_PATH]
+    if config.VECTOR_FILE_PATH:
+        paths.extend(vector_file_paths(config.VECTOR_FILE_PATH))
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def activate(db, extractor, version=None):
+    """Stage whatever is missing and switch the catalog to model version.
+    Returns how many images switched."""
+    version = version or config.MODEL_VERSION
+    while True:
+        reindex(db, extractor, version)
+        switched = db.activate_vectors(version)
+        # None: images were added since the pass, embed those too
+        if switched is not None:
+            break
+    discard_saved_index()
+    print(f"Switched {switched} images to model version {version}.")
+    return switched
+
+def catch_up(db, extractor):
+    """At startup, before the vector store loads: if any image holds a vector of another model
+    version (e.g. the server was restarted with a new one after reindex.py), embed what reindex.py
+    has not staged and switch now"""
+    stale = db.count_stale_vectors(config.MODEL_VERSION)
+    if stale:
+        print(f"{stale} images have vectors of another model version than {config.MODEL_VERSION}.")
+        activate(db, extractor)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Embed the stored catalog with the configured model (GOODSAI_MODEL_VERSION and backend "
+                    "settings) while the server keeps serving the current vectors. A server started with "
+                    "the new version switches to them; --activate switches now, with the server stopped.")
+    parser.add_argument("--activate", action="store_true", help="switch the catalog to the new vectors when done")
+    args = parser.parse_args()
+
+    from database import DBManager
+    from model import FeatureExtractor
+
+    executors.start_process_pool()
+    db = DBManager()
+    extractor = FeatureExtractor()
+    try:
+        if args.activate:
+            activate(db, extractor)
+        else:
+            staged = reindex(db, extractor)
+            print(f"{staged} images staged, {db.count_staged_vectors(config.MODEL_VERSION)} in total for model version "
+                  f"{config.MODEL_VERSION}. Start the server with GOODSAI_MODEL_VERSION={config.MODEL_VERSION} to switch.")
+    finally:
+        db.close()
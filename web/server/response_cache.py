@@ -0,0 +1,109 @@
+import collections
+import hashlib
+import json
+import threading
+import time
+
+# A serialized response: JSON body, its ETag, extra headers and the products it shows
+CachedResponse = collections.namedtuple("CachedResponse", "body etag headers product_ids expires")
+
+def json_body(data):
+    """Serialize like FastAPI's JSONResponse"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def make_etag(body):
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header value covers etag (weak comparison)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+# ------------------------------------------------------
+# Response Cache
+# ------------------------------------------------------
+class ResponseCache:
+    """LRU cache of serialized public GET responses, each kept at most ttl seconds.
+
+    Keys are tuples starting with the kind of response: LIST for product listings,
+    anything else for single-product responses. Entries are tagged with the product
+    ids they show; DBManager calls invalidate() after every committed catalog write,
+    dropping the entries that show a touched product, and every listing when the write
+    can change which products a listing holds or their order, including writes of sibling
+    server workers, which DBManager.sync_catalog() replays from the change log. The TTL
+    bounds staleness from writes that skip the log (the TS server on the same goods.db).
+    """
+    LIST = "products"
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so a response read across a write is not stored
+        self.generation = 0
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    def get(self, key):
+        """Fresh entry for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, body, product_ids, headers=None, generation=None):
+        """Cache a response built from data read at generation (read before querying the
+        database), unless a write was invalidated since. Returns the entry either way."""
+        entry = CachedResponse(body, make_etag(body), headers or {}, frozenset(product_ids), time.monotonic() + self.ttl)
+        with self._lock:
+            if self.max_entries > 0 and (generation is None or generation == self.generation):
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evicted += 1
+        return entry
+
+    def invalidate(self, product_ids=(), lists=False):
+        """Drop entries showing any of product_ids, and all listings if lists"""
+        product_ids = set(product_ids)
+        with self._lock:
+            self.generation += 1
+            stale = [key for key, entry in self._entries.items()
+                     if (lists and key[0] == self.LIST) or not product_ids.isdisjoint(entry.product_ids)]
+            for key in stale:
+                del self._entries[key]
+            self.invalidated += len(stale)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self.generation += 1
+            self.invalidated += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "invalidated": self.invalidated,
+                "evicted": self.evicted
+            }
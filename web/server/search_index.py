@@ -0,0 +1,440 @@
+import os
+import numpy as np
+
+from quantization import Float32Codec
+
+FEATURE_DIM = 576
+
+def group_by_product(product_ids):
+    """Sort order and segment starts that group rows by product id"""
+    order = np.argsort(product_ids, kind='stable')
+    sorted_pids = product_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_pids[1:] != sorted_pids[:-1]])
+    return order, starts
+
+def top_products(scores, product_ids, image_ids, top_k, min_score=None, groups=None):
+    """Reduce image scores to a per-product max and pick the top-k products.
+
+    Returns (product_id, best_image_id, score) tuples, best first.
+    """
+    n = len(scores)
+    if n == 0 or top_k <= 0:
+        return []
+    order, starts = groups if groups is not None else group_by_product(product_ids)
+    sorted_scores = scores[order]
+    best = np.maximum.reduceat(sorted_scores, starts)
+
+    # Products whose every row is deleted (attached storage) score -inf
+    candidates = np.flatnonzero(best > -np.inf) if min_score is None else np.flatnonzero(best >= min_score)
+    if len(candidates) == 0:
+        return []
+    k = min(top_k, len(candidates))
+    top = candidates[np.argpartition(-best[candidates], k - 1)[:k]]
+    top = top[np.argsort(-best[top])]
+
+    ends = np.r_[starts[1:], n]
+    results = []
+    for g in top:
+        row = order[starts[g] + int(np.argmax(sorted_scores[starts[g]:ends[g]]))]
+        results.append((int(product_ids[row]), int(image_ids[row]), float(best[g])))
+    return results
+
+def top_k_rows(scores, k):
+    """Indices of the k highest scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+# ------------------------------------------------------
+# Search Index Interface
+# ------------------------------------------------------
+class SearchIndex:
+    """Row storage for (image_id, product_id, vector) plus a search strategy.
+
+    Rows live in contiguous arrays grown geometrically, with vectors stored as
+    codes of a VectorCodec (raw float32 by default). Subclasses choose which
+    rows a query is scored against by overriding candidates(); everything else
+    (product aggregation, recall measurement) is shared. Not thread-safe, the
+    owning VectorStore serializes access.
+    """
+    name = "base"
+
+    def __init__(self, dim=FEATURE_DIM, codec=None):
+        self.dim = dim
+        self.codec = codec or Float32Codec(dim)
+        self._size = 0
+        self._codes = np.empty((0, self.codec.code_size), dtype=np.uint8)
+        self._image_ids = np.empty(0, dtype=np.int64)
+        self._product_ids = np.empty(0, dtype=np.int64)
+        # Parallel arrays that grow and move together, subclasses may append
+        self._columns = ["_codes", "_image_ids", "_product_ids"]
+        # Cached product grouping, rebuilt lazily after any write
+        self._groups = None
+        # Rows of attached storage deleted in place (image id < 0), None when there are none
+        self._dead = None
+        # Recall@k against exact search, filled in by measure_recall()
+        self.recall_at_k = None
+        self.recall_k = None
+
+    def __len__(self):
+        return self._size - (len(self._dead) if self._dead is not None else 0)
+
+    def _ensure_capacity(self, needed):
+        """Grow the backing arrays geometrically so appends stay amortized O(1)"""
+        capacity = self._codes.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 1024)
+        for name in self._columns:
+            old = getattr(self, name)
+            new = np.empty((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def add(self, image_ids, product_ids, vectors):
+        """Append rows; vectors is an (n, dim) array of L2-normalized features"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            return
+        start = self._size
+        end = start + len(vectors)
+        self._ensure_capacity(end)
+        self._codes[start:end] = self.codec.encode(vectors)
+        self._image_ids[start:end] = image_ids
+        self._product_ids[start:end] = product_ids
+        self._size = end
+        self._groups = None
+        self._on_add(start, end, vectors)
+
+    def _on_add(self, start, end, vectors):
+        """Hook for subclasses to index rows [start, end) given their raw vectors"""
+        pass
+
+    def _remove_rows(self, mask):
+        """Drop masked rows by moving surviving tail rows into the holes"""
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            return 0
+        n = self._size
+        new_size = n - len(rows)
+        holes = rows[rows < new_size]
+        tail_keep = np.arange(new_size, n)[~mask[new_size:n]]
+        for name in self._columns:
+            column = getattr(self, name)
+            column[holes] = column[tail_keep]
+        self._size = new_size
+        self._groups = None
+        return len(rows)
+
+    def remove_images(self, image_ids):
+        """Remove rows for the given image ids"""
+        mask = np.isin(self._image_ids[:self._size], np.asarray(image_ids, dtype=np.int64))
+        return self._remove_rows(mask)
+
+    def remove_products(self, product_ids):
+        """Remove rows for every image of the given products"""
+        mask = np.isin(self._product_ids[:self._size], np.asarray(product_ids, dtype=np.int64))
+        return self._remove_rows(mask)
+
+    def image_ids(self):
+        """Image ids of the stored rows, in row order"""
+        return self._image_ids[:self._size]
+
+    def attach(self, image_ids, product_ids, codes, kept=None):
+        """Serve the rows of arrays owned by the caller, e.g. a memory-mapped vector file,
+        without copying them. The owner appends rows and deletes them by setting their
+        image id to -1 in place, then attaches again; kept gives the old rows that
+        survived, in order, when it dropped some. add() and remove_*() are not used
+        on attached rows."""
+        n = len(codes)
+        start = self._size
+        own = [name for name in self._columns if name not in ("_codes", "_image_ids", "_product_ids")]
+        if kept is not None:
+            for name in own:
+                column = getattr(self, name)
+                column[:len(kept)] = column[kept]
+            start = len(kept)
+        for name in own:
+            old = getattr(self, name)
+            if len(old) < n:
+                new = np.empty((max(n, len(old) * 2, 1024),) + old.shape[1:], dtype=old.dtype)
+                new[:start] = old[:start]
+                setattr(self, name, new)
+        # Deletes leave the product grouping as it is
+        if n != self._size or kept is not None:
+            self._groups = None
+        self._codes, self._image_ids, self._product_ids = codes, image_ids, product_ids
+        self._size = n
+        dead = np.flatnonzero(image_ids < 0)
+        self._dead = dead if len(dead) else None
+        if n > start:
+            self._on_add(start, n, self.codec.decode(codes[start:n]))
+
+    def _mask_dead(self, rows, scores):
+        """Score deleted rows of attached storage -inf, so they never rank"""
+        if self._dead is not None:
+            if rows is None:
+                scores[self._dead] = -np.inf
+            else:
+                scores[self._image_ids[rows] < 0] = -np.inf
+        return scores
+
+    def vectors(self, rows=None):
+        """Decoded float32 vectors for the given rows (all rows when None)"""
+        codes = self._codes[:self._size] if rows is None else self._codes[rows]
+        return self.codec.decode(codes)
+
+    def exact_scores(self, query):
+        """Cosine similarity of the query against every row (vectors are normalized).
+
+        Exact with respect to the stored codes: lossy codecs score asymmetrically.
+        """
+        return self.codec.scores(query, self._codes[:self._size])
+
+    def candidates(self, query):
+        """Return (rows, scores) to rank; rows is None when every row was scored"""
+        return None, self.exact_scores(query)
+
+    def search(self, query, k=10):
+        """Top-k images as (image_ids, scores) arrays, best first"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = self.candidates(query)
+        scores = self._mask_dead(rows, scores)
+        top = top_k_rows(scores, k)
+        if self._dead is not None:
+            top = top[scores[top] > -np.inf]
+        if rows is not None:
+            top_ids = self._image_ids[rows[top]]
+        else:
+            top_ids = self._image_ids[top]
+        return top_ids, scores[top]
+
+    def search_products(self, query, top_k=5, min_score=None):
+        """Top-k products as (product_id, image_id, score), best first"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        n = self._size
+        if n == 0:
+            return []
+        rows, scores = self.candidates(query)
+        scores = self._mask_dead(rows, scores)
+        if rows is None:
+            if self._groups is None:
+                self._groups = group_by_product(self._product_ids[:n])
+            return top_products(scores, self._product_ids[:n], self._image_ids[:n], top_k, min_score, self._groups)
+        return top_products(scores, self._product_ids[rows], self._image_ids[rows], top_k, min_score)
+
+    def measure_recall(self, k=10, n_queries=50, seed=0):
+        """Estimate recall@k against exact search using perturbed catalog vectors"""
+        live = np.arange(self._size) if self._dead is None else np.setdiff1d(np.arange(self._size), self._dead)
+        if len(live) == 0:
+            return None
+        rng = np.random.default_rng(seed)
+        sample = rng.choice(live, size=min(n_queries, len(live)), replace=False)
+        # Nudge each query off its stored vector so it behaves like a new photo
+        queries = self.vectors(sample) + rng.normal(scale=0.5 / np.sqrt(self.dim), size=(len(sample), self.dim)).astype(np.float32)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+        hits = 0
+        total = 0
+        for query in queries:
+            exact_ids = self._image_ids[top_k_rows(self._mask_dead(None, self.exact_scores(query)), k)]
+            found_ids, _ = self.search(query, k)
+            hits += len(np.intersect1d(exact_ids, found_ids))
+            total += len(exact_ids)
+        self.recall_k = k
+        self.recall_at_k = hits / total if total else None
+        return self.recall_at_k
+
+    def train(self):
+        """Build any learned structure; returns True when something was trained"""
+        return False
+
+    def maybe_train(self):
+        """Train once enough rows have arrived incrementally"""
+        return False
+
+    def save(self, path):
+        """Persist learned state to disk"""
+        pass
+
+    def restore(self, path):
+        """Restore learned state saved by save(); returns True on success"""
+        return False
+
+    def stats(self):
+        return {
+            "backend": self.name,
+            "encoding": self.codec.name,
+            "size": len(self),
+            "bytes_per_vector": self.codec.code_size,
+            "memory_bytes": int(self._codes[:self._size].nbytes),
+            "recall_k": self.recall_k,
+            "recall_at_k": self.recall_at_k
+        }
+
+
+# ------------------------------------------------------
+# Exact Backend
+# ------------------------------------------------------
+class FlatIndex(SearchIndex):
+    """Brute-force cosine over every row: one matrix-vector product per query"""
+    name = "flat"
+
+    def measure_recall(self, k=10, n_queries=50, seed=0):
+        # Exact search is its own reference
+        self.recall_k = k
+        self.recall_at_k = 1.0
+        return self.recall_at_k
+
+
+# ------------------------------------------------------
+# IVF Backend
+# ------------------------------------------------------
+class IVFIndex(SearchIndex):
+    """Inverted-file index with a spherical k-means coarse quantizer.
+
+    Each row is assigned to its nearest centroid; a query only scores the rows
+    of its nprobe nearest lists. Until enough rows exist to train, it falls
+    back to exact search.
+    """
+    name = "ivf"
+    MIN_ROWS_PER_LIST = 8
+    TRAIN_SAMPLE = 50000
+
+    def __init__(self, dim=FEATURE_DIM, codec=None, nlist=0, nprobe=16, n_iter=10, seed=0):
+        super().__init__(dim, codec)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self._assign = np.empty(0, dtype=np.int32)
+        self._columns.append("_assign")
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def _target_nlist(self, n):
+        if self.nlist > 0:
+            return self.nlist
+        return int(min(4096, max(16, 4 * np.sqrt(n))))
+
+    def _nearest(self, vectors, centroids, chunk=16384):
+        """Index of the most similar centroid for each vector"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk):
+            labels[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+        return labels
+
+    def _kmeans(self, data, nlist):
+        rng = np.random.default_rng(self.seed)
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            labels = self._nearest(data, centroids)
+            order = np.argsort(labels, kind='stable')
+            used, starts = np.unique(labels[order], return_index=True)
+            sums = np.add.reduceat(data[order], starts, axis=0)
+            centroids[used] = sums
+            # Re-seed empty lists with random points
+            empty = np.setdiff1d(np.arange(nlist), used)
+            if len(empty):
+                centroids[empty] = data[rng.choice(len(data), size=len(empty), replace=False)]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            centroids /= np.maximum(norms, 1e-12)
+        return centroids
+
+    def train(self):
+        n = self._size
+        nlist = self._target_nlist(n)
+        if n < nlist * self.MIN_ROWS_PER_LIST:
+            return False
+        rng = np.random.default_rng(self.seed)
+        sample = rng.choice(n, size=min(n, max(self.TRAIN_SAMPLE, nlist * 32)), replace=False)
+        print(f"Training IVF index: {nlist} lists on {len(sample)} of {n} vectors...")
+        self.centroids = self._kmeans(self.vectors(np.sort(sample)), nlist)
+        for start in range(0, n, self.TRAIN_SAMPLE):
+            end = min(n, start + self.TRAIN_SAMPLE)
+            self._assign[start:end] = self._nearest(self.vectors(np.arange(start, end)), self.centroids)
+        return True
+
+    def _on_add(self, start, end, vectors):
+        if self.trained:
+            self._assign[start:end] = self._nearest(vectors, self.centroids)
+
+    def maybe_train(self):
+        if self.trained or self._size < self._target_nlist(self._size) * self.MIN_ROWS_PER_LIST:
+            return False
+        return self.train()
+
+    def candidates(self, query):
+        if not self.trained:
+            return super().candidates(query)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.flatnonzero(np.isin(self._assign[:self._size], probe))
+        return rows, self.codec.scores(query, self._codes[rows])
+
+    def save(self, path):
+        if not self.trained or not path:
+            return
+        # Per process, as server workers may save at the same time
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, image_ids=self._image_ids[:self._size],
+                     assign=self._assign[:self._size])
+        os.replace(tmp_path, path)
+
+    def restore(self, path):
+        if not path or not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as state:
+                centroids = state["centroids"]
+                saved_ids = state["image_ids"]
+                saved_assign = state["assign"]
+        except Exception as e:
+            print(f"Could not restore IVF index from {path}: {e}")
+            return False
+        if centroids.ndim != 2 or centroids.shape[1] != self.dim:
+            return False
+
+        self.centroids = centroids.astype(np.float32)
+        n = self._size
+        # Reuse saved list assignments by image id; assign rows added since the save
+        ids = self._image_ids[:n]
+        known = np.zeros(n, dtype=bool)
+        if len(saved_ids):
+            order = np.argsort(saved_ids)
+            sorted_ids = saved_ids[order]
+            pos = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+            known = sorted_ids[pos] == ids
+            self._assign[:n][known] = saved_assign[order[pos[known]]]
+        missing = np.flatnonzero(~known)
+        if len(missing):
+            self._assign[missing] = self._nearest(self.vectors(missing), self.centroids)
+        print(f"Restored IVF index from {path} ({len(self.centroids)} lists, {len(missing)} rows re-assigned).")
+        return True
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "trained": self.trained,
+            "nlist": len(self.centroids) if self.trained else self._target_nlist(self._size),
+            "nprobe": self.nprobe
+        })
+        return stats
+
+
+def create_index(backend, dim=FEATURE_DIM, codec=None, **options):
+    """Build a SearchIndex for a backend name ("flat" or "ivf")"""
+    if backend == "flat":
+        return FlatIndex(dim, codec)
+    if backend == "ivf":
+        return IVFIndex(dim, codec, nlist=options.get("nlist", 0), nprobe=options.get("nprobe", 16))
+    raise ValueError(f"Unknown search index backend: {backend}")
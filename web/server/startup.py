@@ -0,0 +1,52 @@
+import contextlib
+import threading
+import time
+
+# ------------------------------------------------------
+# Startup Phases
+# ------------------------------------------------------
+class Startup:
+    """Wall time of each startup phase, and readiness.
+
+    The server process records imports, DB init, model load, re-index catch-up and index load (and
+    anything else it times with phase()); mark_ready() flips ready once the model
+    and the vector index are loaded. Before that only the AI endpoints refuse.
+    """
+
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.perf_counter()
+        self.phases = {}
+        self.ready = threading.Event()
+        self.ready_after = None
+        self.error = None
+
+    def record(self, name, seconds):
+        self.phases[name] = seconds
+        print(f"Startup: {name} took {seconds:.2f}s")
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self):
+        self.ready_after = time.perf_counter() - self.started
+        self.ready.set()
+        print(f"Startup: ready {self.ready_after:.2f}s after start")
+
+    def fail(self, error):
+        self.error = str(error)
+        print(f"Startup failed: {error}")
+
+    def stats(self):
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "ready_after_seconds": round(self.ready_after, 3) if self.ready_after is not None else None,
+            "uptime_seconds": round(time.perf_counter() - self.started, 3)
+        }
@@ -0,0 +1,104 @@
+import argparse
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+import config
+
+# ------------------------------------------------------
+# Thumbnails
+# Derivatives of every stored image, named after the content hash of the uploaded
+# bytes, so a thumbnail URL never changes meaning and browsers may cache it forever.
+# ------------------------------------------------------
+THUMBNAIL_DIR = os.path.join(config.BASE_DIR, "uploads", "thumbs")
+THUMBNAIL_URL_DIR = "uploads/thumbs"
+# THUMBNAIL_FORMAT -> (PIL format, file extension)
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+def image_digest(image_data: bytes):
+    """Content hash of an uploaded image's bytes"""
+    return hashlib.blake2b(image_data, digest_size=16).hexdigest()
+
+def _thumbnail_name(digest, width):
+    return f"{digest}_{width}.{THUMBNAIL_FORMATS[config.THUMBNAIL_FORMAT][1]}"
+
+def thumbnail_paths(digest):
+    """Thumbnail paths of an image by width, relative to the server like image_path; {} without a digest"""
+    if not digest:
+        return {}
+    return {str(width): f"{THUMBNAIL_URL_DIR}/{_thumbnail_name(digest, width)}" for width in config.THUMBNAIL_WIDTHS}
+
+def save_thumbnails(img, digest):
+    """Write the THUMBNAIL_WIDTHS derivatives of a processed image (never upscaled).
+    Files that exist already were built from the same bytes and are kept."""
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    for width in config.THUMBNAIL_WIDTHS:
+        path = os.path.join(THUMBNAIL_DIR, _thumbnail_name(digest, width))
+        if os.path.exists(path):
+            continue
+        thumb = img
+        if img.width > width:
+            thumb = img.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        # Written aside and renamed, so a concurrent request never serves half a file
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        thumb.save(tmp_path, format=THUMBNAIL_FORMATS[config.THUMBNAIL_FORMAT][0], quality=config.THUMBNAIL_QUALITY)
+        os.replace(tmp_path, path)
+
+def remove_thumbnails(digest):
+    """Delete the thumbnails of an image no longer stored"""
+    for width in config.THUMBNAIL_WIDTHS:
+        path = os.path.join(THUMBNAIL_DIR, _thumbnail_name(digest, width))
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                print(f"Error deleting file {path}: {e}")
+
+# ------------------------------------------------------
+# Backfill
+# ------------------------------------------------------
+def _backfill_image(image_path):
+    """Hash a stored image and write its thumbnails, returning the hash (None if unreadable)"""
+    try:
+        with open(os.path.join(config.BASE_DIR, image_path), "rb") as f:
+            data = f.read()
+        digest = image_digest(data)
+        img = Image.open(io.BytesIO(data))
+        save_thumbnails(img if img.mode == "RGB" else img.convert("RGB"), digest)
+        return digest
+    except Exception as e:
+        print(f"Error backfilling thumbnails for {image_path}: {e}")
+        return None
+
+def backfill(db, workers=8, batch_size=500):
+    """Write thumbnails for images stored before they existed (content_hash is NULL).
+    Their hash is taken from the stored file, as the uploaded bytes are gone."""
+    done = failed = duplicates = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = db.get_images_without_hash(last_id, batch_size)
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            digests = list(pool.map(_backfill_image, [image_path for _, image_path in rows]))
+            hashes = [(digest, image_id) for (image_id, _), digest in zip(rows, digests) if digest]
+            duplicated = db.set_image_hashes(hashes)
+            done += len(hashes) - duplicated
+            duplicates += duplicated
+            failed += len(rows) - len(hashes)
+            print(f"{done} images backfilled, {failed} failed, {duplicates} left without a hash as copies "
+                  f"of another image of their product")
+
+if __name__ == "__main__":
+    from database import DBManager
+
+    parser = argparse.ArgumentParser(description="Write thumbnails for images stored before thumbnails existed")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    db = DBManager()
+    backfill(db, args.workers)
+    db.close()
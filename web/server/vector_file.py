@@ -0,0 +1,204 @@
+import os
+import struct
+import numpy as np
+
+# Both files start with a header naming the generation, dimension and model version of the rows
+MAGIC = b"GAIVEC1\0"
+HEADER = struct.Struct("<8sqq64s")
+HEADER_SIZE = 128
+# Id map row: (image_id, product_id); a deleted image's row keeps its product with image id TOMBSTONE
+ID_COLUMNS = 2
+TOMBSTONE = -1
+# Rows copied per write during compaction
+COPY_CHUNK = 65536
+
+def vector_file_paths(path):
+    """The vectors file and its id map"""
+    return path, path + ".ids"
+
+# ------------------------------------------------------
+# Memory-mapped Vector File
+# ------------------------------------------------------
+class VectorFile:
+    """Append-only float32 vectors on disk, memory-mapped, with a parallel id map.
+
+    <path> holds the (n, dim) float32 rows and <path>.ids their (image_id,
+    product_id) as int64. Rows are only ever appended; deleting an image
+    tombstones its row in place and compact() rewrites both files without the
+    tombstones, bumping the generation in their headers so a pair left half
+    replaced by a crash is detected. Every process mapping the file shares one
+    page-cache copy. Not thread-safe, the owning VectorStore serializes access.
+
+    Several processes may share the file: each opens, refreshes and writes it only
+    inside a SQLite write transaction, whose lock orders them, so refresh() catches
+    up with the others' rows before a write.
+    """
+
+    def __init__(self, path, dim, model_version):
+        self.path, self.ids_path = vector_file_paths(path)
+        self.dim = dim
+        self.model_version = model_version
+        self.generation = 0
+        self.rows = 0
+        self.dead = 0
+        self.vectors = None
+        self.ids = None
+        self._files = None
+
+    def _header(self, generation):
+        return HEADER.pack(MAGIC, generation, self.dim, self.model_version.encode("utf-8")).ljust(HEADER_SIZE, b"\0")
+
+    def _read_header(self, f):
+        data = f.read(HEADER_SIZE)
+        if len(data) < HEADER_SIZE:
+            return None
+        magic, generation, dim, version = HEADER.unpack(data[:HEADER.size])
+        if magic != MAGIC or dim != self.dim or version.rstrip(b"\0").decode("utf-8", "replace") != self.model_version:
+            return None
+        return generation
+
+    def _stored_generation(self):
+        """Generation of the files on disk, None unless both exist and match this model and each other"""
+        if not (os.path.exists(self.path) and os.path.exists(self.ids_path)):
+            return None
+        with open(self.path, "rb") as vectors, open(self.ids_path, "rb") as ids:
+            generation = self._read_header(vectors)
+            return generation if generation is not None and generation == self._read_header(ids) else None
+
+    def open(self):
+        """Open the files, or start empty ones when they are missing, of another model
+        version or out of step with each other. Returns True if existing rows were kept."""
+        generation = self._stored_generation()
+        kept = generation is not None
+        if kept:
+            self.generation = generation
+        else:
+            if os.path.exists(self.path):
+                print(f"Vector file {self.path} is incomplete or not of model version {self.model_version}, rebuilding it.")
+            self._write_empty()
+        self._files = (open(self.path, "r+b"), open(self.ids_path, "r+b"))
+        self.rows = self._stored_rows()
+        self._map()
+        self.dead = int(np.count_nonzero(self.ids[:, 0] == TOMBSTONE))
+        return kept
+
+    def _stored_rows(self):
+        """Complete rows on disk. An interrupted append leaves a partial row or vectors
+        without ids behind; the next append overwrites them."""
+        return min((os.fstat(self._files[0].fileno()).st_size - HEADER_SIZE) // (self.dim * 4),
+                   (os.fstat(self._files[1].fileno()).st_size - HEADER_SIZE) // (ID_COLUMNS * 8))
+
+    def refresh(self):
+        """Catch up with rows another process appended, tombstoned or compacted away.
+        Call it holding the SQLite write lock, like a write. Returns False when the files
+        were replaced by a compaction, renumbering the rows."""
+        if any(os.stat(path).st_ino != os.fstat(f.fileno()).st_ino for path, f in zip((self.path, self.ids_path), self._files)):
+            self.close()
+            self.open()
+            return False
+        rows = self._stored_rows()
+        if rows != self.rows:
+            self.rows = rows
+            self._map()
+        self.dead = int(np.count_nonzero(self.ids[:, 0] == TOMBSTONE))
+        return True
+
+    def reopen(self):
+        """Open descriptors of this process's own, e.g. after a fork"""
+        self.close()
+        self.open()
+
+    def _write_empty(self):
+        for path in (self.path, self.ids_path):
+            with open(path, "wb") as f:
+                f.write(self._header(self.generation))
+
+    def _map(self):
+        """(Re)map both files at their current row count"""
+        if self.rows == 0:
+            self.vectors = np.empty((0, self.dim), dtype=np.float32)
+            self.ids = np.empty((0, ID_COLUMNS), dtype=np.int64)
+            return
+        # Vectors are never written in place, only the id map (tombstones)
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r", offset=HEADER_SIZE, shape=(self.rows, self.dim))
+        self.ids = np.memmap(self.ids_path, dtype=np.int64, mode="r+", offset=HEADER_SIZE, shape=(self.rows, ID_COLUMNS))
+
+    def close(self):
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+        self.vectors = self.ids = None
+
+    def append(self, image_ids, product_ids, vectors):
+        """Append rows; vectors is an (n, dim) array"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) == 0:
+            return
+        ids = np.empty((len(vectors), ID_COLUMNS), dtype=np.int64)
+        ids[:, 0] = image_ids
+        ids[:, 1] = product_ids
+        # Vectors first: a row counts once its ids are written
+        for f, data, size in zip(self._files, (vectors, ids), (self.dim * 4, ID_COLUMNS * 8)):
+            f.seek(HEADER_SIZE + self.rows * size)
+            f.write(data.tobytes())
+            f.flush()
+        self.rows += len(vectors)
+        self._map()
+
+    def _tombstone(self, mask):
+        rows = np.flatnonzero(mask & (self.ids[:, 0] != TOMBSTONE))
+        self.ids[rows, 0] = TOMBSTONE
+        self.dead += len(rows)
+        return len(rows)
+
+    def remove_rows(self, rows):
+        """Tombstone rows by position"""
+        mask = np.zeros(self.rows, dtype=bool)
+        mask[rows] = True
+        return self._tombstone(mask)
+
+    def remove_images(self, image_ids):
+        """Tombstone the rows of the given image ids"""
+        return self._tombstone(np.isin(self.ids[:, 0], np.asarray(image_ids, dtype=np.int64)))
+
+    def remove_products(self, product_ids):
+        """Tombstone the rows of every image of the given products"""
+        return self._tombstone(np.isin(self.ids[:, 1], np.asarray(product_ids, dtype=np.int64)))
+
+    def live_rows(self):
+        """Positions of the rows not tombstoned"""
+        return np.flatnonzero(self.ids[:, 0] != TOMBSTONE)
+
+    def needs_compaction(self, ratio):
+        return self.dead > 0 and self.dead >= ratio * self.rows
+
+    def compact(self):
+        """Rewrite both files without tombstoned rows. Returns the positions, before
+        compaction, of the rows kept, in their new order."""
+        kept = self.live_rows()
+        generation = self.generation + 1
+        for path, column in ((self.path, self.vectors), (self.ids_path, self.ids)):
+            with open(path + ".tmp", "wb") as f:
+                f.write(self._header(generation))
+                for start in range(0, len(kept), COPY_CHUNK):
+                    f.write(np.ascontiguousarray(column[kept[start:start + COPY_CHUNK]]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self.close()
+        # A crash between the two replaces leaves generations that differ: open() rebuilds
+        os.replace(self.path + ".tmp", self.path)
+        os.replace(self.ids_path + ".tmp", self.ids_path)
+        print(f"Compacted vector file {self.path}: {self.rows - len(kept)} deleted rows dropped, {len(kept)} kept.")
+        self.generation = generation
+        self.open()
+        return kept
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "rows": self.rows,
+            "deleted_rows": self.dead,
+            "generation": self.generation,
+            "bytes": HEADER_SIZE * 2 + self.rows * (self.dim * 4 + ID_COLUMNS * 8)
+        }
@@ -0,0 +1,333 @@
+import contextlib
+import threading
+import numpy as np
+
+import config
+from quantization import Float16Codec, PQCodec, create_codec
+from search_index import FEATURE_DIM, create_index, top_products
+from vector_file import TOMBSTONE, VectorFile
+
+# Vectors used to train a PQ codebook when none is saved yet
+PQ_TRAIN_SAMPLE = 65536
+# Images read from SQLite per query when the vector file lacks them (or another
+# process added them), and rows encoded per step when a lossy index loads from the file
+VECTOR_FILE_SYNC_CHUNK = 500
+VECTOR_FILE_LOAD_CHUNK = 65536
+
+def rows_to_arrays(rows, dim=FEATURE_DIM):
+    """Turn (image_id, product_id, float32 blob) rows into id arrays and an (n, dim) matrix"""
+    expected = dim * 4
+    rows = [r for r in rows if r[2] is not None and len(r[2]) == expected]
+    image_ids = np.array([r[0] for r in rows], dtype=np.int64)
+    product_ids = np.array([r[1] for r in rows], dtype=np.int64)
+    vectors = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32).reshape(-1, dim)
+    return image_ids, product_ids, vectors
+
+# ------------------------------------------------------
+# Resident Vector Store
+# ------------------------------------------------------
+class VectorStore:
+    """In-memory image vectors kept in sync with product_images.
+
+    Storage and search are delegated to a SearchIndex backend (config.SEARCH_INDEX)
+    holding codes of config.VECTOR_ENCODING. This class loads it from the
+    database, persists learned state, re-ranks lossy results with the exact
+    vectors and serializes access across request threads.
+
+    With a vector file (config.VECTOR_FILE_PATH), every write also goes to the
+    file and startup reads it instead of SQLite, appending what it lacks. A
+    float32 index is attached to the mapped file rather than holding a copy.
+    """
+
+    def __init__(self, backend=None, encoding=None, dim=FEATURE_DIM, index_path=None, codebook_path=None, rerank=None,
+                 vector_file_path=None):
+        self.dim = dim
+        self.lock = threading.Lock()
+        self.backend = backend or config.SEARCH_INDEX
+        self.index_path = index_path if index_path is not None else config.SEARCH_INDEX_PATH
+        self.codebook_path = codebook_path if codebook_path is not None else config.PQ_CODEBOOK_PATH
+        self.rerank = config.RERANK_CANDIDATES if rerank is None else rerank
+        self.vector_file_path = vector_file_path if vector_file_path is not None else config.VECTOR_FILE_PATH
+        self.encoding = encoding or config.VECTOR_ENCODING
+        self.codec = create_codec(self.encoding, dim, pq_subspaces=config.PQ_SUBSPACES)
+        self.index = self._create_index(self.codec)
+        # Set by load(); the source of exact vectors for re-ranking
+        self.db = None
+        # Set by load() when vector_file_path is configured
+        self.file = None
+
+    def _create_index(self, codec):
+        return create_index(self.backend, self.dim, codec=codec,
+                            nlist=config.IVF_NLIST, nprobe=config.IVF_NPROBE)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def mapped(self):
+        """Whether the index searches the vector file in place"""
+        return self.file is not None and self.codec.name == "float32"
+
+    def _prepare_codec(self, db):
+        """A new codec of the configured encoding, its PQ codebook restored or trained"""
+        codec = create_codec(self.encoding, self.dim, pq_subspaces=config.PQ_SUBSPACES)
+        if codec.trained or codec.restore(self.codebook_path):
+            return codec
+        batches = []
+        count = 0
+        for rows in db.iter_vector_rows():
+            _, _, vectors = rows_to_arrays(rows, self.dim)
+            batches.append(vectors)
+            count += len(vectors)
+            if count >= PQ_TRAIN_SAMPLE:
+                break
+        if count < PQCodec.N_CENTROIDS:
+            print(f"Only {count} vectors available to train the PQ codebook, falling back to float16.")
+            return Float16Codec(self.dim)
+        codec.train(np.concatenate(batches))
+        codec.save(self.codebook_path)
+        return codec
+
+    def _sync_file(self, db):
+        """Bring the vector file in line with product_images: tombstone the rows of images
+        deleted meanwhile (e.g. by the TS server, or before a crash) and append the missing"""
+        file = self.file
+        db_ids, db_pids = db.get_vector_ids()
+        rows = file.live_rows()
+        file_ids = file.ids[rows, 0]
+        pos = np.minimum(np.searchsorted(db_ids, file_ids), max(len(db_ids) - 1, 0))
+        found = (db_ids[pos] == file_ids) & (db_pids[pos] == file.ids[rows, 1]) if len(db_ids) else np.zeros(len(rows), dtype=bool)
+        removed = file.remove_rows(rows[~found])
+        present = np.zeros(len(db_ids), dtype=bool)
+        present[pos[found]] = True
+        missing = db_ids[~present]
+        if len(missing) == len(db_ids):
+            # Nothing to keep: one pass over the table beats lookups by id
+            batches = db.iter_vector_rows()
+        else:
+            batches = (db.get_vectors_by_image_ids(missing[i:i + VECTOR_FILE_SYNC_CHUNK].tolist())
+                       for i in range(0, len(missing), VECTOR_FILE_SYNC_CHUNK))
+        added = 0
+        for batch in batches:
+            image_ids, product_ids, vectors = rows_to_arrays(batch, self.dim)
+            file.append(image_ids, product_ids, vectors)
+            added += len(vectors)
+        if removed or added:
+            print(f"Vector file {file.path} synced with the database: {added} vectors appended, {removed} removed.")
+
+    def _attach(self, kept=None):
+        self.index.attach(self.file.ids[:, 0], self.file.ids[:, 1], self.codec.encode(self.file.vectors), kept)
+
+    def _catch_up(self):
+        """Take in vector file writes of other processes: before writing it, and to apply them"""
+        same_rows = self.file.refresh()
+        if self.mapped:
+            # A compaction renumbered the rows: re-index them all
+            self._attach(None if same_rows else np.empty(0, dtype=np.int64))
+
+    def _compact_file(self):
+        """Rewrite the vector file without its deleted rows once they pass the configured share,
+        after a delete"""
+        if not self.file.needs_compaction(config.VECTOR_FILE_COMPACT_RATIO):
+            return
+        kept = self.file.compact()
+        if self.mapped:
+            self._attach(kept)
+
+    def _build_index(self, db, snapshot):
+        """A new index holding every stored vector, from the vector file rows in snapshot
+        (an (ids, vectors) pair) or the database. Touches no state of the store, so it
+        runs without the locks. Returns it and whether its ANN structure needs saving."""
+        codec = self._prepare_codec(db)
+        index = self._create_index(codec)
+        if snapshot is not None:
+            ids, vectors = snapshot
+            if codec.name == "float32":
+                # Re-attached to the mapped file once in place
+                index.attach(ids[:, 0], ids[:, 1], codec.encode(vectors))
+            else:
+                rows = np.flatnonzero(ids[:, 0] != TOMBSTONE)
+                for start in range(0, len(rows), VECTOR_FILE_LOAD_CHUNK):
+                    chunk = rows[start:start + VECTOR_FILE_LOAD_CHUNK]
+                    index.add(ids[chunk, 0], ids[chunk, 1], vectors[chunk])
+        else:
+            for rows in db.iter_vector_rows():
+                image_ids, product_ids, vectors = rows_to_arrays(rows, self.dim)
+                index.add(image_ids, product_ids, vectors)
+
+        # Reuse the persisted ANN structure, or train one and save it for the next start
+        trained = not index.restore(self.index_path) and index.train()
+        index.measure_recall()
+        return index, trained
+
+    def _catch_up_index(self, db, renumbered):
+        """Bring an index built from a snapshot up to date with the writes made since,
+        holding the locks. renumbered: the vector file was compacted meanwhile."""
+        if self.mapped:
+            self._attach(np.empty(0, dtype=np.int64) if renumbered else None)
+            return
+        if self.file is not None:
+            rows = self.file.live_rows()
+            stored = self.file.ids[rows, 0]
+        else:
+            stored, _ = db.get_vector_ids()
+        indexed = self.index.image_ids()
+        removed = np.setdiff1d(indexed, stored)
+        if len(removed):
+            self.index.remove_images(removed)
+        missing = np.setdiff1d(stored, indexed)
+        if self.file is not None:
+            chunk = rows[np.isin(stored, missing)]
+            self.index.add(self.file.ids[chunk, 0], self.file.ids[chunk, 1], self.file.vectors[chunk])
+        else:
+            for i in range(0, len(missing), VECTOR_FILE_SYNC_CHUNK):
+                rows = db.get_vectors_by_image_ids(missing[i:i + VECTOR_FILE_SYNC_CHUNK].tolist())
+                self.index.add(*rows_to_arrays(rows, self.dim))
+
+    def _load(self, db):
+        """Build a new index from the stored vectors and swap it in. The locks are only held
+        to sync the vector file and to swap; writes made while the index builds (deletes, or
+        other processes' changes) are applied to it before it serves."""
+        snapshot = generation = None
+        if self.vector_file_path:
+            # SQLite's write lock keeps other processes from writing the vector file meanwhile
+            with db.write(immediate=True), self.lock:
+                if self.file is None:
+                    self.file = VectorFile(self.vector_file_path, self.dim, config.MODEL_VERSION)
+                else:
+                    self.file.close()
+                self.file.open()
+                self._sync_file(db)
+                if self.file.needs_compaction(config.VECTOR_FILE_COMPACT_RATIO):
+                    self.file.compact()
+                # Vectors are never written in place, only tombstones: copy the ids alone
+                snapshot = (np.array(self.file.ids), self.file.vectors)
+                generation = self.file.generation
+
+        index, trained = self._build_index(db, snapshot)
+
+        # With no writer midway through a transaction, what is stored now is what the index must hold
+        with db.write(immediate=True) if self.file is not None else db.write(), self.lock:
+            renumbered = False
+            if self.file is not None:
+                self.file.refresh()
+                renumbered = self.file.generation != generation
+            self.codec, self.index = index.codec, index
+            self._catch_up_index(db, renumbered)
+            if trained or self.index.maybe_train():
+                self.index.save(self.index_path)
+
+    def load(self, db):
+        """Load every stored vector from the vector file or the database (called once at startup)"""
+        self.db = db
+        self._load(db)
+        print(f"Loaded {len(self.index)} vectors into {self.index.name} index ({self.codec.name}).")
+
+    def reload(self, db):
+        """Start over from the stored vectors, e.g. after another process switched them all to a new model"""
+        self._load(db)
+        print(f"Reloaded {len(self.index)} vectors into {self.index.name} index ({self.codec.name}).")
+
+    def apply_changes(self, db, added, removed_images, removed_products):
+        """Apply image writes committed by another process (see DBManager.sync_catalog())"""
+        # Holding SQLite's write lock, no other process is midway through rewriting the vector file
+        with db.write(immediate=True) if self.file is not None else contextlib.nullcontext(), self.lock:
+            if self.mapped:
+                # Their rows and tombstones are in the shared file already
+                self._catch_up()
+            else:
+                if removed_images:
+                    self.index.remove_images(removed_images)
+                if removed_products:
+                    self.index.remove_products(removed_products)
+                # Read back rather than trust the log: the image may be gone by now
+                added = np.unique(np.asarray(added, dtype=np.int64))
+                # A load finished since they were logged may hold them already
+                added = added[~np.isin(added, self.index.image_ids())]
+                for i in range(0, len(added), VECTOR_FILE_SYNC_CHUNK):
+                    rows = db.get_vectors_by_image_ids(added[i:i + VECTOR_FILE_SYNC_CHUNK].tolist())
+                    self.index.add(*rows_to_arrays(rows, self.dim))
+            if self.index.maybe_train():
+                self.index.save(self.index_path)
+
+    def after_fork(self):
+        """In a server worker forked after load(): give the vector file descriptors of its own,
+        as the inherited ones share their file offsets with the siblings"""
+        if self.file is not None:
+            with self.db.write(immediate=True), self.lock:
+                self.file.reopen()
+                if self.mapped:
+                    self._attach()
+
+    def save(self):
+        """Persist learned index state next to the database"""
+        with self.lock:
+            self.index.save(self.index_path)
+
+    def add(self, image_id, product_id, vector):
+        """Append one image vector"""
+        self.add_batch([image_id], [product_id], vector)
+
+    def add_batch(self, image_ids, product_ids, vectors):
+        """Append many image vectors, an (n, dim) array"""
+        with self.lock:
+            if self.file is not None:
+                self._catch_up()
+                self.file.append(image_ids, product_ids, vectors)
+            if self.mapped:
+                self._attach()
+            else:
+                self.index.add(image_ids, product_ids, vectors)
+            if self.index.maybe_train():
+                self.index.save(self.index_path)
+
+    def remove_images(self, image_ids):
+        """Remove vectors for the given image ids"""
+        with self.lock:
+            return self._remove(lambda store: store.remove_images(image_ids))
+
+    def remove_products(self, product_ids):
+        """Remove vectors for every image of the given products"""
+        with self.lock:
+            return self._remove(lambda store: store.remove_products(product_ids))
+
+    def _remove(self, remove):
+        """Apply remove to the vector file and the index; returns how many rows went"""
+        if self.file is None:
+            return remove(self.index)
+        self._catch_up()
+        removed = remove(self.file)
+        if self.mapped:
+            self._attach()
+        else:
+            remove(self.index)
+        self._compact_file()
+        return removed
+
+    def search(self, query, k=100):
+        """Return the top-k (image_id, score) hits, best first"""
+        with self.lock:
+            image_ids, scores = self.index.search(query, k)
+        return [(int(i), float(s)) for i, s in zip(image_ids, scores)]
+
+    def search_products(self, query, top_k=5, min_score=None):
+        """Return the top-k (product_id, image_id, score), best first"""
+        if not self.codec.lossy or self.rerank <= 0 or self.db is None:
+            with self.lock:
+                return self.index.search_products(query, top_k, min_score)
+
+        # Shortlist on the compressed codes, then re-score it with the exact float32 vectors
+        with self.lock:
+            shortlist, _ = self.index.search(query, max(self.rerank, top_k * 10))
+        rows = self.db.get_vectors_by_image_ids([int(i) for i in shortlist])
+        image_ids, product_ids, vectors = rows_to_arrays(rows, self.dim)
+        scores = vectors @ np.asarray(query, dtype=np.float32).reshape(self.dim)
+        return top_products(scores, product_ids, image_ids, top_k, min_score)
+
+    def stats(self):
+        with self.lock:
+            stats = self.index.stats()
+            if self.file is not None:
+                stats["vector_file"] = dict(self.file.stats(), mapped=self.mapped)
+        stats["rerank_candidates"] = self.rerank if self.codec.lossy else 0
+        return stats
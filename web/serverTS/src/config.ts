@@ -6,6 +6,9 @@ export const CONFIG = {
     DB_PATH: path.resolve(__dirname, '../../server/goods.db'),
     UPLOAD_DIR: path.resolve(__dirname, '../../server/uploads'),
     MODEL_PATH: path.resolve(__dirname, '../model.onnx'),
+    // Stored with every vector (product_images.model_version); keep it equal to the Python server's
+    // GOODSAI_MODEL_VERSION while model.onnx is the export of its model
+    MODEL_VERSION: process.env.GOODSAI_MODEL_VERSION || "mobilenet_v3_small-1",
     JWT_SECRET: "goodsai_secret_key_change_me_in_production", // Matches python version
     JWT_ALGORITHM: "HS256"
 };
@@ -100,6 +100,13 @@ export class DBManager {
             // Column likely exists
         }
 
+        // Model version of each vector, normally added by the Python server's migrations
+        try {
+            await this.run("ALTER TABLE product_images ADD COLUMN model_version TEXT");
+        } catch (e) {
+            // Column likely exists
+        }
+
         // Seed Admin
         const admin = await this.get("SELECT id FROM users WHERE username='admin'");
         if (!admin) {
@@ -194,8 +201,8 @@ export class DBManager {
         }
 
         return this.runInsert(
-            "INSERT INTO product_images (product_id, image_path, feature_vector, display_order) VALUES (?, ?, ?, ?)",
-            [productId, imagePath, buffer, displayOrder]
+            "INSERT INTO product_images (product_id, image_path, feature_vector, display_order, model_version) VALUES (?, ?, ?, ?, ?)",
+            [productId, imagePath, buffer, displayOrder, CONFIG.MODEL_VERSION]
         );
     }
 
@@ -281,7 +288,7 @@ export class DBManager {
 
     async updateFeatureVector(imageId: number, vector: Float32Array): Promise<void> {
         const buffer = Buffer.from(vector.buffer);
-        return this.run("UPDATE product_images SET feature_vector=? WHERE id=?", [buffer, imageId]);
+        return this.run("UPDATE product_images SET feature_vector=?, model_version=? WHERE id=?", [buffer, CONFIG.MODEL_VERSION, imageId]);
     }
 
     async getAllVectors(): Promise<any[]> {